@@ -0,0 +1,30 @@
+"""
+Thread affinity for running several API workers.
+
+Per-thread state (the turn queue in turn_scheduler.py, the message store index, turns
+buffered by "batched" durability) lives in one process, so every request of a thread
+must reach the same worker. `HashRing` maps a thread_id to a worker by consistent
+hashing: adding or removing a worker only moves about 1/N of the threads.
+"""
+import bisect
+import hashlib
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+
+    def __init__(self, nodes, replicas: int = 100):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        self.replicas = replicas
+        ring = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._points = [p for p, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def node_for(self, key: str):
+        i = bisect.bisect(self._points, _point(str(key)))
+        return self._owners[i % len(self._owners)]
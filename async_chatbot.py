@@ -1,101 +1,177 @@
+"""
+Graph for the FastAPI backend (main.py).
+
+Importing this module is cheap: LangGraph, the OpenAI client, DuckDuckGo and the MCP
+adapters are imported by `build_graph()` (see `preload()`), so the app can open the
+checkpointer and serve /threads and /conversations while the graph is still being built.
+Compiled graphs are cached per tool set and checkpointer, so rebuilding after an MCP
+tool refresh that changed nothing reuses the compiled graph.
+"""
+import asyncio
+import importlib
+import os
 from typing import TypedDict, Annotated, List
 
-from langgraph.graph.message import add_messages
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-from langchain_openai import ChatOpenAI
-import os
+from langchain_core.messages import BaseMessage
 from dotenv import load_dotenv
-import sqlite3
-from langchain.tools import tool
-from langgraph.prebuilt import ToolNode, tools_condition
-from langchain_community.tools import DuckDuckGoSearchResults
-import aiosqlite
-from langchain_mcp_adapters.client import MultiServerMCPClient
+
+from checkpointers import open_checkpointer
+from history import HistoryManager
+from mcp_pool import McpSessionPool
+from prompt_cache import PromptCacheStats, PromptPrefix
+from tool_cache import tool_cache
+from tool_executor import ToolExecutor
 
 load_dotenv()
 
-    
-llm = ChatOpenAI(model="gpt-4o-mini")
+# modules `build_graph` needs; `preload` imports them off the event loop
+GRAPH_MODULES = (
+    "langgraph.graph",
+    "langgraph.prebuilt",
+    "langchain_openai",
+    "langchain_community.tools",
+    "langchain_mcp_adapters.tools",
+    "llm_cache",
+    "model_router",
+)
+
+# created on first use by `build_graph`; set them beforehand to use other ones
+llm = None
+search_tool = None
 
 
-client = MultiServerMCPClient(
+# long-lived MCP sessions; tool schemas come from the on-disk cache (see mcp_pool.py)
+mcp_pool = McpSessionPool(
     {
         "PersonaTracker": {
             "transport": "streamable_http",
-            "url": "http://127.0.0.1:8000/mcp"
+            "url": os.getenv("PERSONA_TRACKER_MCP_URL", "http://127.0.0.1:8000/mcp"),
         }
     }
 )
 
 
-search_tool = DuckDuckGoSearchResults()
+def make_llm():
+    from llm_cache import cached
+    from model_router import routed_chat_model
 
+    # MODEL_HEDGE / MODEL_CHEAP add hedging and cheap-model routing (see model_router.py)
+    return cached(routed_chat_model())
 
 
+def make_search_tool():
+    from langchain_community.tools import DuckDuckGoSearchResults
+    from tool_cache import cacheable, text_key
 
+    # near-identical queries within TOOL_CACHE_SEARCH_TTL seconds share one live search
+    return cacheable(
+        DuckDuckGoSearchResults(),
+        ttl=float(os.getenv("TOOL_CACHE_SEARCH_TTL", "600")),
+        key=text_key,
+    )
 
-class ChatState(TypedDict):
-    messages: Annotated[List[BaseMessage], add_messages]
 
-async def build_graph():
-    
-    mcp_tools = await client.get_tools()
-    
-    tools = [search_tool, *mcp_tools]
-    
-    llm_with_tools = llm.bind_tools(tools)
-    
-    async_conn = await aiosqlite.connect("new_chatbot.db")
-    
-    # Async checkpointer
-    checkpointer = AsyncSqliteSaver(conn= async_conn)
+SYSTEM_PROMPT = """
+You are a helpful personal assistant. Always check current date and time before answering questions.
+Use the tools available to you to answer user queries.
+
+Tasks you can help with:
+1. Managing personal notes.
+2. Managing personal tasks.
+3. Managing reminders using google calendar.
+
+NOTE: Always check the schema structure if available if you want to make any create or update operations to the database.
+      Always try to fill optional fields if possible while creating entries.
+"""
+
+history = HistoryManager.from_env()
+
+# cached input tokens reported by the model (see prompt_cache.py)
+prompt_cache = PromptCacheStats()
+
+# runs the tool calls of a turn concurrently, with per-tool timeouts (see tool_executor.py)
+tool_executor = ToolExecutor(cache=tool_cache())
+
+# (tools hash, id(checkpointer)) -> compiled graph
+_compiled = {}
+
+
+async def preload():
+    """Import the graph's dependencies in a worker thread, so the event loop keeps serving."""
+    for name in GRAPH_MODULES:
+        await asyncio.to_thread(importlib.import_module, name)
+
+
+def compile_graph(tools, checkpointer):
+    from langgraph.graph import StateGraph
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import tools_condition
+    from llm_cache import tools_hash
+
+    global llm
+    key = (tools_hash(tools), id(checkpointer))
+    if key in _compiled:
+        return _compiled[key]
+
+    if llm is None:
+        llm = make_llm()
+    model = llm
+    # system prompt and tool schemas built once, so every call sends the same bytes first
+    prefix = PromptPrefix(SYSTEM_PROMPT, tools)
+    llm_with_tools = model.bind_tools(prefix.tools)
+    by_name = {tool.name: tool for tool in tools}
+
+    class ChatState(TypedDict):
+        messages: Annotated[List[BaseMessage], add_messages]
+        # rolling summary of the turns before messages[summarized_count:] (see history.py)
+        summary: str
+        summarized_count: int
 
     graph = StateGraph(ChatState)
-    
+
     async def chat_node(state: ChatState) -> ChatState:
-        messages = state["messages"]
-        system_prompt = """
-        You are a helpful personal assistant. Always check current date and time before answering questions.
-        Use the tools available to you to answer user queries.
-        
-        Tasks you can help with:
-        1. Managing personal notes.
-        2. Managing personal tasks.
-        3. Managing reminders using google calendar.
-        
-        NOTE: Always check the schema structure if available if you want to make any create or update operations to the database.
-              Always try to fill optional fields if possible while creating entries.
-        """
-        response = await llm_with_tools.ainvoke(
-            [
-                SystemMessage(content=system_prompt),
-            ] 
-            +
-            messages
-            )
+        # read-only tool calls start while the reply is still streaming (see tool_executor.py)
+        response = await tool_executor.astream(llm_with_tools, history.select(state, prefix.system_message), by_name)
+        prompt_cache.observe(response, prefix)
         return {"messages": [response]}
 
+    graph.add_node("compact_history", history.anode(model))
     graph.add_node("chat_node", chat_node)
-    graph.add_node("tools", ToolNode(tools))
-    graph.set_entry_point("chat_node")
+    graph.add_node("tools", tool_executor.node(tools))
+    graph.set_entry_point("compact_history")
+    graph.add_edge("compact_history", "chat_node")
     graph.add_conditional_edges("chat_node", tools_condition)
     graph.add_edge("tools", "chat_node")
 
+    chatbot = graph.compile(checkpointer=checkpointer)
+    _compiled[key] = chatbot
+    return chatbot
+
+
+async def build_graph(checkpointer=None):
+    """
+    The compiled graph and its checkpointer. Pass an already opened checkpointer to
+    build the graph for it; by default one is opened from the environment.
+    """
+    global search_tool
+    await preload()
+    if checkpointer is None:
+        # sqlite (default), postgres or memory, picked by CHECKPOINT_BACKEND (see checkpointers.py)
+        checkpointer = await open_checkpointer()
+
+    mcp_tools = await mcp_pool.get_tools()
+    if search_tool is None:
+        search_tool = make_search_tool()
+    tools = [search_tool, *mcp_tools]
 
-    
-    
+    chatbot = compile_graph(tools, checkpointer)
 
-    chatbot = graph.compile(checkpointer=checkpointer)
-    
     return chatbot , checkpointer
 
 
-async def retrieve_all_threads(checkpointer: AsyncSqliteSaver):
-    threads = []
-    async for cp in checkpointer.alist(None):
-        tid = cp.config["configurable"]["thread_id"]
-        if tid not in threads:
-            threads.append(tid)
-    return threads[::-1]
\ No newline at end of file
+async def retrieve_all_threads(checkpointer, limit=None, after=None):
+    """
+    One page of threads from the catalog, most recently updated first.
+    Returns (threads, next_cursor); pass next_cursor back as `after` for the next page.
+    """
+    return await checkpointer.alist_threads(limit=limit, after=after)
@@ -0,0 +1,516 @@
+"""
+Batch (offline) turns: replay or bulk-run prompts through the compiled graph.
+
+The input is a JSONL file of jobs, one per line:
+
+    {"thread_id": "eval-17", "message": "What is on my calendar tomorrow?", "id": "q17"}
+
+`id` is optional (default: the line number). Jobs of one thread run one after another,
+in file order, since each turn sees the previous ones; different threads run
+concurrently, at most `concurrency` at a time, through the turn scheduler like /chat
+turns. Each finished job appends one line to the output JSONL:
+
+    {"id", "thread_id", "status": "ok" | "error", "reply", "error", "model",
+     "input_tokens", "output_tokens", "seconds"}
+
+The output file is also the progress record: rerunning a batch with the same output
+skips the jobs already "ok" there. Each job's message is stored with the id
+`batch:{batch_id}:{job_id}`, so a job whose turn was checkpointed but not written to the
+output (the run stopped in between) is recovered from the thread instead of being sent
+twice, and one stopped in the middle of its turn is resumed from its last checkpoint.
+A run holds an exclusive lock on its output file (flock, POSIX only), so the same batch
+cannot run twice at once, from another task or another process.
+
+Upstream quotas: `ModelLimits` keeps the requests and tokens each model (by the
+`model_name` the responses report) used in the last minute and holds new jobs back
+while a model is over its requests/tokens per minute. A rate-limited call (HTTP 429)
+pauses every worker for an exponential backoff before the job is retried.
+
+From the command line, with the graph and checkpointer of async_chatbot.py:
+
+    python batch_runner.py jobs.jsonl results.jsonl --concurrency 8 --rpm 500 --tpm 200000
+
+and in main.py as POST /batch (see `BatchManager`). Behind router.py, every /batch
+request of a batch goes to the worker that owns the batch id. The batch's turns run on
+that worker, not on each thread's owner: they bypass the owner's per-thread turn queue
+and its batched-durability buffer (see affinity.py). With several workers, use threads
+for batches that no /chat request uses while the batch runs, or run batches on a
+single-worker deployment. Configured by:
+
+    BATCH_DIR=batches          input and output files of /batch runs
+    BATCH_CONCURRENCY=8
+    BATCH_RPM=0                requests per minute per model (0: no limit)
+    BATCH_TPM=0                tokens per minute per model (0: no limit)
+    BATCH_RETRIES=3            retries of a rate-limited job
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from metrics import Histogram
+from turn_scheduler import SchedulerFull, turn_scheduler
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are not locked against each other
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 60.0
+
+
+# ---------------------------- Jobs ----------------------------
+
+def parse_jobs(lines) -> list[dict]:
+    """Jobs from JSONL lines; raises ValueError naming the first bad line."""
+    jobs, seen = [], set()
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+        if not isinstance(item, dict) or not item.get("thread_id") or not isinstance(item.get("message"), str):
+            raise ValueError(f"line {number}: expected an object with thread_id and message")
+        job_id = str(item.get("id", number))
+        if job_id in seen:
+            raise ValueError(f"line {number}: duplicate id {job_id!r}")
+        seen.add(job_id)
+        jobs.append({"id": job_id, "thread_id": str(item["thread_id"]), "message": item["message"]})
+    return jobs
+
+
+def read_jobs(path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return parse_jobs(f)
+
+
+class BatchLocked(RuntimeError):
+    """The output file is locked by another run of the same batch."""
+
+
+def _lock(f, path):
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise BatchLocked(f"{path} is in use by another run of this batch") from None
+
+
+def output_locked(output_path) -> bool:
+    """True while a run (in any process) holds the lock on `output_path`."""
+    if fcntl is None or not os.path.exists(output_path):
+        return False
+    with open(output_path, "a", encoding="utf-8") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+
+def completed_ids(output_path) -> set:
+    """Ids of the jobs already "ok" in an output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # a line cut short when the previous run stopped
+                continue
+            if item.get("status") == "ok":
+                done.add(str(item["id"]))
+    return done
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    if isinstance(error, SchedulerFull):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+# ---------------------------- Rate limits ----------------------------
+
+class ModelLimits:
+    """
+    Requests and tokens per model over the last minute, against per-model limits
+    (`limits`: model name -> (rpm, tpm), 0 for none; `default` for other models).
+    """
+
+    def __init__(self, default=(0, 0), limits: dict | None = None):
+        self.default = default
+        self.limits = dict(limits or {})
+        self._usage: dict[str, deque] = {}
+        self.paused_until = 0.0
+        self.waited = 0.0
+
+    def record(self, model: str, requests: int, tokens: int):
+        self._usage.setdefault(model, deque()).append((time.monotonic(), requests, tokens))
+
+    def pause(self, seconds: float):
+        """Hold every worker back for `seconds` (after a 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        delay = self.paused_until - now
+        for model, events in self._usage.items():
+            while events and events[0][0] <= now - WINDOW_SECONDS:
+                events.popleft()
+            rpm, tpm = self.limits.get(model, self.default)
+            for limit, index in ((rpm, 1), (tpm, 2)):
+                if not limit:
+                    continue
+                used = sum(e[index] for e in events)
+                # wait until enough of the window has expired to be back under the limit
+                for t, *amounts in events:
+                    if used < limit:
+                        break
+                    used -= amounts[index - 1]
+                    delay = max(delay, t + WINDOW_SECONDS - now)
+        return delay
+
+    async def wait(self):
+        while (delay := self._delay()) > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def usage(self):
+        now = time.monotonic()
+        return {
+            model: {
+                "requests_last_minute": sum(e[1] for e in events if e[0] > now - WINDOW_SECONDS),
+                "tokens_last_minute": sum(e[2] for e in events if e[0] > now - WINDOW_SECONDS),
+            }
+            for model, events in self._usage.items()
+        }
+
+
+# ---------------------------- Stats ----------------------------
+
+class BatchStats:
+    def __init__(self, total: int = 0, skipped: int = 0):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.errors = 0
+        self.recovered = 0
+        self.resumed = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.error_types: dict[str, int] = {}
+        self.latency = Histogram()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        done = self.ok + self.errors
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "done": done,
+            "ok": self.ok,
+            "errors": self.errors,
+            "error_rate": self.errors / done if done else 0.0,
+            "error_types": dict(self.error_types),
+            "recovered": self.recovered,
+            "resumed": self.resumed,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "elapsed_seconds": elapsed,
+            "jobs_per_second": done / elapsed if elapsed else 0.0,
+            "tokens_per_second": (self.input_tokens + self.output_tokens) / elapsed if elapsed else 0.0,
+            "latency": self.latency.as_dict(),
+        }
+
+
+# ---------------------------- Runner ----------------------------
+
+def _turn_result(messages, message_id):
+    """(reply, model, requests, input tokens, output tokens) of the turn that starts at `message_id`."""
+    start = next((i for i, m in enumerate(messages) if m.id == message_id), None)
+    turn = messages[start + 1:] if start is not None else []
+    ai = [m for m in turn if m.type == "ai"]
+    usage = [m.usage_metadata or {} for m in ai]
+    model = next((m.response_metadata.get("model_name") for m in reversed(ai) if m.response_metadata.get("model_name")), None)
+    reply = ai[-1].content if ai else ""
+    return reply, model, len(ai), sum(u.get("input_tokens", 0) for u in usage), sum(u.get("output_tokens", 0) for u in usage)
+
+
+class BatchRunner:
+    """Runs jobs through `chatbot` (a compiled graph) and appends results to an output JSONL."""
+
+    def __init__(self, chatbot, checkpointer=None, concurrency: int = 8, limits: ModelLimits | None = None, retries: int = 3):
+        self.chatbot = chatbot
+        self.checkpointer = checkpointer
+        self.concurrency = concurrency
+        self.limits = limits or ModelLimits()
+        self.retries = retries
+        self.stats = BatchStats()
+
+    @classmethod
+    def from_env(cls, chatbot, checkpointer=None, concurrency=None, rpm=None, tpm=None, retries=None, limits=None):
+        """A runner configured by BATCH_*; arguments that are not None take precedence."""
+        def option(value, name, default):
+            return value if value is not None else int(os.getenv(name, default))
+
+        return cls(
+            chatbot,
+            checkpointer,
+            concurrency=option(concurrency, "BATCH_CONCURRENCY", "8"),
+            limits=ModelLimits(default=(option(rpm, "BATCH_RPM", "0"), option(tpm, "BATCH_TPM", "0")), limits=limits),
+            retries=option(retries, "BATCH_RETRIES", "3"),
+        )
+
+    async def run(self, jobs, output_path, batch_id: str | None = None):
+        """Run the jobs not yet "ok" in `output_path`; returns the stats. BatchLocked if it is in use."""
+        batch_id = batch_id or os.path.splitext(os.path.basename(output_path))[0]
+        with open(output_path, "a", encoding="utf-8") as out:
+            # held until the file is closed; read the progress only once it is ours
+            _lock(out, output_path)
+            done = completed_ids(output_path)
+            threads = OrderedDict()
+            for job in jobs:
+                if job["id"] not in done:
+                    threads.setdefault(job["thread_id"], []).append(job)
+            pending = sum(len(j) for j in threads.values())
+            self.stats = BatchStats(total=len(jobs), skipped=len(jobs) - pending)
+
+            queue = asyncio.Queue()
+            for thread_jobs in threads.values():
+                queue.put_nowait(thread_jobs)
+
+            async def worker():
+                while not queue.empty():
+                    for job in queue.get_nowait():
+                        result = await self._run_job(job, batch_id)
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+
+            try:
+                await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(threads)) or 1)))
+            finally:
+                self.stats.finished = time.monotonic()
+        return self.stats.as_dict()
+
+    async def _run_job(self, job, batch_id):
+        message_id = f"batch:{batch_id}:{job['id']}"
+        result = {"id": job["id"], "thread_id": job["thread_id"]}
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            await self.limits.wait()
+            try:
+                messages = await self._turn(job, message_id)
+                break
+            except Exception as e:
+                if is_rate_limited(e) and attempt < self.retries:
+                    self.stats.retries += 1
+                    backoff = getattr(e, "retry_after", None) or min(60.0, 2.0 ** attempt) * (1 + random.random())
+                    self.limits.pause(backoff)
+                    continue
+                logger.warning("batch job %s failed: %r", job["id"], e)
+                self.stats.errors += 1
+                kind = type(e).__name__
+                self.stats.error_types[kind] = self.stats.error_types.get(kind, 0) + 1
+                result.update(status="error", error=f"{kind}: {e}", seconds=time.perf_counter() - started)
+                return result
+
+        reply, model, requests, input_tokens, output_tokens = _turn_result(messages, message_id)
+        self.limits.record(model or "default", requests, input_tokens + output_tokens)
+        self.stats.ok += 1
+        self.stats.input_tokens += input_tokens
+        self.stats.output_tokens += output_tokens
+        seconds = time.perf_counter() - started
+        self.stats.latency.observe(seconds)
+        result.update(
+            status="ok", reply=reply, model=model,
+            input_tokens=input_tokens, output_tokens=output_tokens, seconds=seconds,
+        )
+        return result
+
+    async def _turn(self, job, message_id):
+        """The thread's messages after the job's turn; runs, resumes or recovers the turn."""
+        from langchain_core.messages import HumanMessage
+
+        config = {"configurable": {"thread_id": job["thread_id"]}, "metadata": {"batch": message_id}}
+        async with turn_scheduler().aturn(job["thread_id"]):
+            state = await self.chatbot.aget_state(config)
+            messages = state.values.get("messages", [])
+            if any(m.id == message_id for m in messages):
+                if not state.next:
+                    # the turn finished before the previous run could record it
+                    self.stats.recovered += 1
+                    return messages
+                # stopped mid-turn: continue from its last checkpoint
+                self.stats.resumed += 1
+                values = await self.chatbot.ainvoke(None, config=config)
+            else:
+                values = await self.chatbot.ainvoke(
+                    {"messages": [HumanMessage(content=job["message"], id=message_id)]}, config=config
+                )
+            if self.checkpointer is not None:
+                # end of turn: commit the turn's checkpoints if durability is "batched"
+                await self.checkpointer.aflush()
+        return values["messages"]
+
+
+# ---------------------------- Batches of the API ----------------------------
+
+class BatchManager:
+    """/batch runs of main.py: files in `directory`, one `BatchRunner` task per running batch."""
+
+    def __init__(self, directory: str | None = None):
+        self.directory = directory or os.getenv("BATCH_DIR", "batches")
+        self.runners: dict[str, BatchRunner] = {}
+        self.tasks: dict[str, asyncio.Task] = {}
+
+    def paths(self, batch_id: str):
+        if not batch_id or not all(c.isalnum() or c in "-_" for c in batch_id):
+            raise ValueError(f"invalid batch id {batch_id!r}")
+        base = os.path.join(self.directory, batch_id)
+        return base + ".input.jsonl", base + ".output.jsonl"
+
+    def create(self, body: str, batch_id: str | None = None) -> tuple[str, int]:
+        """
+        Validate and store a JSONL body; returns (batch id, number of jobs). router.py
+        picks the id, so that it can send the batch's requests to one worker.
+        """
+        jobs = parse_jobs(body.splitlines())
+        batch_id = batch_id or uuid.uuid4().hex[:12]
+        os.makedirs(self.directory, exist_ok=True)
+        input_path, _ = self.paths(batch_id)
+        try:
+            with open(input_path, "x", encoding="utf-8") as f:
+                f.write(body if body.endswith("\n") else body + "\n")
+        except FileExistsError:
+            raise ValueError(f"batch {batch_id} already exists") from None
+        return batch_id, len(jobs)
+
+    def start(self, batch_id: str, chatbot, checkpointer, **options):
+        """Run (or resume) a stored batch in the background."""
+        if batch_id in self.tasks and not self.tasks[batch_id].done():
+            raise RuntimeError(f"batch {batch_id} is already running")
+        input_path, output_path = self.paths(batch_id)
+        if output_locked(output_path):
+            raise BatchLocked(f"batch {batch_id} is already running in another process")
+        jobs = read_jobs(input_path)
+        runner = BatchRunner.from_env(chatbot, checkpointer, **options)
+        self.runners[batch_id] = runner
+        self.tasks[batch_id] = asyncio.create_task(runner.run(jobs, output_path, batch_id))
+
+    def status(self, batch_id: str) -> dict | None:
+        input_path, output_path = self.paths(batch_id)
+        if not os.path.exists(input_path):
+            return None
+        task = self.tasks.get(batch_id)
+        if task is None:
+            state = "running elsewhere" if output_locked(output_path) else "stopped"
+        elif not task.done():
+            state = "running"
+        elif task.cancelled():
+            state = "cancelled"
+        elif task.exception() is not None:
+            state = f"failed: {task.exception()!r}"
+        else:
+            state = "finished"
+        runner = self.runners.get(batch_id)
+        status = {"batch_id": batch_id, "state": state}
+        if runner is not None:
+            status.update(runner.stats.as_dict(), rate_limits=runner.limits.usage(), rate_limit_wait_seconds=runner.limits.waited)
+        else:
+            status.update(total=len(read_jobs(input_path)), ok=len(completed_ids(output_path)))
+        return status
+
+    async def cancel(self, batch_id: str) -> bool:
+        task = self.tasks.get(batch_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def aclose(self):
+        """Stop running batches; POST /batch/{id}/resume picks them up again."""
+        for batch_id in list(self.tasks):
+            await self.cancel(batch_id)
+
+    def totals(self) -> dict:
+        """Jobs by outcome over the batches run by this process."""
+        totals = {"ok": 0, "errors": 0, "retries": 0, "running": 0}
+        for batch_id, runner in self.runners.items():
+            totals["ok"] += runner.stats.ok
+            totals["errors"] += runner.stats.errors
+            totals["retries"] += runner.stats.retries
+            totals["running"] += not self.tasks[batch_id].done()
+        return totals
+
+
+# ---------------------------- CLI ----------------------------
+
+def _parse_limits(values):
+    """MODEL=RPM:TPM options -> {model: (rpm, tpm)}"""
+    limits = {}
+    for value in values or []:
+        model, _, rates = value.partition("=")
+        rpm, _, tpm = rates.partition(":")
+        limits[model] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+async def _report(runner, every):
+    while True:
+        await asyncio.sleep(every)
+        s = runner.stats.as_dict()
+        print(f"{s['done']}/{s['total'] - s['skipped']} done, {s['errors']} errors, "
+              f"{s['jobs_per_second']:.2f} jobs/s, {s['tokens_per_second']:.0f} tokens/s", file=sys.stderr)
+
+
+async def _main(args):
+    from async_chatbot import build_graph
+
+    jobs = read_jobs(args.input)
+    chatbot, checkpointer = await build_graph()
+    runner = BatchRunner.from_env(
+        chatbot, checkpointer, concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm, retries=args.retries,
+        limits=_parse_limits(args.limit),
+    )
+    reporter = asyncio.create_task(_report(runner, args.progress))
+    try:
+        stats = await runner.run(jobs, args.output)
+    finally:
+        reporter.cancel()
+        await checkpointer.aclose()
+    stats["rate_limit_wait_seconds"] = runner.limits.waited
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of (thread_id, message) jobs through the chat graph.")
+    parser.add_argument("input")
+    parser.add_argument("output", help="results JSONL; jobs already ok in it are skipped")
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute per model")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute per model")
+    parser.add_argument("--limit", action="append", metavar="MODEL=RPM:TPM", help="limits of one model")
+    parser.add_argument("--retries", type=int, default=None)
+    parser.add_argument("--progress", type=float, default=10.0, help="seconds between progress lines")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,127 @@
+"""
+Turn latency of the chat_node -> tools -> chat_node loop with per-step commits
+("sync") versus one commit per turn ("batched").
+
+No model or network is involved: chat_node emits a fixed number of tool calls
+before answering, so the difference is checkpoint I/O only.
+
+    python -m benchmarks.checkpoint_durability --turns 50 --tool-rounds 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import TypedDict, Annotated, List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.tools import tool
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+
+from sqlite_pool import PooledAsyncSqliteSaver
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+
+
+@tool
+def echo(text: str):
+    """Return the text unchanged."""
+    return text
+
+
+def build_graph(checkpointer, tool_rounds: int):
+    def chat_node(state: ChatState) -> ChatState:
+        # count tool rounds since the last human message
+        rounds = 0
+        for msg in reversed(state["messages"]):
+            if isinstance(msg, HumanMessage):
+                break
+            if isinstance(msg, AIMessage):
+                rounds += 1
+        if rounds < tool_rounds:
+            call = {"name": "echo", "args": {"text": "x" * 200}, "id": f"call_{time.time_ns()}"}
+            return {"messages": [AIMessage(content="", tool_calls=[call])]}
+        return {"messages": [AIMessage(content="done " * 50)]}
+
+    graph = StateGraph(ChatState)
+    graph.add_node("chat_node", chat_node)
+    graph.add_node("tools", ToolNode([echo]))
+    graph.set_entry_point("chat_node")
+    graph.add_conditional_edges("chat_node", tools_condition)
+    graph.add_edge("tools", "chat_node")
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def run_turns(path, durability, turns, tool_rounds, synchronous):
+    checkpointer = await PooledAsyncSqliteSaver.from_path(path, durability=durability)
+    await checkpointer.pool.writer_conn.executescript(f"PRAGMA synchronous={synchronous};")
+    chatbot = build_graph(checkpointer, tool_rounds)
+    config = {"configurable": {"thread_id": f"bench-{durability}"}}
+
+    latencies = []
+    for i in range(turns):
+        start = time.perf_counter()
+        await chatbot.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config=config)
+        await checkpointer.aflush()  # end of turn, same as main.chat_endpoint
+        latencies.append(time.perf_counter() - start)
+
+    await checkpointer.aclose()
+    return latencies
+
+
+async def crash_check(path, tool_rounds):
+    """
+    Documented crash semantics of "batched": a turn that was never flushed is lost
+    as a whole and the thread resumes from the previous flushed turn.
+    """
+    config = {"configurable": {"thread_id": "crash"}}
+
+    checkpointer = await PooledAsyncSqliteSaver.from_path(path, durability="batched", flush_max_delay=3600)
+    chatbot = build_graph(checkpointer, tool_rounds)
+    await chatbot.ainvoke({"messages": [HumanMessage(content="kept")]}, config=config)
+    await checkpointer.aflush()
+    expected = len((await chatbot.aget_state(config)).values["messages"])
+    await chatbot.ainvoke({"messages": [HumanMessage(content="lost")]}, config=config)
+    # simulate a crash: drop the buffer instead of flushing it
+    checkpointer._buffer.clear()
+    checkpointer._buffered_threads.clear()
+    await checkpointer.aclose()
+
+    checkpointer = await PooledAsyncSqliteSaver.from_path(path)
+    chatbot = build_graph(checkpointer, tool_rounds)
+    messages = (await chatbot.aget_state(config)).values["messages"]
+    await checkpointer.aclose()
+    return len(messages) == expected and messages[-1].content.startswith("done")
+
+
+def summarize(name, latencies):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{name:>8}  mean {statistics.mean(ms):7.2f} ms  p50 {statistics.median(ms):7.2f} ms  p95 {p95:7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--tool-rounds", type=int, default=3)
+    parser.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous for the writer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.turns} turns, {args.tool_rounds} tool rounds per turn, synchronous={args.synchronous}")
+        for durability in ("sync", "batched"):
+            latencies = await run_turns(
+                os.path.join(tmp, f"{durability}.db"), durability, args.turns, args.tool_rounds, args.synchronous
+            )
+            summarize(durability, latencies)
+        ok = await crash_check(os.path.join(tmp, "crash.db"), args.tool_rounds)
+        print(f"crash check (unflushed turn is dropped whole): {'ok' if ok else 'FAILED'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
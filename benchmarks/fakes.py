@@ -0,0 +1,265 @@
+"""
+Deterministic stand-ins for the network dependencies of the graphs, so the app can be
+benchmarked without OpenAI, DuckDuckGo or a remote MCP server.
+
+- `FakeStreamingChatModel`: streams a reply at `tokens_per_second` after `ttft` seconds.
+  When tools are bound and the turn has not called one yet, it first streams
+  `tool_calls_per_turn` tool calls (as tool call chunks, like OpenAI) for `tool_call_ratio`
+  of the turns. The same prompt
+  always gets the same reply. Usage reports cached input tokens the way OpenAI's prompt
+  cache would: the longest prefix seen before, in `cache_block` token blocks, once the
+  prompt is at least `cache_min_tokens` long. `slow_ratio` of the calls wait `slow_ttft`
+  instead of `ttft` for their first chunk and `fail_ratio` raise instead, independently
+  per call (drawn from `seed` and the call count), to stand in for a slow or failing upstream.
+- `mock_search_tool()`: a drop-in for `DuckDuckGoSearchResults` with a fixed latency.
+- benchmarks/mock_mcp.py: a local MCP server with the tools the PersonaTracker server offers.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+WORDS = (
+    "the", "note", "task", "reminder", "calendar", "today", "tomorrow", "meeting", "list",
+    "created", "updated", "found", "results", "search", "done", "please", "check", "time",
+)
+
+# characters per token, for the usage estimate
+CHARS_PER_TOKEN = 4
+
+
+def _seed(*parts) -> int:
+    return int.from_bytes(hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).digest(), "big")
+
+
+def burn(seconds: float):
+    """Spend `seconds` of CPU (a stand-in for per-token decoding/serialization work)."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def example_args(schema: dict, text: str) -> dict:
+    """Arguments for a tool call, filled from the tool's JSON schema."""
+    args = {}
+    properties = schema.get("properties", {})
+    for name in schema.get("required", list(properties)):
+        kind = properties.get(name, {}).get("type")
+        if kind == "integer":
+            args[name] = 1 + _seed(text, name) % 9
+        elif kind == "number":
+            args[name] = float(1 + _seed(text, name) % 9)
+        elif kind == "boolean":
+            args[name] = True
+        elif kind in ("array", "object"):
+            args[name] = [] if kind == "array" else {}
+        elif "enum" in properties.get(name, {}):
+            args[name] = properties[name]["enum"][0]
+        else:
+            args[name] = text[:80]
+    return args
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """See module docstring. Call counts are kept in `calls` (shared across bound copies)."""
+
+    tokens: int = 40
+    tokens_per_second: float = 200.0
+    ttft: float = 0.05
+    cpu_us_per_token: float = 0.0
+    tool_call_ratio: float = 0.5
+    # pieces the arguments of each tool call are streamed in
+    tool_arg_chunks: int = 4
+    tool_calls_per_turn: int = 1
+    slow_ratio: float = 0.0
+    slow_ttft: float = 1.0
+    fail_ratio: float = 0.0
+    seed: int = 0
+    cache_block: int = 128
+    cache_min_tokens: int = 1024
+    calls: dict = {}
+    # chained hashes of the prompt prefixes seen so far (the provider's prompt cache)
+    prefixes: dict = {}
+    max_prefixes: int = 200_000
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    # ---------------------------- plan ----------------------------
+
+    def _plan(self, messages, tools):
+        """(tool calls, reply words, usage) for a prompt; depends only on the prompt."""
+        last_human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        text = last_human.content if last_human is not None and isinstance(last_human.content, str) else ""
+        since_human = messages[messages.index(last_human) + 1:] if last_human is not None else []
+        seed = _seed(text, len(messages))
+
+        calls = []
+        if tools and not any(isinstance(m, ToolMessage) for m in since_human):
+            if (seed % 1000) / 1000 < self.tool_call_ratio:
+                for i in range(self.tool_calls_per_turn):
+                    function = tools[(seed + i) % len(tools)]["function"]
+                    calls.append({
+                        "name": function["name"],
+                        "args": example_args(function.get("parameters", {}), f"{text} ({i})" if i else text),
+                        "id": f"call_{seed:016x}" + (f"_{i}" if i else ""),
+                    })
+        words = [] if calls else [WORDS[(seed >> (i % 48)) % len(WORDS)] for i in range(self.tokens)]
+
+        prompt_chars = sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for m in messages)
+        if tools:
+            prompt_chars += len(json.dumps(tools))
+        input_tokens = prompt_chars // CHARS_PER_TOKEN + 1
+        output_tokens = len(words) or self.tool_arg_chunks * len(calls)
+        usage = UsageMetadata(input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens)
+        return calls, words, usage
+
+    def _cache_read(self, messages, tools) -> int:
+        """Tokens of the prompt's longest already-seen prefix, in whole blocks; records the prompt."""
+        parts = [json.dumps(tools or [], sort_keys=True)]
+        for m in messages:
+            parts.append(f"{m.type}:{m.content}:{json.dumps(getattr(m, 'tool_calls', None) or [], sort_keys=True)}")
+        prompt = "\n".join(parts)
+        size = self.cache_block * CHARS_PER_TOKEN
+        if len(prompt) < self.cache_min_tokens * CHARS_PER_TOKEN:
+            return 0
+        cached, hit, digest = 0, True, b""
+        for start in range(0, len(prompt) - size + 1, size):
+            digest = hashlib.blake2b(digest + prompt[start:start + size].encode(), digest_size=16).digest()
+            if hit and digest in self.prefixes:
+                cached += self.cache_block
+            else:
+                hit = False
+            self.prefixes[digest] = True
+        while len(self.prefixes) > self.max_prefixes:
+            del self.prefixes[next(iter(self.prefixes))]
+        return cached if cached >= self.cache_min_tokens else 0
+
+    def _usage(self, messages, tools, usage):
+        cached = self._cache_read(messages, tools)
+        return UsageMetadata(**usage, input_token_details={"cache_read": min(cached, usage["input_tokens"])})
+
+    def _count(self, kind):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def _first_delay(self) -> float:
+        """Time to the first chunk of this call; raises for the injected failures."""
+        n = self.calls["draws"] = self.calls.get("draws", 0) + 1
+        draw = _seed(self.seed, n) % 10_000 / 10_000
+        if draw < self.fail_ratio:
+            raise RuntimeError("injected upstream failure")
+        return self.slow_ttft if draw < self.fail_ratio + self.slow_ratio else self.ttft
+
+    def _chunks(self, calls, words, usage):
+        for index, call in enumerate(calls):
+            args = json.dumps(call["args"])
+            size = max(1, -(-len(args) // self.tool_arg_chunks))
+            for i, start in enumerate(range(0, len(args), size)):
+                first = i == 0
+                yield AIMessageChunk(content="", tool_call_chunks=[{
+                    "name": call["name"] if first else None,
+                    "args": args[start:start + size],
+                    "id": call["id"] if first else None,
+                    "index": index,
+                }])
+        for i, word in enumerate(words):
+            yield AIMessageChunk(content=word if i == 0 else " " + word)
+        yield AIMessageChunk(content="", usage_metadata=usage, response_metadata={"finish_reason": "tool_calls" if calls else "stop"})
+
+    def _delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    # ---------------------------- generate / stream ----------------------------
+
+    def _generate(self, messages, stop=None, run_manager=None, tools: Any = None, **kwargs):
+        self._count("generate")
+        calls, words, usage = self._plan(messages, tools)
+        usage = self._usage(messages, tools, usage)
+        # as long as streaming the same reply would take
+        chunks = sum(1 for _ in self._chunks(calls, words, usage))
+        time.sleep(self._first_delay() + self._delay() * (chunks - 1))
+        burn(self.cpu_us_per_token * len(words) / 1e6)
+        message = AIMessage(content=" ".join(words), tool_calls=calls, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools: Any = None, **kwargs):
+        # like `_generate`, without holding a worker thread while "waiting" for the provider
+        self._count("generate")
+        calls, words, usage = self._plan(messages, tools)
+        usage = self._usage(messages, tools, usage)
+        chunks = sum(1 for _ in self._chunks(calls, words, usage))
+        await asyncio.sleep(self._first_delay() + self._delay() * (chunks - 1))
+        burn(self.cpu_us_per_token * len(words) / 1e6)
+        message = AIMessage(content=" ".join(words), tool_calls=calls, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools: Any = None, **kwargs):
+        self._count("stream")
+        calls, words, usage = self._plan(messages, tools)
+        usage = self._usage(messages, tools, usage)
+        await asyncio.sleep(self._first_delay())
+        delay = self._delay()
+        started = time.perf_counter()
+        for i, message in enumerate(self._chunks(calls, words, usage)):
+            if self.cpu_us_per_token:
+                burn(self.cpu_us_per_token / 1e6)
+            # pace against the start time so sleep overshoot does not accumulate
+            wait = started + i * delay - time.perf_counter()
+            await asyncio.sleep(wait if wait > 0 else 0)
+            # BaseChatModel reports each chunk to the callbacks (and so to stream_mode="messages")
+            yield ChatGenerationChunk(message=message)
+
+    def _stream(self, messages, stop=None, run_manager=None, tools: Any = None, **kwargs):
+        self._count("stream")
+        calls, words, usage = self._plan(messages, tools)
+        usage = self._usage(messages, tools, usage)
+        time.sleep(self._first_delay())
+        delay = self._delay()
+        for message in self._chunks(calls, words, usage):
+            burn(self.cpu_us_per_token / 1e6)
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=message)
+
+
+def mock_search_tool(latency: float = 0.3, results: int = 4, name: str = "duckduckgo_results_json"):
+    """Async stand-in for DuckDuckGoSearchResults: same name and argument, fixed latency."""
+
+    def make(query: str):
+        seed = _seed(query)
+        return json.dumps([
+            {
+                "snippet": f"Result {i} for {query}: " + " ".join(WORDS[(seed >> i) % len(WORDS)] for _ in range(20)),
+                "title": f"{query} ({i})",
+                "link": f"https://example.com/{seed % 10_000}/{i}",
+            }
+            for i in range(results)
+        ])
+
+    def search(query: str) -> str:
+        time.sleep(latency)
+        return make(query)
+
+    async def asearch(query: str) -> str:
+        await asyncio.sleep(latency)
+        return make(query)
+
+    return StructuredTool.from_function(
+        func=search,
+        coroutine=asearch,
+        name=name,
+        description="A wrapper around Duck Duck Go Search. Useful for when you need to answer questions "
+                    "about current events. Input should be a search query.",
+    )
@@ -0,0 +1,122 @@
+"""
+Prompt tokens and model-call latency per turn as a thread grows, with and without
+history compaction (history.py).
+
+The model is a stand-in whose latency grows with prompt size (`--prefill-us-per-token`),
+so the effect of sending less history is visible without calling a provider.
+
+    python -m benchmarks.history_compaction --turns 200 --max-tokens 4000
+"""
+import argparse
+import asyncio
+import time
+from typing import TypedDict, Annotated, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+
+from history import HistoryManager
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+    summary: str
+    summarized_count: int
+
+
+class PrefillCostModel(BaseChatModel):
+    """Calls `search` once per turn, then answers; sleeps in proportion to prompt tokens."""
+
+    counter: object
+    prefill_us_per_token: float = 20.0
+    prompt_tokens: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "prefill-cost"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.counter.total(messages)
+        self.prompt_tokens.append(tokens)
+        await asyncio.sleep(tokens * self.prefill_us_per_token / 1e6)
+        if messages[-1].type == "human":
+            call = {"name": "search", "args": {"query": messages[-1].content[:20]}, "id": f"call_{time.time_ns()}"}
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content="", tool_calls=[call]))])
+        if messages[0].content.startswith("You maintain a running summary"):
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content="summary " * 100))])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="answer " * 150))])
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@tool
+def search(query: str):
+    """Search the web."""
+    return "result " * 800
+
+
+def build(history: HistoryManager, model: PrefillCostModel):
+    async def chat_node(state: ChatState) -> ChatState:
+        return {"messages": [await model.ainvoke(history.select(state, "You are a helpful assistant."))]}
+
+    graph = StateGraph(ChatState)
+    graph.add_node("compact_history", history.anode(model))
+    graph.add_node("chat_node", chat_node)
+    graph.add_node("tools", ToolNode([search]))
+    graph.set_entry_point("compact_history")
+    graph.add_edge("compact_history", "chat_node")
+    graph.add_conditional_edges("chat_node", tools_condition)
+    graph.add_edge("tools", "chat_node")
+    return graph.compile(checkpointer=InMemorySaver())
+
+
+async def run(strategies, args):
+    history = HistoryManager(strategies=strategies, max_tokens=args.max_tokens)
+    model = PrefillCostModel(counter=history.counter, prefill_us_per_token=args.prefill_us_per_token, prompt_tokens=[])
+    chatbot = build(history, model)
+    config = {"configurable": {"thread_id": "bench"}}
+
+    rows = []
+    for turn in range(1, args.turns + 1):
+        model.prompt_tokens.clear()
+        start = time.perf_counter()
+        await chatbot.ainvoke({"messages": [HumanMessage(content=f"question {turn} " * 40)]}, config=config)
+        rows.append((turn, max(model.prompt_tokens), (time.perf_counter() - start) * 1000))
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument("--prefill-us-per-token", type=float, default=20.0)
+    parser.add_argument("--every", type=int, default=10, help="print every Nth turn")
+    args = parser.parse_args()
+
+    configs = {
+        "none": [],
+        "trim_tools": ["trim_tools"],
+        "window": ["window", "trim_tools"],
+        "summarize": ["window", "summarize", "trim_tools"],
+    }
+    results = {name: await run(strategies, args) for name, strategies in configs.items()}
+
+    header = "  ".join(f"{name + ' tok':>15} {name + ' ms':>14}" for name in configs)
+    print(f"{'turn':>5}  {header}")
+    for i in range(args.every - 1, args.turns, args.every):
+        cells = "  ".join(f"{results[name][i][1]:>15} {results[name][i][2]:>14.1f}" for name in configs)
+        print(f"{i + 1:>5}  {cells}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
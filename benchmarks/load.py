@@ -0,0 +1,392 @@
+"""
+Load test of the FastAPI app (main.py) with every network dependency replaced by a
+local stand-in: the model by `FakeStreamingChatModel`, DuckDuckGo by `mock_search_tool`
+and the PersonaTracker MCP server by benchmarks/mock_mcp.py. The graph, checkpointer,
+caches, scheduler and streaming path are the real ones.
+
+Requests arrive open-loop (seeded Poisson arrivals at `--rps`), mixed across /chat,
+/threads and /conversations/{thread_id} by `--mix`. The report has p50/p95/p99 time to
+first byte and total latency per endpoint, streamed tokens/sec and checkpoint bytes
+written to SQLite per turn.
+
+    python -m benchmarks.load --rps 20 --seconds 30
+    python -m benchmarks.load --rps 20 --seconds 30 --save bench.json
+    python -m benchmarks.load --rps 20 --seconds 30 --baseline bench.json --threshold 0.15
+
+With `--baseline`, the run exits with status 1 if a gated metric is worse than the
+baseline by more than `--threshold` (a fraction), or if the error rate exceeds
+`--max-error-rate`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+ENDPOINTS = ("chat", "threads", "conversations")
+
+# metric -> True if higher is better; only these are compared against the baseline
+GATED = {
+    "chat.ttfb_p95_ms": False,
+    "chat.latency_p95_ms": False,
+    "chat.tokens_per_second": True,
+    "threads.latency_p95_ms": False,
+    "conversations.latency_p95_ms": False,
+    "sqlite.bytes_per_turn": False,
+}
+
+
+# ---------------------------- Server ----------------------------
+
+def run_server(args):
+    """main:app with the model, search tool and MCP server swapped for the local stand-ins."""
+    import uvicorn
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import async_chatbot
+    from benchmarks.fakes import FakeStreamingChatModel, mock_search_tool
+    from llm_cache import cached
+    from mcp_pool import McpSessionPool
+    from tool_cache import cacheable, text_key
+
+    async_chatbot.llm = cached(FakeStreamingChatModel(
+        tokens=args.tokens,
+        tokens_per_second=args.tokens_per_second,
+        ttft=args.ttft,
+        tool_call_ratio=args.tool_call_ratio,
+    ))
+    async_chatbot.search_tool = cacheable(
+        mock_search_tool(args.search_latency),
+        ttl=float(os.getenv("TOOL_CACHE_SEARCH_TTL", "600")),
+        key=text_key,
+    )
+    async_chatbot.mcp_pool = McpSessionPool(
+        {"PersonaTracker": {"transport": "streamable_http", "url": args.mcp_url}},
+        cache_path=args.mcp_cache,
+    )
+    import main
+
+    main.mcp_pool = async_chatbot.mcp_pool
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# ---------------------------- Measurements ----------------------------
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def sqlite_bytes(path):
+    """Bytes of checkpoint data stored in the database (payload columns, not pages)."""
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        total = 0
+        if "checkpoints" in tables:
+            total += conn.execute("SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()[0]
+        if "writes" in tables:
+            total += conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+        if "message_store" in tables:
+            total += conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM message_store").fetchone()[0]
+        return total
+    finally:
+        conn.close()
+
+
+def count_tokens(buffer: bytes):
+    """Whitespace separated words of AI text in the complete SSE frames of `buffer`; returns (tokens, rest)."""
+    tokens = 0
+    *frames, rest = buffer.split(b"\n\n")
+    for frame in frames:
+        if not frame.startswith(b"data: {"):
+            continue
+        data = json.loads(frame[6:])
+        if data.get("role") == "ai" and isinstance(data.get("content"), str):
+            tokens += len(data["content"].split())
+    return tokens, rest
+
+
+class LoadGenerator:
+
+    def __init__(self, base_url, rps, mix, thread_count, seed=0, max_in_flight=1000):
+        self.base_url = base_url
+        self.rps = rps
+        total = sum(mix.values())
+        self.endpoints = list(mix)
+        self.weights = [mix[e] / total for e in self.endpoints]
+        self.thread_ids = [f"load-{seed}-{i}" for i in range(thread_count)]
+        self.chatted: list[str] = []
+        self.rng = random.Random(seed)
+        self.max_in_flight = max_in_flight
+        self.turns = 0
+
+    async def _chat(self, client, thread_id):
+        body = {"thread_id": thread_id, "message": f"turn {self.turns} on {thread_id}: what is on my list today?"}
+        self.turns += 1
+        start = time.perf_counter()
+        ttfb, tokens, buffer = None, 0, b""
+        async with client.stream("POST", self.base_url + "/chat", json=body) as r:
+            async for data in r.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                n, buffer = count_tokens(buffer + data)
+                tokens += n
+            status = r.status_code
+        if thread_id not in self.chatted and status == 200:
+            self.chatted.append(thread_id)
+        return status, ttfb, time.perf_counter() - start, tokens
+
+    async def _get(self, client, path):
+        start = time.perf_counter()
+        ttfb = None
+        async with client.stream("GET", self.base_url + path) as r:
+            async for _ in r.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+            status = r.status_code
+        return status, ttfb, time.perf_counter() - start, 0
+
+    async def request(self, client, endpoint, records):
+        try:
+            if endpoint == "chat":
+                result = await self._chat(client, self.rng.choice(self.thread_ids))
+            elif endpoint == "threads":
+                result = await self._get(client, "/threads?limit=50")
+            else:
+                thread_id = self.rng.choice(self.chatted or self.thread_ids)
+                result = await self._get(client, f"/conversations/{thread_id}?limit=50")
+        except httpx.HTTPError as e:
+            result = (type(e).__name__, None, None, 0)
+        status, ttfb, latency, tokens = result
+        records.append({"endpoint": endpoint, "status": status, "ttfb": ttfb, "latency": latency, "tokens": tokens})
+
+    async def run(self, seconds):
+        """Issue requests for `seconds`, wait for them to finish; returns (records, elapsed, dropped)."""
+        records, tasks, dropped = [], set(), 0
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            start = time.perf_counter()
+            next_at = start
+            while next_at < start + seconds:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if len(tasks) >= self.max_in_flight:
+                    dropped += 1
+                else:
+                    endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+                    task = asyncio.ensure_future(self.request(client, endpoint, records))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                next_at += self.rng.expovariate(self.rps)
+            if tasks:
+                await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+        return records, elapsed, dropped
+
+
+def summarize(records, elapsed, dropped, bytes_written):
+    report = {"duration_s": round(elapsed, 2), "dropped": dropped}
+    total = errors = 0
+    for endpoint in ENDPOINTS:
+        rows = [r for r in records if r["endpoint"] == endpoint]
+        ok = [r for r in rows if r["status"] == 200]
+        total += len(rows)
+        errors += len(rows) - len(ok)
+        stats = {"requests": len(rows), "errors": len(rows) - len(ok), "rps": round(len(rows) / elapsed, 2)}
+        for name in ("ttfb", "latency"):
+            values = [r[name] for r in ok if r[name] is not None]
+            for q in (50, 95, 99):
+                value = percentile(values, q)
+                stats[f"{name}_p{q}_ms"] = None if value is None else round(value * 1000, 1)
+        if endpoint == "chat":
+            tokens = sum(r["tokens"] for r in ok)
+            rates = [r["tokens"] / (r["latency"] - r["ttfb"]) for r in ok if r["tokens"] and r["latency"] > r["ttfb"]]
+            stats["tokens"] = tokens
+            stats["tokens_per_second"] = round(tokens / elapsed, 1)
+            stats["stream_tokens_per_second_p50"] = None if not rates else round(percentile(rates, 50), 1)
+        report[endpoint] = stats
+    turns = report["chat"]["requests"] - report["chat"]["errors"]
+    report["sqlite"] = {"bytes_written": bytes_written, "bytes_per_turn": round(bytes_written / turns) if turns else None}
+    report["error_rate"] = round(errors / total, 4) if total else 0.0
+    return report
+
+
+def flatten(report):
+    return {
+        f"{section}.{key}": value
+        for section, stats in report.items() if isinstance(stats, dict)
+        for key, value in stats.items()
+    }
+
+
+def regressions(report, baseline, threshold, max_error_rate):
+    failures = []
+    current, previous = flatten(report), flatten(baseline)
+    for metric, higher_is_better in GATED.items():
+        new, old = current.get(metric), previous.get(metric)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > threshold:
+            failures.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    if report["error_rate"] > max_error_rate:
+        failures.append(f"error_rate: {report['error_rate']:.2%} > {max_error_rate:.2%}")
+    return failures
+
+
+def print_report(report):
+    print(f"{'endpoint':<14} {'reqs':>6} {'err':>4} {'rps':>6} "
+          f"{'ttfb p50':>9} {'p95':>7} {'p99':>7} {'lat p50':>9} {'p95':>7} {'p99':>7}  (ms)")
+    for endpoint in ENDPOINTS:
+        s = report[endpoint]
+        cells = [s[f"{n}_p{q}_ms"] for n in ("ttfb", "latency") for q in (50, 95, 99)]
+        cells = ["-" if c is None else f"{c:.1f}" for c in cells]
+        print(f"{endpoint:<14} {s['requests']:>6} {s['errors']:>4} {s['rps']:>6.1f} "
+              f"{cells[0]:>9} {cells[1]:>7} {cells[2]:>7} {cells[3]:>9} {cells[4]:>7} {cells[5]:>7}")
+    chat = report["chat"]
+    print(f"tokens/s: {chat['tokens_per_second']} total, {chat['stream_tokens_per_second_p50']} per stream (p50)")
+    print(f"sqlite bytes/turn: {report['sqlite']['bytes_per_turn']}  error rate: {report['error_rate']:.2%}  "
+          f"dropped: {report['dropped']}")
+
+
+# ---------------------------- Driver ----------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(url, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r} in --mix, expected {ENDPOINTS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "load.db")
+        env = {"LLM_CACHE": "false", **os.environ, "CHECKPOINT_DB": db}
+        mcp_port, app_port = free_port(), free_port()
+        procs = [subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_mcp", "--port", str(mcp_port), "--latency", str(args.mcp_latency)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )]
+        try:
+            await wait_ready(f"http://127.0.0.1:{mcp_port}/mcp")
+            procs.append(subprocess.Popen([
+                sys.executable, "-m", "benchmarks.load", "server",
+                "--port", str(app_port),
+                "--mcp-url", f"http://127.0.0.1:{mcp_port}/mcp",
+                "--mcp-cache", os.path.join(tmp, "mcp_tools.json"),
+                "--tokens", str(args.tokens),
+                "--tokens-per-second", str(args.tokens_per_second),
+                "--ttft", str(args.ttft),
+                "--tool-call-ratio", str(args.tool_call_ratio),
+                "--search-latency", str(args.search_latency),
+            ], env=env))
+            base_url = f"http://127.0.0.1:{app_port}"
+            await wait_ready(base_url + "/metrics/turns")
+
+            mix = parse_mix(args.mix)
+            if args.warmup > 0:
+                await LoadGenerator(base_url, args.rps, mix, args.threads, seed=args.seed + 1).run(args.warmup)
+            before = sqlite_bytes(db)
+            records, elapsed, dropped = await LoadGenerator(
+                base_url, args.rps, mix, args.threads, seed=args.seed, max_in_flight=args.max_in_flight
+            ).run(args.seconds)
+            report = summarize(records, elapsed, dropped, sqlite_bytes(db) - before)
+            async with httpx.AsyncClient() as client:
+                report["tools"] = {
+                    name: stats.get("calls") for name, stats in (await client.get(base_url + "/metrics/tools")).json().items()
+                }
+        finally:
+            # app first, so it can close its MCP session cleanly
+            for proc in reversed(procs):
+                proc.terminate()
+                proc.wait()
+
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("command", "save", "baseline")}
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = regressions(report, baseline, args.threshold, args.max_error_rate)
+        if failures:
+            print(f"REGRESSION (threshold {args.threshold:.0%}):")
+            for failure in failures:
+                print("  " + failure)
+            return 1
+        print(f"no regression against {args.baseline} (threshold {args.threshold:.0%})")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    server = sub.add_parser("server")
+    server.add_argument("--port", type=int, required=True)
+    server.add_argument("--mcp-url", required=True)
+    server.add_argument("--mcp-cache", default=None)
+    for p in (parser, server):
+        p.add_argument("--tokens", type=int, default=40, help="tokens per model reply")
+        p.add_argument("--tokens-per-second", type=float, default=200.0)
+        p.add_argument("--ttft", type=float, default=0.05, help="model time to first token (s)")
+        p.add_argument("--tool-call-ratio", type=float, default=0.5)
+        p.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--mcp-latency", type=float, default=0.02)
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--mix", default="chat=6,threads=2,conversations=2")
+    parser.add_argument("--threads", type=int, default=50, help="distinct thread_ids")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    if args.command == "server":
+        run_server(args)
+    else:
+        sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
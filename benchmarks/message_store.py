@@ -0,0 +1,69 @@
+"""
+Database size and latency of full-snapshot checkpoints versus the append-only
+message store, across conversation lengths.
+
+    python -m benchmarks.message_store --lengths 10 50 200
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.checkpoint_durability import build_graph
+from sqlite_pool import PooledAsyncSqliteSaver
+
+
+def db_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+async def run(path, message_store, turns, tool_rounds):
+    checkpointer = await PooledAsyncSqliteSaver.from_path(path, message_store=message_store)
+    chatbot = build_graph(checkpointer, tool_rounds)
+    config = {"configurable": {"thread_id": "bench"}}
+
+    turn_times = []
+    for i in range(turns):
+        start = time.perf_counter()
+        await chatbot.ainvoke({"messages": [HumanMessage(content=f"turn {i} " * 20)]}, config=config)
+        turn_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    state = await chatbot.aget_state(config)
+    read_time = time.perf_counter() - start
+    count = len(state.values["messages"])
+
+    await checkpointer.pool.writer_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    await checkpointer.aclose()
+    return {
+        "messages": count,
+        "bytes": db_bytes(path),
+        "last_turn_ms": turn_times[-1] * 1000,
+        "mean_turn_ms": sum(turn_times) / len(turn_times) * 1000,
+        "read_ms": read_time * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 200], help="turns per thread")
+    parser.add_argument("--tool-rounds", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'turns':>6} {'mode':>9} {'msgs':>6} {'db KiB':>9} {'mean turn':>10} {'last turn':>10} {'read':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for turns in args.lengths:
+            for message_store in (False, True):
+                mode = "store" if message_store else "snapshot"
+                r = await run(os.path.join(tmp, f"{mode}-{turns}.db"), message_store, turns, args.tool_rounds)
+                print(
+                    f"{turns:>6} {mode:>9} {r['messages']:>6} {r['bytes'] / 1024:>9.1f} "
+                    f"{r['mean_turn_ms']:>8.2f}ms {r['last_turn_ms']:>8.2f}ms {r['read_ms']:>6.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
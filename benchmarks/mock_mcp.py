@@ -0,0 +1,68 @@
+"""
+Local stand-in for the PersonaTracker MCP server, with a fixed latency per call.
+
+    python -m benchmarks.mock_mcp --port 8765 --latency 0.05
+
+Serves streamable HTTP at http://127.0.0.1:<port>/mcp. Notes and tasks are kept in memory.
+"""
+import argparse
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+from mcp.server.fastmcp import FastMCP
+
+
+def create_server(latency: float = 0.05, port: int = 8765) -> FastMCP:
+    server = FastMCP("PersonaTracker", port=port, log_level="WARNING")
+    notes: dict[int, dict] = {}
+    tasks: dict[int, dict] = {}
+    ids = itertools.count(1)
+
+    @server.tool()
+    async def get_current_datetime() -> str:
+        """Current date and time (UTC, ISO 8601)."""
+        await asyncio.sleep(latency)
+        return datetime.now(timezone.utc).isoformat()
+
+    @server.tool()
+    async def create_note(title: str, content: str, tags: list[str] | None = None) -> dict:
+        """Create a personal note."""
+        await asyncio.sleep(latency)
+        note = {"id": next(ids), "title": title, "content": content, "tags": tags or []}
+        notes[note["id"]] = note
+        return note
+
+    @server.tool()
+    async def list_notes(limit: int = 10) -> list[dict]:
+        """Most recent personal notes."""
+        await asyncio.sleep(latency)
+        return list(notes.values())[-limit:]
+
+    @server.tool()
+    async def create_task(title: str, due: str | None = None) -> dict:
+        """Create a personal task."""
+        await asyncio.sleep(latency)
+        task = {"id": next(ids), "title": title, "due": due, "done": False}
+        tasks[task["id"]] = task
+        return task
+
+    @server.tool()
+    async def list_tasks(include_done: bool = False) -> list[dict]:
+        """Open (or all) personal tasks."""
+        await asyncio.sleep(latency)
+        return [t for t in tasks.values() if include_done or not t["done"]]
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    create_server(args.latency, args.port).run("streamable-http")
+
+
+if __name__ == "__main__":
+    main()
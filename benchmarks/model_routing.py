@@ -0,0 +1,136 @@
+"""
+Tail latency with hedged requests, failover and cheap-model routing (model_router.py).
+
+Every endpoint is a `FakeStreamingChatModel` that injects delays: `--slow-ratio` of the
+calls wait `--slow-ttft` seconds for their first chunk instead of `--ttft`, independently
+per endpoint. Requests arrive `--concurrency` at a time and are streamed through
+`RoutedChatModel.astream`, like chat_node does; the report has p50/p95/p99 time to first
+chunk and total time per scenario:
+
+    primary    one endpoint, no router (the old setup)
+    hedged     primary + hedge endpoint; duplicate after the primary's p95 TTFT
+    outage     hedged, but every primary call fails: the breaker opens and calls go to
+               the hedge endpoint directly
+    cheap      hedged, with `--trivial-ratio` of the turns small talk routed to a faster
+               cheap endpoint
+
+Each streamed reply is checked against the fake's reply for the same prompt, so a
+scenario also fails loudly if hedging mixed up or dropped chunks.
+
+    python -m benchmarks.model_routing --requests 400 --slow-ratio 0.04
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fakes import FakeStreamingChatModel
+from model_router import ModelRouter, RoutedChatModel
+
+
+def fake(args, seed, **overrides):
+    params = dict(
+        tokens=args.tokens, tokens_per_second=args.tokens_per_second, ttft=args.ttft,
+        slow_ratio=args.slow_ratio, slow_ttft=args.slow_ttft, tool_call_ratio=0.0,
+        seed=seed, calls={}, prefixes={},
+    )
+    params.update(overrides)
+    return FakeStreamingChatModel(**params)
+
+
+def scenarios(args):
+    """name -> (model, router or None)"""
+    def routed(models):
+        router = ModelRouter(names=tuple(models), hedge_delay=args.ttft * 3, min_delay=args.ttft)
+        return RoutedChatModel(models=models, router=router), router
+
+    return {
+        "primary": (fake(args, 1), None),
+        "hedged": routed({"primary": fake(args, 1), "hedge": fake(args, 2)}),
+        "outage": routed({"primary": fake(args, 1, fail_ratio=1.0), "hedge": fake(args, 2)}),
+        "cheap": routed({
+            "primary": fake(args, 1),
+            "hedge": fake(args, 2),
+            "cheap": fake(args, 3, ttft=args.ttft / 3, tokens_per_second=args.tokens_per_second * 3),
+        }),
+    }
+
+
+def prompts(args):
+    rng = random.Random(0)
+    return [
+        [HumanMessage(content="thanks!" if rng.random() < args.trivial_ratio else f"what is on my calendar for day {i}")]
+        for i in range(args.requests)
+    ]
+
+
+async def run(model, messages_list, concurrency, reference):
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts, totals, errors, mismatches = [], [], 0, 0
+
+    async def one(messages):
+        nonlocal errors, mismatches
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            text = []
+            try:
+                async for chunk in model.astream(messages):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    text.append(chunk.content)
+            except Exception:
+                errors += 1
+                return
+            ttfts.append(first)
+            totals.append(time.perf_counter() - start)
+            mismatches += "".join(text) != reference(messages)
+
+    await asyncio.gather(*(one(m) for m in messages_list))
+    return ttfts, totals, errors, mismatches
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else float("nan")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--slow-ttft", type=float, default=2.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.04)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--trivial-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    messages_list = prompts(args)
+    plain = fake(args, 0, slow_ratio=0.0, ttft=0.0, tokens_per_second=0)
+
+    def reference(messages):
+        _calls, words, _usage = plain._plan(messages, None)
+        return " ".join(words)
+
+    print(f"{'scenario':<9} {'ttft p50':>9} {'p95':>7} {'p99':>7} {'total p50':>10} {'p95':>7} {'p99':>7} "
+          f"{'errors':>7} {'mismatch':>9}  router")
+    for name, (model, router) in scenarios(args).items():
+        ttfts, totals, errors, mismatches = await run(model, messages_list, args.concurrency, reference)
+        ms = lambda values, q: percentile(values, q) * 1e3
+        extra = ""
+        if router is not None:
+            stats = router.stats()
+            wins = {n: e["wins"] for n, e in stats["endpoints"].items()}
+            extra = (f"hedges={stats['hedges']} failovers={stats['failovers']} cheap={stats['cheap_routes']} "
+                     f"wins={wins} primary_breaker_opens={stats['endpoints']['primary']['breaker_opens']}")
+        print(f"{name:<9} {ms(ttfts, .5):>9.0f} {ms(ttfts, .95):>7.0f} {ms(ttfts, .99):>7.0f} "
+              f"{ms(totals, .5):>10.0f} {ms(totals, .95):>7.0f} {ms(totals, .99):>7.0f} {errors:>7} {mismatches:>9}  {extra}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
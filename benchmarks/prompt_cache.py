@@ -0,0 +1,101 @@
+"""
+Provider prompt cache hits (prompt_cache.py) as threads grow past the history budget,
+with the sliding history window and with the stable, append-only one (history.py).
+
+Runs the async_chatbot graph on the fake model, which reports cached input tokens the
+way OpenAI's prompt cache does (longest previously seen prefix, in 128-token blocks).
+"append-only" is the share of chat model calls whose prompt starts with the thread's
+previous prompt, i.e. calls that could hit the cache for everything but the new turn.
+
+    python -m benchmarks.prompt_cache --threads 4 --turns 60 --max-tokens 16000
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+import async_chatbot
+from benchmarks.fakes import FakeStreamingChatModel, mock_search_tool
+from history import HistoryManager
+from prompt_cache import PromptCacheStats
+
+
+class RecordingHistory(HistoryManager):
+    """Counts selected prompts that extend the previous prompt of the same thread."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.previous = {}
+        self.calls = 0
+        self.append_only = 0
+        self.select_seconds = 0.0
+
+    def select(self, state, system_prompt=None):
+        start = time.perf_counter()
+        prompt = super().select(state, system_prompt)
+        self.select_seconds += time.perf_counter() - start
+        key = [(m.type, m.content) for m in prompt]
+        thread_key = state["messages"][0].id
+        previous = self.previous.get(thread_key)
+        self.calls += 1
+        self.append_only += previous is not None and key[: len(previous)] == previous
+        self.previous[thread_key] = key
+        return prompt
+
+
+async def run(stable, args):
+    history = RecordingHistory(
+        strategies=["window", "summarize", "trim_tools"],
+        max_tokens=args.max_tokens,
+        stable_prefix=stable,
+    )
+    async_chatbot.history = history
+    async_chatbot.prompt_cache = PromptCacheStats()
+    async_chatbot.llm = FakeStreamingChatModel(
+        tokens=args.reply_words, tokens_per_second=0, ttft=0, tool_call_ratio=args.tool_call_ratio,
+        calls={}, prefixes={},
+    )
+    chatbot = async_chatbot.compile_graph([mock_search_tool(latency=0, results=args.search_results)], InMemorySaver())
+
+    start = time.perf_counter()
+    for turn in range(args.turns):
+        for thread in range(args.threads):
+            await chatbot.ainvoke(
+                {"messages": [HumanMessage(content=f"thread {thread} question {turn}: " + "what about my notes " * 8)]},
+                config={"configurable": {"thread_id": f"bench-{thread}"}},
+            )
+    elapsed = time.perf_counter() - start
+    stats = async_chatbot.prompt_cache.as_dict()
+    return {
+        "calls": history.calls,
+        "append_only": history.append_only / max(1, history.calls - args.threads),
+        "cached_ratio": stats["cached_ratio"],
+        "input_tokens": stats["input_tokens"],
+        "uncached_tokens": stats["input_tokens"] - stats["cached_tokens"],
+        "select_us": history.select_seconds / max(1, history.calls) * 1e6,
+        "seconds": elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--max-tokens", type=int, default=16000)
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--search-results", type=int, default=16, help="size of the tool output (results)")
+    parser.add_argument("--tool-call-ratio", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = {"sliding": await run(False, args), "stable": await run(True, args)}
+    print(f"{'history':<8} {'calls':>6} {'append-only':>12} {'cached ratio':>13} {'input tok':>10} "
+          f"{'uncached tok':>13} {'select us':>10} {'seconds':>8}")
+    for name, r in results.items():
+        print(f"{name:<8} {r['calls']:>6} {r['append_only']:>12.1%} {r['cached_ratio']:>13.1%} {r['input_tokens']:>10} "
+              f"{r['uncached_tokens']:>13} {r['select_us']:>10.0f} {r['seconds']:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,188 @@
+"""
+/chat throughput as API workers are added behind the router (router.py).
+
+For each worker count, N `main:app` workers are started on a shared checkpointer
+(CHECKPOINT_BACKEND, by default one SQLite file in a temp dir) with a stand-in graph
+whose model streams `--tokens` tokens and burns `--cpu-us-per-token` of CPU per token,
+plus the router in front of them. `--clients` concurrent clients, each on its own
+thread, then run turns through the router for `--seconds`.
+
+    python -m benchmarks.scale_out --workers 1 2 4 --clients 32 --seconds 15
+
+Throughput can only grow with workers while there are idle cores: the worker processes
+are CPU bound, like real workers are on serialization, graph execution and streaming.
+With CHECKPOINT_BACKEND=postgres and CHECKPOINT_URL set, the workers share Postgres.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import TypedDict, Annotated, List
+
+import httpx
+from langchain_core.messages import BaseMessage
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+
+from benchmarks.fakes import FakeStreamingChatModel
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+
+
+def build_bench_graph(checkpointer, model):
+    async def chat_node(state: ChatState) -> ChatState:
+        return {"messages": [await model.ainvoke(state["messages"])]}
+
+    graph = StateGraph(ChatState)
+    graph.add_node("chat_node", chat_node)
+    graph.set_entry_point("chat_node")
+    graph.set_finish_point("chat_node")
+    return graph.compile(checkpointer=checkpointer)
+
+
+# ---------------------------- Worker ----------------------------
+
+def run_worker(port: int, tokens: int, cpu_us_per_token: float):
+    """main:app with the stand-in graph instead of the model + MCP tools."""
+    import uvicorn
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import main
+    from checkpointers import open_checkpointer
+
+    async def startup():
+        main.checkpointer = await open_checkpointer()
+        model = FakeStreamingChatModel(tokens=tokens, tokens_per_second=0, ttft=0, cpu_us_per_token=cpu_us_per_token)
+        main.chatbot = build_bench_graph(main.checkpointer, model)
+
+    async def shutdown():
+        await main.checkpointer.aclose()
+
+    main.app.router.on_startup[:] = [startup]
+    main.app.router.on_shutdown[:] = [shutdown]
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# ---------------------------- Driver ----------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(url, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get(url + "/metrics/turns")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def drive(url, clients, seconds):
+    latencies, errors = [], 0
+    stop_at = time.perf_counter() + seconds
+
+    async def client_loop(client, i):
+        nonlocal errors
+        turn = 0
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                async with client.stream("POST", url + "/chat", json={"thread_id": f"bench-{i}", "message": f"turn {turn}"}) as r:
+                    async for _ in r.aiter_raw():
+                        pass
+                    ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+            turn += 1
+
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=None)) as client:
+        began = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, i) for i in range(clients)))
+        elapsed = time.perf_counter() - began
+    return latencies, errors, elapsed
+
+
+def start(args, env):
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.scale_out", *args], env=env)
+
+
+async def measure(n_workers, args, db_dir):
+    env = {**os.environ, "CHECKPOINT_DB": os.path.join(db_dir, f"scale_{n_workers}.db"), "LLM_CACHE": "false"}
+    ports = [free_port() for _ in range(n_workers)]
+    procs = [
+        start(["worker", "--port", str(p), "--tokens", str(args.tokens), "--cpu-us-per-token", str(args.cpu_us_per_token)], env)
+        for p in ports
+    ]
+    router_port = free_port()
+    router_env = {**env, "WORKER_URLS": ",".join(f"http://127.0.0.1:{p}" for p in ports)}
+    procs.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "router:app", "--port", str(router_port), "--log-level", "warning"], env=router_env
+    ))
+    try:
+        for p in ports:
+            await wait_ready(f"http://127.0.0.1:{p}")
+        router = f"http://127.0.0.1:{router_port}"
+        await wait_ready(router)
+        await drive(router, args.clients, min(2.0, args.seconds))  # warm up
+        return await drive(router, args.clients, args.seconds)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+async def run(args):
+    print(f"cores={os.cpu_count()} clients={args.clients} tokens/turn={args.tokens} cpu/token={args.cpu_us_per_token}us "
+          f"backend={os.getenv('CHECKPOINT_BACKEND', 'sqlite')}")
+    print(f"{'workers':>7} {'turns/s':>9} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as db_dir:
+        for n in args.workers:
+            latencies, errors, elapsed = await measure(n, args, db_dir)
+            rate = len(latencies) / elapsed
+            baseline = baseline or rate
+            q = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else [0] * 19
+            print(f"{n:>7} {rate:>9.1f} {rate / baseline:>7.2f}x {statistics.median(latencies) * 1000:>8.1f} "
+                  f"{q[18] * 1000:>8.1f} {errors:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    worker = sub.add_parser("worker")
+    worker.add_argument("--port", type=int, required=True)
+    for p in (parser, worker):
+        p.add_argument("--tokens", type=int, default=50)
+        p.add_argument("--cpu-us-per-token", type=float, default=200.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        run_worker(args.port, args.tokens, args.cpu_us_per_token)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
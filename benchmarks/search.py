@@ -0,0 +1,129 @@
+"""
+Conversation search (search_index.py): /search latency at a given number of indexed
+messages, and the cost of indexing.
+
+Builds a database of `--messages` messages over `--threads` threads, then times `asearch`
+on a reader connection like the checkpointer does, for queries of different selectivity.
+Text is drawn from a Zipf-distributed vocabulary whose most frequent words are the
+English stopwords, as in real text; "stopword (raw)" searches one of them with raw FTS5
+syntax, i.e. a term found in most messages, which is the worst case. The database is
+kept in `--db` and reused by later runs.
+
+    python -m benchmarks.search --messages 1000000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from search_index import SEARCH_SCHEMA, STOPWORDS, UPSERT_SQL, asearch, to_match
+
+
+SYLLABLES = "ka lo mi nu pe ra si to vu we xa yo ze bri cla dre fro gla".split()
+
+
+def vocabulary(size, seed=0):
+    """The stopwords, then `size` made-up words; earlier words are drawn more often."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 5))))
+    return sorted(STOPWORDS) + sorted(words)
+
+
+def build(path, messages, threads, words_per_message, batch=20000):
+    words = vocabulary(20000)
+    # Zipf-like weights: word i is 1/(i+1) as frequent as the most common one
+    cum_weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(len(words))))
+    rng = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;" + SEARCH_SCHEMA)
+    start = time.perf_counter()
+    for offset in range(0, messages, batch):
+        n = min(batch, messages - offset)
+        rows = [
+            (
+                f"thread-{(offset + i) % threads}",
+                f"msg-{offset + i}",
+                "human" if i % 2 else "ai",
+                " ".join(rng.choices(words, cum_weights=cum_weights, k=words_per_message)),
+                "2026-01-01T00:00:00+00:00",
+            )
+            for i in range(n)
+        ]
+        with conn:
+            conn.executemany(UPSERT_SQL, rows)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed, words
+
+
+def queries(words):
+    """name -> (query, raw)"""
+    content = words[len(STOPWORDS):]
+    return {
+        "common word": (content[0], False),
+        "mid word": (content[200], False),
+        "rare word": (content[15000], False),
+        "two words": (f"{content[5]} {content[300]}", False),
+        "sentence": (f"what was it about the {content[40]} and {content[90]}", False),
+        "stopword (raw)": ('"the"', True),
+        "no match": ("qqqqzzzz", False),
+    }
+
+
+async def time_queries(path, cases, rounds):
+    conn = await aiosqlite.connect(path)
+    await conn.executescript("PRAGMA query_only=ON; PRAGMA mmap_size=268435456; PRAGMA cache_size=-65536;")
+    results = {}
+    try:
+        for name, (query, raw) in cases.items():
+            times = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                page = await asearch(conn, query, limit=20, raw=raw)
+                times.append(time.perf_counter() - start)
+            count = (await (await conn.execute(
+                "SELECT COUNT(*) FROM search_fts WHERE search_fts MATCH ?", (query if raw else to_match(query),)
+            )).fetchone())[0]
+            results[name] = (query, count, len(page["results"]), times)
+    finally:
+        await conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=30, help="words per message")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--db", default=None, help="database to build (default: a temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "search.db")
+    if os.path.exists(path):
+        words = vocabulary(20000)
+        print(f"reusing {path}")
+    else:
+        elapsed, words = build(path, args.messages, args.threads, args.words)
+        print(f"indexed {args.messages} messages in {elapsed:.1f}s ({args.messages / elapsed:.0f} messages/s), "
+              f"{os.path.getsize(path) / 1e6:.0f} MB")
+
+    results = asyncio.run(time_queries(path, queries(words), args.rounds))
+    print(f"{'query':<15} {'matching msgs':>14} {'threads':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, (_query, count, returned, times) in results.items():
+        times = sorted(times)
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{name:<15} {count:>14} {returned:>8} {statistics.median(times) * 1e3:>8.2f} {p95 * 1e3:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Checkpoint serializers: bytes per checkpoint and serialize/deserialize time of the stock
+JsonPlusSerializer against the compact one in checkpoint_serde.py, per codec.
+
+Checkpoints are built the way the graph writes them: a thread of `--turns` turns
+(human -> AI tool call -> tool result -> AI answer, with OpenAI-style response_metadata
+as in the `response` file), one checkpoint per step, each holding the whole history so
+far. Every blob is read back and compared with the original (minus the stripped metadata),
+and stock blobs are read by the compact serializer, to check that existing data loads.
+
+    python -m benchmarks.serde --turns 20 --rounds 5
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from checkpoint_serde import DEFAULT_STRIP, CompactSerializer
+
+
+SYLLABLES = "ka lo mi nu pe ra si to vu we xa yo ze bri cla dre fro gla".split()
+# a 2000-word vocabulary, so text compresses roughly like prose rather than like a loop
+_rng = random.Random(0)
+WORDS = ["".join(_rng.choices(SYLLABLES, k=_rng.randint(1, 4))) for _ in range(2000)]
+
+
+def text(n, seed):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def response_metadata(prompt_tokens, completion_tokens, finish_reason):
+    return {
+        "token_usage": {
+            "completion_tokens": completion_tokens,
+            "prompt_tokens": prompt_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "completion_tokens_details": {"accepted_prediction_tokens": 0, "audio_tokens": 0, "reasoning_tokens": 0, "rejected_prediction_tokens": 0},
+            "prompt_tokens_details": {"audio_tokens": 0, "cached_tokens": 0},
+        },
+        "model_provider": "openai",
+        "model_name": "gpt-4o-mini-2024-07-18",
+        "system_fingerprint": "fp_560af6e559",
+        "id": f"chatcmpl-{uuid.uuid4().hex[:29]}",
+        "service_tier": "default",
+        "finish_reason": finish_reason,
+        "logprobs": None,
+    }
+
+
+def usage(prompt_tokens, completion_tokens):
+    return {
+        "input_tokens": prompt_tokens,
+        "output_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "input_token_details": {"audio": 0, "cache_read": 0},
+        "output_token_details": {"audio": 0, "reasoning": 0},
+    }
+
+
+def turn_messages(i, history_tokens):
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    results = ", ".join(
+        f"snippet: {text(30, i + r)}, title: {text(6, r)}, link: https://www.example.com/{i}/{r}" for r in range(4)
+    )
+    return [
+        HumanMessage(content=f"turn {i}: {text(15, i)}", id=str(uuid.uuid4())),
+        AIMessage(
+            content="",
+            additional_kwargs={"refusal": None},
+            response_metadata=response_metadata(history_tokens, 22, "tool_calls"),
+            id=f"lc_run--{uuid.uuid4()}-0",
+            tool_calls=[{"name": "duckduckgo_results_json", "args": {"query": text(5, i)}, "id": call_id, "type": "tool_call"}],
+            usage_metadata=usage(history_tokens, 22),
+        ),
+        ToolMessage(content=f"[{results}]", name="duckduckgo_results_json", id=str(uuid.uuid4()), tool_call_id=call_id),
+        AIMessage(
+            content=text(120, i),
+            additional_kwargs={"refusal": None},
+            response_metadata=response_metadata(history_tokens + 400, 160, "stop"),
+            id=f"lc_run--{uuid.uuid4()}-0",
+            usage_metadata=usage(history_tokens + 400, 160),
+        ),
+    ]
+
+
+def build_checkpoints(turns):
+    """One checkpoint per graph step (input, chat_node, tools, chat_node per turn)."""
+    messages, checkpoints, step = [], [], 0
+    for i in range(turns):
+        for msg in turn_messages(i, 150 + 600 * i):
+            messages = messages + [msg]
+            step += 1
+            checkpoints.append({
+                "v": 4,
+                "id": str(uuid.uuid4()),
+                "ts": "2026-01-01T00:00:00.000000+00:00",
+                "channel_values": {"messages": messages, "summary": "", "summarized_count": 0},
+                "channel_versions": {"messages": f"{step:032}.0", "__start__": f"{step:032}.0"},
+                "versions_seen": {"chat_node": {"messages": f"{step:032}.0"}},
+                "updated_channels": ["messages"],
+            })
+    return checkpoints
+
+
+def comparable(msg):
+    metadata = {k: v for k, v in msg.response_metadata.items() if v is not None and k not in DEFAULT_STRIP}
+    return (type(msg), msg.content, msg.id, getattr(msg, "tool_calls", None), getattr(msg, "usage_metadata", None), metadata)
+
+
+def check(serde, checkpoints, blobs):
+    for checkpoint, blob in zip(checkpoints, blobs):
+        loaded = serde.loads_typed(blob)["channel_values"]["messages"]
+        expected = checkpoint["channel_values"]["messages"]
+        if [comparable(m) for m in loaded] != [comparable(m) for m in expected]:
+            raise AssertionError(f"{blob[0]} blob did not round-trip")
+
+
+def measure(make_serde, checkpoints, rounds):
+    """(bytes per checkpoint, dumps seconds per checkpoint, loads seconds per checkpoint, blobs)."""
+    dumps_times, loads_times = [], []
+    for _ in range(rounds):
+        # a fresh serializer per round, so its message memo starts empty
+        serde = make_serde()
+        start = time.perf_counter()
+        blobs = [serde.dumps_typed(c) for c in checkpoints]
+        dumps_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for blob in blobs:
+            serde.loads_typed(blob)
+        loads_times.append(time.perf_counter() - start)
+    n = len(checkpoints)
+    size = sum(len(b[1]) for b in blobs) / n
+    return size, min(dumps_times) / n, min(loads_times) / n, blobs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    checkpoints = build_checkpoints(args.turns)
+    candidates = {"default (jsonplus)": JsonPlusSerializer}
+    for codec in ("none", "zlib", "zstd", "lz4"):
+        try:
+            CompactSerializer(codec=codec).dumps_typed(checkpoints[0])
+        except ImportError:
+            print(f"compact/{codec}: skipped (not installed)")
+            continue
+        candidates[f"compact/{codec}"] = lambda codec=codec: CompactSerializer(codec=codec)
+    candidates["compact/zstd, no memo"] = lambda: CompactSerializer(codec="zstd", memo_size=0)
+
+    print(f"{len(checkpoints)} checkpoints, {args.turns} turns, last one holds {len(checkpoints[-1]['channel_values']['messages'])} messages")
+    print(f"{'serializer':<24} {'bytes/cp':>10} {'ratio':>7} {'dumps us':>10} {'loads us':>10}")
+    baseline = None
+    for name, make_serde in candidates.items():
+        size, dumps, loads, blobs = measure(make_serde, checkpoints, args.rounds)
+        check(CompactSerializer(), checkpoints, blobs)
+        if baseline is None:
+            baseline = size
+        print(f"{name:<24} {size:>10.0f} {size / baseline:>7.2f} {dumps * 1e6:>10.1f} {loads * 1e6:>10.1f}")
+
+    last = checkpoints[-1]
+    stock = JsonPlusSerializer().dumps_typed(last)
+    print(f"stock blobs read by the compact serializer: ok ({len(stock[1])} -> "
+          f"{len(CompactSerializer().dumps_typed(last)[1])} bytes for the last checkpoint)")
+    sizes = [len(JsonPlusSerializer().dumps_typed(m)[1]) for m in last["channel_values"]["messages"]]
+    compact_sizes = [len(CompactSerializer().dumps_typed(m)[1]) for m in last["channel_values"]["messages"]]
+    print(f"per message (message store rows): {statistics.mean(sizes):.0f} -> {statistics.mean(compact_sizes):.0f} bytes")
+
+
+if __name__ == "__main__":
+    main()
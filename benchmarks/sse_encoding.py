@@ -0,0 +1,92 @@
+"""
+Chunks per second (single core) of the /chat frame encoder versus the previous
+`serialize()` + `json.dumps` path, on a token stream with occasional tool calls.
+
+    python -m benchmarks.sse_encoding --chunks 200000
+"""
+import argparse
+import json
+import time
+
+from langchain_core.messages import AIMessageChunk, ToolMessage
+
+import sse_encoder
+from sse_encoder import StreamEncoder
+
+
+def legacy_serialize_message(msg):
+    # main.serialize_message before the encoder (including its role lookup)
+    msg_type = msg.__class__.__name__
+    if msg_type in ("AIMessage", "AIMessageChunk"):
+        role = "ai"
+    elif msg_type in ("ToolMessage",):
+        role = "tool"
+    elif msg_type in ("HumanMessage"):
+        role = "human"
+    else:
+        role = "unknown"
+    data = {"role": role, "content": getattr(msg, "content", None) or ""}
+    if hasattr(msg, "tool_calls") and msg.tool_calls:
+        data["tool_calls"] = msg.tool_calls
+    if hasattr(msg, "tool_call_chunks") and msg.tool_call_chunks:
+        data["tool_call_chunks"] = msg.tool_call_chunks
+    return data
+
+
+def legacy_encode(item):
+    if not isinstance(item, tuple) or len(item) != 2:
+        return None
+    return f"data: {(json.dumps(legacy_serialize_message(item[0])))}\n\n".encode()
+
+
+def make_stream(n, tool_every=200):
+    """Mostly text deltas, with a tool call chunk and a tool result every `tool_every` items."""
+    meta = {"langgraph_node": "chat_node"}
+    words = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", ".", " Ünïcode", " ✓"]
+    items = []
+    for i in range(n):
+        if i % tool_every == tool_every - 1:
+            chunk = AIMessageChunk(content="", tool_call_chunks=[
+                {"name": "calculator", "args": '{"a": 1, "b": 2, "operation": "add"}', "id": f"call_{i}", "index": 0}
+            ])
+            items.append((chunk, meta))
+            items.append((ToolMessage(content="3", name="calculator", tool_call_id=f"call_{i}"), meta))
+        else:
+            items.append((AIMessageChunk(content=words[i % len(words)]), meta))
+    return items
+
+
+def rate(encode, items, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            encode(item)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200_000)
+    args = parser.parse_args()
+
+    items = make_stream(args.chunks)
+    cases = [
+        ("legacy serialize + json.dumps", legacy_encode),
+        ("encoder sse", StreamEncoder("sse").encode),
+        ("encoder ndjson compact", StreamEncoder("ndjson", compact=True).encode),
+    ]
+    if sse_encoder.dumps is not sse_encoder.stdlib_dumps:
+        cases.append(("encoder sse (stdlib json)", StreamEncoder("sse", json_dumps=sse_encoder.stdlib_dumps).encode))
+
+    baseline = None
+    print(f"{'path':<32} {'chunks/s':>12} {'speedup':>8}")
+    for name, encode in cases:
+        r = rate(encode, items)
+        baseline = baseline or r
+        print(f"{name:<32} {r:>12,.0f} {r / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
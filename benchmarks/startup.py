@@ -0,0 +1,212 @@
+"""
+Cold start of the FastAPI app (main.py): import time and time to the first successful
+request.
+
+Each run spawns `uvicorn main:app` on a fresh SQLite checkpoint database and polls it
+from the moment the process starts. Reported, as the median over `--repeat` runs:
+
+- import: `import main` in a fresh interpreter
+- first /threads and /conversations: first 200 response; these don't wait for the graph
+- graph ready: until /health reports the graph built (MCP discovery and compile included)
+
+MCP scenarios (`--scenarios`):
+
+- cold: benchmarks/mock_mcp.py is up, the tool schema cache is empty
+- warm: same server, schema cache filled by a previous start
+- stalled: the MCP server accepts connections but never answers, so discovery waits
+  for its timeout; /threads must still be served right away
+
+The model is never called, so no API key is needed.
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --repeat 5 --save startup.json
+    python -m benchmarks.startup --repeat 5 --baseline startup.json --threshold 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load import free_port, wait_ready
+
+
+SCENARIOS = ("cold", "warm", "stalled")
+
+# metric -> only these are compared against the baseline (all lower is better)
+GATED = (
+    "import_s",
+    "warm.first_threads_s",
+    "warm.graph_ready_s",
+    "stalled.first_threads_s",
+)
+
+
+# ---------------------------- Measurements ----------------------------
+
+def import_time(env):
+    """Seconds to `import main` in a fresh interpreter."""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+async def stalled_server():
+    """A TCP server that accepts connections and never answers."""
+    held = []
+
+    async def hold(reader, writer):
+        held.append(writer)
+        await reader.read()
+
+    server = await asyncio.start_server(hold, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def poll(client, url, done, start, timeout):
+    """Seconds from `start` until `done(response)` holds; None on timeout."""
+    while time.perf_counter() - start < timeout:
+        try:
+            response = await client.get(url)
+            if done(response):
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.005)
+    return None
+
+
+async def start_once(env, timeout):
+    """Spawn the app, return seconds to the first 200 of each endpoint and to a built graph."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            ok = lambda r: r.status_code == 200
+            threads = await poll(client, base_url + "/threads", ok, start, timeout)
+            conversations = await poll(client, base_url + "/conversations/startup-probe?limit=20", ok, start, timeout)
+            graph = await poll(
+                client, base_url + "/health", lambda r: r.json().get("graph") != "building", start, timeout
+            )
+            state = (await client.get(base_url + "/health")).json().get("graph", "unknown") if graph is not None else "timeout"
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {"first_threads_s": threads, "first_conversations_s": conversations, "graph_ready_s": graph, "graph": state}
+
+
+def median(rows, key):
+    values = [r[key] for r in rows if r[key] is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+# ---------------------------- Driver ----------------------------
+
+async def run(args):
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_env = {
+            "OPENAI_API_KEY": "bench",
+            **os.environ,
+            "CHECKPOINT_BACKEND": "sqlite",
+            "PROFILER": "off",
+        }
+        report["import_s"] = round(min(import_time(base_env) for _ in range(args.repeat)), 3)
+
+        mcp_port = free_port()
+        mcp = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_mcp", "--port", str(mcp_port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        stalled, stalled_port = await stalled_server()
+        try:
+            await wait_ready(f"http://127.0.0.1:{mcp_port}/mcp")
+            for scenario in args.scenarios.split(","):
+                if scenario not in SCENARIOS:
+                    raise SystemExit(f"Unknown scenario {scenario!r}, expected {SCENARIOS}")
+                rows = []
+                for i in range(args.repeat):
+                    cache = os.path.join(tmp, f"{scenario}-mcp_tools.json")
+                    if scenario != "warm" and os.path.exists(cache):
+                        os.remove(cache)
+                    if scenario == "warm" and i == 0:
+                        # fill the schema cache with one unmeasured start
+                        await start_once({**base_env, "MCP_TOOL_CACHE": cache,
+                                          "CHECKPOINT_DB": os.path.join(tmp, "fill.db"),
+                                          "PERSONA_TRACKER_MCP_URL": f"http://127.0.0.1:{mcp_port}/mcp"}, args.timeout)
+                    port = stalled_port if scenario == "stalled" else mcp_port
+                    env = {
+                        **base_env,
+                        "CHECKPOINT_DB": os.path.join(tmp, f"{scenario}-{i}.db"),
+                        "MCP_TOOL_CACHE": cache,
+                        "PERSONA_TRACKER_MCP_URL": f"http://127.0.0.1:{port}/mcp",
+                    }
+                    rows.append(await start_once(env, args.timeout))
+                report[scenario] = {
+                    key: median(rows, key) for key in ("first_threads_s", "first_conversations_s", "graph_ready_s")
+                }
+                report[scenario]["graph"] = sorted({r["graph"] for r in rows})
+        finally:
+            stalled.close()
+            mcp.terminate()
+            mcp.wait()
+
+    print(f"import main: {report['import_s']:.3f}s (best of {args.repeat})")
+    print(f"{'scenario':<10} {'/threads':>10} {'/conversations':>15} {'graph ready':>12}  graph")
+    for scenario in SCENARIOS:
+        if scenario in report:
+            s = report[scenario]
+            cells = ["-" if s[k] is None else f"{s[k]:.3f}s" for k in ("first_threads_s", "first_conversations_s", "graph_ready_s")]
+            print(f"{scenario:<10} {cells[0]:>10} {cells[1]:>15} {cells[2]:>12}  {','.join(s['graph'])}")
+
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("save", "baseline")}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = []
+        for metric in GATED:
+            section, _, key = metric.rpartition(".")
+            new = (report.get(section) or {}).get(key) if section else report.get(key)
+            old = (baseline.get(section) or {}).get(key) if section else baseline.get(key)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            if change > args.threshold:
+                failures.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+        if failures:
+            print(f"REGRESSION (threshold {args.threshold:.0%}):")
+            for failure in failures:
+                print("  " + failure)
+            return 1
+        print(f"no regression against {args.baseline} (threshold {args.threshold:.0%})")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each phase")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
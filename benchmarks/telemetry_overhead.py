@@ -0,0 +1,118 @@
+"""
+CPU cost of the instrumentation in telemetry.py against its budget (2% of a turn).
+
+Turns run the chat_node -> tools -> chat_node graph with the fake model (no delays,
+so the turn is pure CPU) on the pooled SQLite checkpointer, streamed with
+stream_mode="messages" like /chat. Measured:
+
+- the model timer (per-token callback): turns with and without it, interleaved,
+  best of `--rounds`
+- the always-on histograms (checkpoint, stream and scheduler metrics): the cost of one
+  `Histogram.observe` times the observations a turn makes
+
+    python -m benchmarks.telemetry_overhead --turns 200 --tokens 100
+
+Exits with status 1 when the total is over `--budget` (a fraction).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import TypedDict, Annotated, List
+
+from langchain_core.messages import BaseMessage, HumanMessage
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import tools_condition
+
+from benchmarks.fakes import FakeStreamingChatModel, mock_search_tool
+from metrics import Histogram
+from sqlite_pool import PooledAsyncSqliteSaver
+from telemetry import ModelTimer, Registry
+from tool_executor import ToolExecutor
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+
+
+def build_graph(checkpointer, model, tools):
+    bound = model.bind_tools(tools)
+
+    async def chat_node(state: ChatState) -> ChatState:
+        return {"messages": [await bound.ainvoke(state["messages"])]}
+
+    graph = StateGraph(ChatState)
+    graph.add_node("chat_node", chat_node)
+    graph.add_node("tools", ToolExecutor().node(tools))
+    graph.set_entry_point("chat_node")
+    graph.add_conditional_edges("chat_node", tools_condition)
+    graph.add_edge("tools", "chat_node")
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def run_turns(chatbot, turns, prefix, callbacks):
+    start = time.process_time()
+    for i in range(turns):
+        config = {"configurable": {"thread_id": f"{prefix}-{i % 20}"}}
+        if callbacks:
+            config["callbacks"] = callbacks
+        async for _ in chatbot.astream({"messages": [HumanMessage(content=f"turn {i}")]}, config=config, stream_mode="messages"):
+            pass
+    return (time.process_time() - start) / turns
+
+
+def observe_cost(n=200_000):
+    histogram = Histogram()
+    start = time.perf_counter()
+    for i in range(n):
+        histogram.observe(i * 1e-6)
+    return (time.perf_counter() - start) / n
+
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpointer = await PooledAsyncSqliteSaver.from_path(os.path.join(tmp, "overhead.db"))
+        await checkpointer.setup()
+        model = FakeStreamingChatModel(tokens=args.tokens, tokens_per_second=0, ttft=0, tool_call_ratio=0.5)
+        chatbot = build_graph(checkpointer, model, [mock_search_tool(latency=0)])
+        timer = ModelTimer(Registry())
+
+        await run_turns(chatbot, 20, "warmup", None)
+        plain, timed = [], []
+        for r in range(args.rounds):
+            plain.append(await run_turns(chatbot, args.turns, f"plain{r}", None))
+            timed.append(await run_turns(chatbot, args.turns, f"timed{r}", [timer]))
+
+        observations = checkpointer.read_times.count + checkpointer.commit_times.count + checkpointer.write_bytes.count
+        turns = 20 + 2 * args.rounds * args.turns
+        await checkpointer.aclose()
+
+    # per /chat stream: 4 stream histograms + 2 scheduler histograms
+    per_turn = observations / turns + 6
+    turn = min(plain)
+    timer_cost = max(0.0, min(timed) - turn)
+    histogram_cost = per_turn * observe_cost()
+    total = (timer_cost + histogram_cost) / turn
+
+    print(f"turn CPU time:       {turn * 1000:8.3f} ms  ({args.tokens} tokens/reply, half the turns call a tool)")
+    print(f"model timer:         {timer_cost * 1e6:8.1f} us/turn  ({timer_cost / turn:.2%})")
+    print(f"always-on histograms:{histogram_cost * 1e6:8.1f} us/turn  ({per_turn:.0f} observations, {histogram_cost / turn:.2%})")
+    print(f"total overhead:      {total:8.2%}  (budget {args.budget:.0%})")
+    return 0 if total <= args.budget else 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=0.02)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
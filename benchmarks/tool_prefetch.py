@@ -0,0 +1,98 @@
+"""
+Turn latency with and without speculative tool prefetch (tool_executor.py).
+
+Runs the async_chatbot graph on the fake model with every turn calling
+`--calls-per-turn` read-only tools: a search of `--tool-latency` seconds and a lookup of
+`--fast-tool-latency` seconds, picked per call by the fake. The arguments of each call
+stream in `--arg-tokens` chunks at `--tokens-per-second`. With prefetch a call starts as
+soon as its arguments are complete, overlapping with the rest of the message instead of
+waiting for the tools node, so a turn saves up to the time streamed after its slowest
+call (little with one call per turn, where only the final chunk follows). The
+ToolMessages of both runs are compared, so a prefetch that answered the wrong call shows
+up as a mismatch.
+
+    python -m benchmarks.tool_prefetch --turns 40 --calls-per-turn 1 3
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.messages import HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+import async_chatbot
+from benchmarks.fakes import FakeStreamingChatModel, mock_search_tool
+from tool_executor import ToolExecutor, read_only
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else float("nan")
+
+
+async def run(prefetch, calls_per_turn, args):
+    async_chatbot._compiled.clear()
+    async_chatbot.tool_executor = ToolExecutor(prefetch=prefetch)
+    async_chatbot.llm = FakeStreamingChatModel(
+        tokens=args.reply_words, tokens_per_second=args.tokens_per_second, ttft=args.ttft,
+        tool_call_ratio=1.0, tool_calls_per_turn=calls_per_turn, tool_arg_chunks=args.arg_tokens,
+        calls={}, prefixes={},
+    )
+    tools = [
+        read_only(mock_search_tool(latency=args.tool_latency)),
+        read_only(mock_search_tool(latency=args.fast_tool_latency, name="lookup")),
+    ]
+    chatbot = async_chatbot.compile_graph(tools, InMemorySaver())
+
+    latencies, results = [], []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def turn(i):
+        async with semaphore:
+            start = time.perf_counter()
+            state = await chatbot.ainvoke(
+                {"messages": [HumanMessage(content=f"look up topic {i} for me")]},
+                config={"configurable": {"thread_id": f"bench-{i}"}},
+            )
+            latencies.append(time.perf_counter() - start)
+            results.append((i, [m.content for m in state["messages"] if isinstance(m, ToolMessage)]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(turn(i) for i in range(args.turns)))
+    return {
+        "p50": percentile(latencies, .5),
+        "p95": percentile(latencies, .95),
+        "seconds": time.perf_counter() - start,
+        "results": sorted(results),
+        "prefetch": async_chatbot.tool_executor.prefetch_stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--calls-per-turn", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--tool-latency", type=float, default=0.3)
+    parser.add_argument("--fast-tool-latency", type=float, default=0.05)
+    parser.add_argument("--arg-tokens", type=int, default=16, help="chunks each call's arguments stream in")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--reply-words", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'calls':>5} {'prefetch':>8} {'turn p50 ms':>12} {'p95 ms':>7} {'saved ms/turn':>14} "
+          f"{'used':>5} {'discarded':>10} {'mismatch':>9}")
+    for calls_per_turn in args.calls_per_turn:
+        off = await run(False, calls_per_turn, args)
+        on = await run(True, calls_per_turn, args)
+        mismatches = sum(a != b for a, b in zip(off["results"], on["results"]))
+        for name, r in (("off", off), ("on", on)):
+            p = r["prefetch"]
+            print(f"{calls_per_turn:>5} {name:>8} {r['p50'] * 1e3:>12.0f} {r['p95'] * 1e3:>7.0f} "
+                  f"{(off['p50'] - r['p50']) * 1e3:>14.0f} {p['used']:>5} {p['discarded']:>10} "
+                  f"{mismatches if name == 'on' else '':>9}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
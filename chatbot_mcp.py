@@ -12,14 +12,15 @@ from langchain.tools import tool
 from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_community.tools import DuckDuckGoSearchResults
 import asyncio
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp_pool import McpSessionPool
 
 load_dotenv()
 
     
 llm = ChatOpenAI(model="gpt-4o-mini")
 
-client = MultiServerMCPClient(
+# the arith server is spawned once and its session reused across tool calls
+client = McpSessionPool(
     {
         "arith": {
             "transport": "stdio",
@@ -69,6 +70,8 @@ async def main():
     response = await chatbot.ainvoke({"messages": [HumanMessage(content="Find the modulus of 132354 and 23 and give answer like a cricket commentator.")]})
     
     print(response['messages'][-1].content)
+
+    await client.aclose()
     
     
 if __name__ == '__main__':
@@ -0,0 +1,418 @@
+"""
+Compact checkpoint serializer.
+
+Every checkpoint write serializes the whole `messages` channel, and the stock
+JsonPlusSerializer encodes each message as its full pydantic dump: module and class
+name, every default-valued field and the provider's `response_metadata` (token usage
+twice over, system fingerprint, logprobs, ...; see the `response` file). With
+CHECKPOINT_SERDE=compact, blobs are written as type "compact" instead:
+
+- messages of the known classes become (class index, non-default fields) with the field
+  and metadata key names interned to small ints; `response_metadata` entries that are
+  None or listed in CHECKPOINT_SERDE_STRIP (default: the `token_usage` copy of
+  `usage_metadata`, and `logprobs`) are dropped
+- a message's encoding is cached by a digest of its fields, so the messages every
+  checkpoint of a thread repeats are not dumped by pydantic and re-interned each time
+- the result is compressed with CHECKPOINT_SERDE_CODEC, using a built-in dictionary of
+  strings every checkpoint repeats: zstd (default when `zstandard` is installed), lz4
+  (needs `pip install lz4`), zlib or none
+
+Compact blobs start with a 3-byte header (format version, codec, dictionary), so the
+key table, codecs and dictionary can change later without breaking stored data. Blobs
+of any other type are read by JsonPlusSerializer, so existing databases keep working,
+and with CHECKPOINT_SERDE=default (new writes in the stock format) compact blobs stay
+readable. Rewrite an existing SQLite database either way with:
+
+    python checkpoint_serde.py new_chatbot.db --to compact
+    python checkpoint_serde.py new_chatbot.db --to default
+
+Compression is not free: in `python -m benchmarks.serde` compact dumps without a codec
+take about 0.7x the time of JsonPlusSerializer's, with zstd about 1.3x and with zlib
+about 2x, for blobs a sixth of the size.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+import ormsgpack
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    ChatMessage,
+    FunctionMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+# the stock encoder, for everything that is not a message
+from langgraph.checkpoint.serde.jsonplus import _msgpack_default, _option as MSGPACK_OPTION
+
+
+TYPE = "compact"
+FORMAT_VERSION = 1
+
+# ext code of a compact message; jsonplus uses 0-7
+EXT_MESSAGE = 64
+
+# Format version 1 tables. Append only: the position is what gets stored.
+MESSAGE_CLASSES = (
+    HumanMessage, AIMessage, ToolMessage, SystemMessage, AIMessageChunk,
+    RemoveMessage, ChatMessage, FunctionMessage,
+)
+KEYS = (
+    "content", "additional_kwargs", "response_metadata", "type", "name", "id",
+    "tool_calls", "invalid_tool_calls", "usage_metadata", "tool_call_id", "artifact",
+    "status", "role", "args", "error",
+    "input_tokens", "output_tokens", "total_tokens", "input_token_details",
+    "output_token_details", "audio", "cache_read", "cache_creation", "reasoning",
+    "token_usage", "completion_tokens", "prompt_tokens", "completion_tokens_details",
+    "prompt_tokens_details", "accepted_prediction_tokens", "audio_tokens",
+    "reasoning_tokens", "rejected_prediction_tokens", "cached_tokens",
+    "model_provider", "model_name", "system_fingerprint", "service_tier",
+    "finish_reason", "logprobs", "refusal", "tool_call_chunks", "index", "chunk_position",
+)
+KEY_IDS = {key: i for i, key in enumerate(KEYS)}
+
+# message fields whose nested dicts have interned keys; tool call args are user data
+INTERNED_FIELDS = ("additional_kwargs", "response_metadata", "usage_metadata")
+INTERNED_LISTS = ("tool_calls", "invalid_tool_calls", "tool_call_chunks")
+
+# Dictionary 1: strings that recur in nearly every checkpoint. Never edit it: data
+# compressed with it must stay readable. Add DICTIONARIES[2] and write that instead.
+DICTIONARIES = {
+    1: ormsgpack.packb([
+        "langgraph.checkpoint", "__start__", "chat_node", "tools", "compact_history",
+        "branch:to:chat_node", "branch:to:tools", "messages", "summary", "summarized_count",
+        "channel_values", "channel_versions", "versions_seen", "updated_channels",
+        "00000000000000000000000000000001.0", "0.0",
+        "openai", "gpt-4o-mini", "gpt-4o-mini-2024-07-18", "default", "stop", "tool_calls",
+        "tool_call", "success", "error", "lc_run--", "call_", "chatcmpl-", "fp_",
+        "duckduckgo_results_json", "get_current_datetime", "create_note", "list_notes",
+        "create_task", "list_tasks", "query", "snippet: ", ", title: ", ", link: https://",
+        "https://www.", ".com/", "T00:00:00", "+00:00",
+    ]),
+}
+
+CODECS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+CODEC_NAMES = {v: k for k, v in CODECS.items()}
+
+DEFAULT_STRIP = ("token_usage", "logprobs")
+
+
+def default_codec() -> str:
+    try:
+        import zstandard  # noqa: F401
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+
+class _Uninternable(Exception):
+    """A dict in an interned field has a non-string key."""
+
+
+def _intern(value):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise _Uninternable(key)
+            out[KEY_IDS.get(key, key)] = _intern(item)
+        return out
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    return value
+
+
+def _extern(value):
+    if isinstance(value, dict):
+        return {KEYS[key] if isinstance(key, int) else key: _extern(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_extern(item) for item in value]
+    return value
+
+
+def _intern_call(call):
+    if not isinstance(call, dict) or not all(isinstance(k, str) for k in call):
+        raise _Uninternable(call)
+    return {KEY_IDS.get(k, k): v for k, v in call.items()}
+
+
+def _extern_call(call):
+    return {KEYS[k] if isinstance(k, int) else k: v for k, v in call.items()}
+
+
+class _Codec:
+    """Compress/decompress with one codec and dictionary; per-thread (de)compressor objects."""
+
+    def __init__(self, name: str, dictionary: bytes, level: int):
+        self.name = name
+        self.dictionary = dictionary
+        self.level = level
+        self._local = threading.local()
+        if name == "zstd":
+            import zstandard
+
+            self._zstd = zstandard
+            self._zdict = zstandard.ZstdCompressionDict(dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        elif name == "lz4":
+            import lz4.block
+
+            self._lz4 = lz4.block
+        elif name not in ("zlib", "none"):
+            raise ValueError(f"Unknown CHECKPOINT_SERDE_CODEC {name!r}, expected one of {tuple(CODECS)}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            compressor = getattr(self._local, "compressor", None)
+            if compressor is None:
+                compressor = self._local.compressor = self._zstd.ZstdCompressor(
+                    level=self.level, dict_data=self._zdict, write_content_size=True, write_checksum=False,
+                )
+            return compressor.compress(data)
+        if self.name == "lz4":
+            return self._lz4.compress(data, dict=self.dictionary)
+        if self.name == "zlib":
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+            return compressor.compress(data) + compressor.flush()
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            decompressor = getattr(self._local, "decompressor", None)
+            if decompressor is None:
+                decompressor = self._local.decompressor = self._zstd.ZstdDecompressor(dict_data=self._zdict)
+            return decompressor.decompress(data)
+        if self.name == "lz4":
+            return self._lz4.decompress(data, dict=self.dictionary)
+        if self.name == "zlib":
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+            return decompressor.decompress(data) + decompressor.flush()
+        return data
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    JsonPlusSerializer that writes the compact format (see module docstring) and reads
+    both. With `compact=False` it writes exactly what JsonPlusSerializer writes.
+    """
+
+    def __init__(
+        self,
+        *,
+        compact: bool = True,
+        codec: str | None = None,
+        level: int = 3,
+        strip=DEFAULT_STRIP,
+        min_size: int = 64,
+        memo_size: int = 4096,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.compact = compact
+        self.codec_name = codec or default_codec()
+        if self.codec_name not in CODECS:
+            raise ValueError(f"Unknown CHECKPOINT_SERDE_CODEC {self.codec_name!r}, expected one of {tuple(CODECS)}")
+        self.level = level
+        self.dictionary_id = max(DICTIONARIES)
+        self.strip = frozenset(strip)
+        # below this size compression costs more than it saves
+        self.min_size = min_size
+        self.memo_size = memo_size
+        self._codecs: dict[tuple[int, int], _Codec] = {}
+        self._writer = self._codec(CODECS[self.codec_name], self.dictionary_id) if compact else None
+        # (class id, digest of the message's plain msgpack) -> its encoded Ext; see `_default`
+        self._memo: OrderedDict[tuple, ormsgpack.Ext] = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        raw = os.getenv("CHECKPOINT_SERDE_STRIP", ",".join(DEFAULT_STRIP))
+        return cls(
+            compact=os.getenv("CHECKPOINT_SERDE", "default").lower() == "compact",
+            codec=os.getenv("CHECKPOINT_SERDE_CODEC") or None,
+            level=int(os.getenv("CHECKPOINT_SERDE_LEVEL", "3")),
+            strip=[] if raw.strip() == "none" else [s.strip() for s in raw.split(",") if s.strip()],
+        )
+
+    def _codec(self, codec_id: int, dictionary_id: int) -> _Codec:
+        key = (codec_id, dictionary_id)
+        codec = self._codecs.get(key)
+        if codec is None:
+            if codec_id not in CODEC_NAMES or dictionary_id not in DICTIONARIES:
+                raise ValueError(f"Unknown compact blob codec {codec_id} / dictionary {dictionary_id}")
+            codec = self._codecs[key] = _Codec(CODEC_NAMES[codec_id], DICTIONARIES[dictionary_id], self.level)
+        return codec
+
+    # ---------------------------- Encoding ----------------------------
+
+    def _fields(self, msg):
+        fields = msg.model_dump(exclude_defaults=True)
+        fields.pop("type", None)
+        metadata = fields.get("response_metadata")
+        if metadata:
+            metadata = {k: v for k, v in metadata.items() if v is not None and k not in self.strip}
+            if metadata:
+                fields["response_metadata"] = metadata
+            else:
+                del fields["response_metadata"]
+        extra = fields.get("additional_kwargs")
+        if extra:
+            extra = {k: v for k, v in extra.items() if v is not None}
+            if extra:
+                fields["additional_kwargs"] = extra
+            else:
+                del fields["additional_kwargs"]
+
+        packed = {}
+        for key, value in fields.items():
+            if key in INTERNED_FIELDS:
+                value = _intern(value)
+            elif key in INTERNED_LISTS:
+                value = [_intern_call(call) for call in value]
+            packed[KEY_IDS.get(key, key)] = value
+        return packed
+
+    def _default(self, obj):
+        class_id = MESSAGE_IDS.get(type(obj))
+        if class_id is None:
+            return _msgpack_default(obj)
+        # keyed on the content, not the object: messages are mutable (add_messages assigns
+        # ids in place after the input was written), so the same object can change. The
+        # fields are plain data, so msgpack of the instance dict is a full copy of them.
+        try:
+            plain = ormsgpack.packb((obj.__dict__, obj.__pydantic_extra__), default=_msgpack_default, option=MSGPACK_OPTION)
+            key = (class_id, hashlib.blake2b(plain, digest_size=16).digest())
+        except ormsgpack.MsgpackEncodeError:
+            key = None
+        if key is not None:
+            with self._memo_lock:
+                ext = self._memo.get(key)
+                if ext is not None:
+                    self._memo.move_to_end(key)
+                    return ext
+        try:
+            fields = self._fields(obj)
+        except _Uninternable:
+            return _msgpack_default(obj)
+        ext = ormsgpack.Ext(EXT_MESSAGE, ormsgpack.packb((class_id, fields), default=self._default, option=MSGPACK_OPTION))
+        if key is not None and self.memo_size:
+            with self._memo_lock:
+                self._memo[key] = ext
+                if len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        return ext
+
+    def dumps_typed(self, obj):
+        if not self.compact or obj is None or isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+        try:
+            body = ormsgpack.packb(obj, default=self._default, option=MSGPACK_OPTION)
+        except ormsgpack.MsgpackEncodeError:
+            # pickle fallback (if enabled) or the error, as JsonPlusSerializer does
+            return super().dumps_typed(obj)
+        codec_id, dictionary_id = CODECS[self.codec_name], self.dictionary_id
+        if len(body) < self.min_size or codec_id == 0:
+            codec_id, dictionary_id = 0, 0
+        else:
+            body = self._writer.compress(body)
+        return TYPE, bytes((FORMAT_VERSION, codec_id, dictionary_id)) + body
+
+    # ---------------------------- Decoding ----------------------------
+
+    def _ext_hook(self, code, data):
+        if code != EXT_MESSAGE:
+            return self._unpack_ext_hook(code, data)
+        class_id, fields = ormsgpack.unpackb(data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+        kwargs = {}
+        for key, value in fields.items():
+            key = KEYS[key] if isinstance(key, int) else key
+            if key in INTERNED_FIELDS:
+                value = _extern(value)
+            elif key in INTERNED_LISTS:
+                value = [_extern_call(call) for call in value]
+            kwargs[key] = value
+        return MESSAGE_CLASSES[class_id](**kwargs)
+
+    def loads_typed(self, data):
+        type_, blob = data
+        if type_ != TYPE:
+            return super().loads_typed(data)
+        version, codec_id, dictionary_id = blob[0], blob[1], blob[2]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact checkpoint format version {version}")
+        body = blob[3:]
+        if codec_id:
+            body = self._codec(codec_id, dictionary_id).decompress(body)
+        return ormsgpack.unpackb(body, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+
+MESSAGE_IDS = {cls: i for i, cls in enumerate(MESSAGE_CLASSES)}
+
+
+def serializer_from_env():
+    """The checkpoint serializer for CHECKPOINT_SERDE / CHECKPOINT_SERDE_* (see module docstring)."""
+    return CompactSerializer.from_env()
+
+
+# ---------------------------- Rewrite ----------------------------
+
+# (table, type column, value column)
+BLOB_COLUMNS = (
+    ("checkpoints", "type", "checkpoint"),
+    ("writes", "type", "value"),
+    ("message_store", "type", "value"),
+)
+
+
+def rewrite(path: str, serde: CompactSerializer, batch: int = 500) -> int:
+    """Re-encode every blob of a SQLite checkpoint database with `serde`. Returns blobs rewritten."""
+    conn = sqlite3.connect(path)
+    rewritten = 0
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, type_column, value_column in BLOB_COLUMNS:
+            if table not in tables:
+                continue
+            # message_store dedupes by a digest of the blob (see message_store.py)
+            digest = ", digest = ?" if table == "message_store" else ""
+            rowids = [row[0] for row in conn.execute(f"SELECT rowid FROM {table}")]
+            for i in range(0, len(rowids), batch):
+                chunk = rowids[i:i + batch]
+                rows = conn.execute(
+                    f"SELECT rowid, {type_column}, {value_column} FROM {table} WHERE rowid IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                updates = []
+                for rowid, type_, value in rows:
+                    new_type, new_value = serde.dumps_typed(serde.loads_typed((type_, value)))
+                    if (new_type, new_value) == (type_, value):
+                        continue
+                    extra = [hashlib.blake2b(new_value, digest_size=16).hexdigest()] if digest else []
+                    updates.append((new_type, new_value, *extra, rowid))
+                with conn:
+                    conn.executemany(
+                        f"UPDATE {table} SET {type_column} = ?, {value_column} = ?{digest} WHERE rowid = ?", updates
+                    )
+                rewritten += len(updates)
+        conn.execute("VACUUM")
+        return rewritten
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode the checkpoint blobs of SQLite databases.")
+    parser.add_argument("db", nargs="+")
+    parser.add_argument("--to", choices=("compact", "default"), required=True)
+    parser.add_argument("--codec", choices=tuple(CODECS), default=None)
+    args = parser.parse_args()
+    serde = CompactSerializer(compact=args.to == "compact", codec=args.codec)
+    for path in args.db:
+        print(f"{path}: rewrote {rewrite(path, serde)} blobs")
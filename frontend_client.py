@@ -0,0 +1,256 @@
+"""
+Chat backends for the Streamlit frontends.
+
+The frontends used to run the sync graph (`chatbot.stream`) on the script thread of every
+session, read a conversation with two `get_state` calls and reload the thread list once
+per session. They now go through one of these backends, picked by `FRONTEND_BACKEND`:
+
+    local      (default)  the frontend's own sync graph module, as before
+    http                  the FastAPI app (main.py): POST /chat (SSE), GET /threads and
+                          GET /conversations/{id} on BACKEND_URL. Turns are scheduled,
+                          coalesced and checkpointed by the server.
+    inprocess             the async graph of async_chatbot.py, built once per process and
+                          run on one background event loop shared by every session
+
+All three speak the same dicts: stream events and conversation messages are the
+`message_payload()` objects /chat and /conversations send (see sse_encoder.py), so the
+frontends render them the same way whatever the mode. A full turn queue raises
+`SchedulerFull` in every mode.
+
+The frontends cache `threads()` and `messages()` with `st.cache_data` for
+`FRONTEND_CACHE_TTL` seconds and clear the entries of a thread when one of its turns
+completes (see `cache_ttl()`).
+"""
+import asyncio
+import importlib
+import json
+import os
+import queue
+import threading
+
+from turn_scheduler import SchedulerFull, turn_scheduler
+
+
+MODES = ("local", "http", "inprocess")
+
+
+def cache_ttl() -> float:
+    return float(os.getenv("FRONTEND_CACHE_TTL", "30"))
+
+
+def chat_history(messages) -> list[dict]:
+    """
+    The `{"role": "user" | "assistant", "content"}` entries the frontends display:
+    tool calls and tool results are left out.
+    """
+    history = []
+    for msg in messages:
+        if msg.get("role") == "tool" or msg.get("tool_calls"):
+            continue
+        role = "user" if msg.get("role") == "human" else "assistant"
+        history.append({"role": role, "content": msg.get("content") or ""})
+    return history
+
+
+def _turn_config(thread_id):
+    return {
+        "configurable": {"thread_id": thread_id},
+        "metadata": {"thread_id": thread_id},
+        "run_name": "chat_turn",
+    }
+
+
+def _payloads(stream):
+    """`message_payload()` dicts for the `(chunk, metadata)` items of a graph stream; empty text deltas are dropped."""
+    from sse_encoder import message_payload
+
+    for message_chunk, _metadata in stream:
+        payload = message_payload(message_chunk)
+        if payload["role"] == "ai" and not payload["content"] and len(payload) == 2:
+            continue
+        yield payload
+
+
+# ---------------------------- Local (sync graph) ----------------------------
+
+class LocalBackend:
+    """The frontend's own sync graph module (e.g. `langgraph_sqlit_tools_backened`), run on the calling thread."""
+
+    mode = "local"
+
+    def __init__(self, module_name: str):
+        self.module = importlib.import_module(module_name)
+        self.chatbot = self.module.chatbot
+
+    def threads(self) -> list[str]:
+        retrieve_all_threads = getattr(self.module, "retrieve_all_threads", None)
+        if retrieve_all_threads is None:
+            return []
+        # retrieve_all_threads lists them least recently updated first
+        return [str(t) for t in retrieve_all_threads()][::-1]
+
+    def messages(self, thread_id: str) -> list[dict]:
+        from sse_encoder import message_payload
+
+        state = self.chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
+        return [message_payload(m) for m in state.values.get("messages", [])]
+
+    def stream(self, thread_id: str, message: str):
+        from langchain_core.messages import HumanMessage
+
+        # one turn per thread at a time, and a global cap shared by all sessions
+        with turn_scheduler().turn(thread_id):
+            yield from _payloads(self.chatbot.stream(
+                {"messages": [HumanMessage(content=message)]},
+                config=_turn_config(thread_id),
+                stream_mode="messages",
+            ))
+
+
+# ---------------------------- HTTP (FastAPI /chat) ----------------------------
+
+class HttpBackend:
+    """Client of the FastAPI app; one connection pool per process."""
+
+    mode = "http"
+
+    def __init__(self, base_url: str, threads_limit: int = 100):
+        import httpx
+
+        self.threads_limit = threads_limit
+        self.client = httpx.Client(base_url=base_url, timeout=httpx.Timeout(10.0, read=None))
+
+    def threads(self) -> list[str]:
+        response = self.client.get("/threads", params={"limit": self.threads_limit})
+        response.raise_for_status()
+        return response.json()["threads"]
+
+    def messages(self, thread_id: str) -> list[dict]:
+        response = self.client.get(f"/conversations/{thread_id}", params={"fields": "role,content,tool_calls"})
+        response.raise_for_status()
+        data = response.json()
+        if "error" in data:
+            raise RuntimeError(data["error"])
+        return data["messages"]
+
+    def stream(self, thread_id: str, message: str):
+        with self.client.stream("POST", "/chat", json={"thread_id": thread_id, "message": message}) as response:
+            if response.status_code == 429:
+                response.read()
+                raise SchedulerFull(float(response.json().get("retry_after", 1.0)))
+            if response.status_code != 200:
+                response.read()
+                raise RuntimeError(f"/chat failed with {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if not line.startswith("data: "):
+                    # blank separators and ": ping" heartbeats
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    return
+                yield json.loads(data)
+
+
+# ---------------------------- In-process (shared async graph) ----------------------------
+
+_DONE = object()
+
+
+class InProcessBackend:
+    """
+    The async graph of async_chatbot.py on a background event loop thread. Every
+    Streamlit session submits its turns to that loop, so the model calls of concurrent
+    sessions overlap instead of each holding a script thread for the whole turn.
+    """
+
+    mode = "inprocess"
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="frontend-graph-loop", daemon=True)
+        self.thread.start()
+        self.chatbot, self.checkpointer = self.run(self._build())
+
+    async def _build(self):
+        from async_chatbot import build_graph
+
+        return await build_graph()
+
+    def run(self, coro):
+        """Run a coroutine on the shared loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def threads(self) -> list[str]:
+        threads, _next = self.run(self.checkpointer.alist_threads())
+        return [t["thread_id"] for t in threads]
+
+    def messages(self, thread_id: str) -> list[dict]:
+        from sse_encoder import message_payload
+
+        _checkpoint_id, _total, _start, messages = self.run(self.checkpointer.aget_messages(thread_id))
+        return [message_payload(m) for m in messages]
+
+    async def _turn(self, thread_id, message, out):
+        from langchain_core.messages import HumanMessage
+
+        try:
+            async with turn_scheduler().aturn(thread_id):
+                stream = self.chatbot.astream(
+                    {"messages": [HumanMessage(content=message)]},
+                    config=_turn_config(thread_id),
+                    stream_mode="messages",
+                )
+                async for item in stream:
+                    for payload in _payloads([item]):
+                        out.put(payload)
+                # end of turn: commit the turn's checkpoints if durability is "batched"
+                await self.checkpointer.aflush()
+        except BaseException as e:
+            out.put(e)
+            raise
+        finally:
+            out.put(_DONE)
+
+    def stream(self, thread_id: str, message: str):
+        out = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._turn(thread_id, message, out), self.loop)
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # the session stopped reading (rerun, closed tab): cancel the run
+            future.cancel()
+
+
+# ---------------------------- Process-wide backend ----------------------------
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def frontend_backend(local_module: str):
+    """
+    The process-wide backend for `FRONTEND_BACKEND`; `local_module` is the sync graph
+    module the frontend runs in "local" mode.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            mode = os.getenv("FRONTEND_BACKEND", "local")
+            if mode == "http":
+                _backend = HttpBackend(
+                    os.getenv("BACKEND_URL", "http://127.0.0.1:8080"),
+                    threads_limit=int(os.getenv("FRONTEND_THREADS_LIMIT", "100")),
+                )
+            elif mode == "inprocess":
+                _backend = InProcessBackend()
+            elif mode == "local":
+                _backend = LocalBackend(local_module)
+            else:
+                raise ValueError(f"Unknown FRONTEND_BACKEND {mode!r}, expected one of {MODES}")
+        return _backend
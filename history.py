@@ -0,0 +1,300 @@
+"""
+Context-window management for long threads.
+
+`chat_node` used to send the whole `state["messages"]` to the model on every call, so
+prompt size and time to first token grew with the thread. `HistoryManager` decides what
+the model actually sees, with strategies that can be combined:
+
+- "trim_tools": tool outputs older than the last `keep_tool_turns` turns are cut to
+  `tool_output_chars` characters
+- "window": only the most recent whole turns that fit in `max_tokens` are sent
+- "summarize": turns that fall out of the token budget are folded into a rolling summary kept
+  in state (`summary` / `summarized_count`) by the `compact_history` graph node
+
+The stored history is never modified; only the prompt is. Token counts are cached per
+message id, so each turn only counts the messages it added.
+
+With `stable_prefix` (the default) prompts are append-only between rebases, so the
+provider's prompt cache keeps hitting: the window start and the tool output trimming
+frontier only move to *breakpoints*, the turn starts where the thread's running token
+count crosses a multiple of `rebase_tokens` (max_tokens / 4 by default). A sliding
+window instead moves the start on every turn once the budget is reached, and trimming
+rewrites the previous turn's tool output, so every prompt differs from the previous one
+early on and the cache only covers the system prompt.
+
+Configured from the environment by `HistoryManager.from_env()`:
+
+    HISTORY_STRATEGY=window,summarize,trim_tools   ("none" sends the full history)
+    HISTORY_MAX_TOKENS=16000
+    HISTORY_TOOL_OUTPUT_CHARS=2000
+    HISTORY_KEEP_TOOL_TURNS=1
+    HISTORY_STABLE_PREFIX=true
+    HISTORY_REBASE_TOKENS=4000
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.constants import TAG_NOSTREAM
+
+
+STRATEGIES = ("window", "summarize", "trim_tools")
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages below. Keep facts, names, numbers, decisions "
+    "and open tasks; drop pleasantries. Reply with the updated summary only."
+)
+
+# per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# ---------------------------- Token counting ----------------------------
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                # tiktoken missing or its BPE file can't be fetched: estimate instead
+                _encoding = False
+        return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _message_text(msg) -> str:
+    content = msg.content if isinstance(msg.content, str) else str(msg.content)
+    tool_calls = getattr(msg, "tool_calls", None)
+    if tool_calls:
+        content += str([(tc["name"], tc["args"]) for tc in tool_calls])
+    return content
+
+
+class TokenCounter:
+    """Token counts of messages, cached by message id (bounded LRU)."""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, msg) -> int:
+        key = getattr(msg, "id", None)
+        if key is not None:
+            with self._lock:
+                cached = self._counts.get(key)
+                if cached is not None:
+                    self._counts.move_to_end(key)
+                    return cached
+        tokens = count_text_tokens(_message_text(msg)) + MESSAGE_OVERHEAD_TOKENS
+        if key is not None:
+            with self._lock:
+                self._counts[key] = tokens
+                while len(self._counts) > self.max_entries:
+                    self._counts.popitem(last=False)
+        return tokens
+
+    def total(self, messages) -> int:
+        return sum(self.count(m) for m in messages)
+
+
+# ---------------------------- History manager ----------------------------
+
+class HistoryManager:
+    """Builds the model prompt from the thread state and runs the `compact_history` node."""
+
+    def __init__(
+        self,
+        strategies=("window", "trim_tools"),
+        max_tokens: int = 16000,
+        tool_output_chars: int = 2000,
+        keep_tool_turns: int = 1,
+        summary_min_tokens: int | None = None,
+        counter: TokenCounter | None = None,
+        stable_prefix: bool = True,
+        rebase_tokens: int | None = None,
+    ):
+        unknown = set(strategies) - set(STRATEGIES)
+        if unknown:
+            raise ValueError(f"Unknown history strategies: {sorted(unknown)}")
+        self.strategies = set(strategies)
+        self.max_tokens = max_tokens
+        self.tool_output_chars = tool_output_chars
+        self.keep_tool_turns = keep_tool_turns
+        # fold dropped turns into the summary in batches, not on every turn
+        self.summary_min_tokens = max_tokens // 4 if summary_min_tokens is None else summary_min_tokens
+        self.counter = counter or TokenCounter()
+        self.stable_prefix = stable_prefix
+        self.rebase_tokens = max(1, max_tokens // 4 if rebase_tokens is None else rebase_tokens)
+
+    @classmethod
+    def from_env(cls):
+        raw = os.getenv("HISTORY_STRATEGY", "window,summarize,trim_tools")
+        strategies = [] if raw.strip() == "none" else [s.strip() for s in raw.split(",") if s.strip()]
+        return cls(
+            strategies=strategies,
+            max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "16000")),
+            tool_output_chars=int(os.getenv("HISTORY_TOOL_OUTPUT_CHARS", "2000")),
+            keep_tool_turns=int(os.getenv("HISTORY_KEEP_TOOL_TURNS", "1")),
+            stable_prefix=os.getenv("HISTORY_STABLE_PREFIX", "true").lower() in ("1", "true", "yes"),
+            rebase_tokens=int(os.getenv("HISTORY_REBASE_TOKENS", "0")) or None,
+        )
+
+    # ---------------------------- Prompt selection ----------------------------
+
+    @staticmethod
+    def _turn_starts(messages):
+        return [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+
+    def _breakpoints(self, messages):
+        """Turn starts where the running token count crosses a multiple of `rebase_tokens`, first to last."""
+        points, used, mark = [], 0, self.rebase_tokens
+        starts = set(self._turn_starts(messages))
+        for i, msg in enumerate(messages):
+            if i in starts and used >= mark:
+                points.append(i)
+                mark = (used // self.rebase_tokens + 1) * self.rebase_tokens
+            used += self.counter.count(msg)
+        return points
+
+    def _trim_tools(self, messages):
+        if "trim_tools" not in self.strategies:
+            return messages
+        starts = self._turn_starts(messages)
+        if len(starts) <= self.keep_tool_turns:
+            return messages
+        recent_from = starts[-self.keep_tool_turns] if self.keep_tool_turns else len(messages)
+        if self.stable_prefix:
+            # trim up to the last breakpoint only, so older prompts stay prefixes of this one
+            recent_from = max((p for p in self._breakpoints(messages) if p <= recent_from), default=0)
+        trimmed = []
+        for i, msg in enumerate(messages):
+            if i < recent_from and isinstance(msg, ToolMessage) and isinstance(msg.content, str) \
+                    and len(msg.content) > self.tool_output_chars:
+                omitted = len(msg.content) - self.tool_output_chars
+                msg = msg.model_copy(update={
+                    "content": msg.content[: self.tool_output_chars] + f"\n[... {omitted} characters of old tool output omitted]",
+                    # distinct id so the trimmed copy gets its own cached token count
+                    "id": f"{msg.id}:trimmed" if msg.id else None,
+                })
+            trimmed.append(msg)
+        return trimmed
+
+    def _window_start(self, messages, budget):
+        """
+        Index of the first message of the most recent whole turns that fit in `budget`;
+        with `stable_prefix`, the earliest breakpoint that fits (if any does).
+        """
+        if self.stable_prefix:
+            tail = self.counter.total(messages)
+            done = 0
+            for point in [0, *self._breakpoints(messages)]:
+                tail -= self.counter.total(messages[done:point])
+                done = point
+                if tail <= budget:
+                    return point
+        starts = self._turn_starts(messages)
+        if not starts:
+            return 0
+        used = 0
+        cut = len(messages)
+        for start in reversed(starts):
+            used += self.counter.total(messages[start:cut])
+            if used > budget and cut != len(messages):
+                return cut
+            cut = start
+        return 0
+
+    def select(self, state, system_prompt: str | BaseMessage | None = None):
+        """
+        The messages to send to the model for this state (system prompt included). Pass
+        a prebuilt SystemMessage (see prompt_cache.PromptPrefix) to send the same object,
+        and so the same bytes, on every call.
+        """
+        summarized = state.get("summarized_count", 0) or 0
+        summary = state.get("summary") or ""
+        messages = self._trim_tools(state["messages"][summarized:])
+
+        prefix = []
+        if isinstance(system_prompt, BaseMessage):
+            prefix.append(system_prompt)
+        elif system_prompt:
+            prefix.append(SystemMessage(content=system_prompt))
+        # after the system prompt: a new summary leaves the system prompt and tools cached
+        if summary:
+            prefix.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+
+        if "window" not in self.strategies:
+            return prefix + messages
+        budget = self.max_tokens - sum(count_text_tokens(m.content) for m in prefix)
+        return prefix + messages[self._window_start(messages, budget):]
+
+    def prompt_tokens(self, messages) -> int:
+        return self.counter.total(messages)
+
+    # ---------------------------- Summarization node ----------------------------
+
+    def _pending_summary(self, state):
+        """(messages to fold into the summary, new summarized_count) or None."""
+        if "summarize" not in self.strategies:
+            return None
+        summarized = state.get("summarized_count", 0) or 0
+        messages = self._trim_tools(state["messages"][summarized:])
+        summary_tokens = count_text_tokens(state.get("summary") or "")
+        cut = self._window_start(messages, self.max_tokens - summary_tokens)
+        if cut == 0 or self.counter.total(messages[:cut]) < self.summary_min_tokens:
+            return None
+        return messages[:cut], summarized + cut
+
+    def _summary_request(self, state, dropped):
+        transcript = "\n".join(f"{m.type}: {_message_text(m)}" for m in dropped)
+        previous = state.get("summary") or "(empty)"
+        return [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{previous}\n\nNew messages:\n{transcript}"),
+        ]
+
+    def node(self, llm):
+        """Sync `compact_history` node: folds turns that left the window into `summary`."""
+        # summary tokens are internal, keep them out of stream_mode="messages"
+        llm = llm.with_config(tags=[TAG_NOSTREAM])
+
+        def compact_history(state):
+            pending = self._pending_summary(state)
+            if pending is None:
+                return {}
+            dropped, summarized_count = pending
+            response = llm.invoke(self._summary_request(state, dropped))
+            return {"summary": response.content, "summarized_count": summarized_count}
+
+        return compact_history
+
+    def anode(self, llm):
+        """Async `compact_history` node."""
+        llm = llm.with_config(tags=[TAG_NOSTREAM])
+
+        async def compact_history(state):
+            pending = self._pending_summary(state)
+            if pending is None:
+                return {}
+            dropped, summarized_count = pending
+            response = await llm.ainvoke(self._summary_request(state, dropped))
+            return {"summary": response.content, "summarized_count": summarized_count}
+
+        return compact_history
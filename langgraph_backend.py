@@ -4,7 +4,8 @@ from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, HumanMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import InMemorySaver
-from langchain_openai import ChatOpenAI
+from llm_cache import cached
+from model_router import routed_chat_model
 import os
 from dotenv import load_dotenv
 
@@ -13,7 +14,7 @@ load_dotenv()
 class ChatState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
     
-llm = ChatOpenAI(model="gpt-4o-mini")
+llm = cached(routed_chat_model())
 
 def chat_node(state: ChatState) -> ChatState:
     messages = state["messages"]
@@ -3,23 +3,34 @@ from typing import TypedDict, Annotated, List
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, HumanMessage
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_openai import ChatOpenAI
+from thread_catalog import CatalogSqliteSaver, list_threads, MAX_PAGE_SIZE
+from llm_cache import cached
+from model_router import routed_chat_model
+from history import HistoryManager
+from tool_executor import ToolExecutor
+from tool_cache import cacheable, text_key, tool_cache
 import os
 from dotenv import load_dotenv
 import sqlite3
 from langchain.tools import tool
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.prebuilt import tools_condition
 from langchain_community.tools import DuckDuckGoSearchResults
 
 load_dotenv()
 
 class ChatState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
+    # rolling summary of the turns before messages[summarized_count:] (see history.py)
+    summary: str
+    summarized_count: int
     
-llm = ChatOpenAI(model="gpt-4o-mini")
+llm = cached(routed_chat_model())
 
-search_tool = DuckDuckGoSearchResults()
+search_tool = cacheable(
+    DuckDuckGoSearchResults(),
+    ttl=float(os.getenv("TOOL_CACHE_SEARCH_TTL", "600")),
+    key=text_key,
+)
 
 @tool
 def calculator(a:int, b: int, operation: str):
@@ -43,25 +54,31 @@ def calculator(a:int, b: int, operation: str):
     except Exception as e:
         return {"error": str(e)}
     
-tools = [calculator, search_tool]
+# calculator is deterministic: its results never expire
+tools = [cacheable(calculator), search_tool]
+
+tool_executor = ToolExecutor(cache=tool_cache())
 
 llm_with_tools = llm.bind_tools(tools)
 
+history = HistoryManager.from_env()
+
 def chat_node(state: ChatState) -> ChatState:
-    messages = state["messages"]
-    response = llm_with_tools.invoke(messages)
+    response = llm_with_tools.invoke(history.select(state))
     return {"messages": [response]}
 
 
 conn = sqlite3.connect(database="chatbot.db", check_same_thread=False)
 
-checkpointer = SqliteSaver(conn=conn)
+checkpointer = CatalogSqliteSaver(conn=conn)
 
 graph = StateGraph(ChatState)
 
+graph.add_node("compact_history", history.node(llm))
 graph.add_node("chat_node", chat_node)
-graph.add_node("tools", ToolNode(tools))
-graph.set_entry_point("chat_node")
+graph.add_node("tools", tool_executor.node(tools))
+graph.set_entry_point("compact_history")
+graph.add_edge("compact_history", "chat_node")
 graph.add_conditional_edges("chat_node", tools_condition)
 graph.add_edge("tools", "chat_node")
 
@@ -70,10 +87,14 @@ graph.add_edge("tools", "chat_node")
 chatbot = graph.compile(checkpointer= checkpointer)
 
 def retrieve_all_threads():
-    threads = []
-    for cp in checkpointer.list(None):   # already in creation order
-        tid = cp.config["configurable"]["thread_id"]
-        if tid not in threads:
-            threads.append(tid)
+    threads, after = [], None
+    with checkpointer.cursor(transaction=False) as cur:
+        # every thread, one catalog page at a time
+        while True:
+            page, after = list_threads(cur, limit=MAX_PAGE_SIZE, after=after)
+            threads.extend(t["thread_id"] for t in page)
+            if after is None:
+                break
+    # catalog pages are most recently updated first; the sidebar reverses this list
     return threads[::-1]
 
@@ -0,0 +1,392 @@
+"""
+Response cache in front of the chat model.
+
+`CachedChatModel` wraps any chat model (e.g. `ChatOpenAI`) and answers repeated
+prompts from a `ResponseCache` instead of calling the provider:
+
+- exact tier: keyed on the normalized message list plus a hash of the bound tool schemas
+- semantic tier (optional): same conversation prefix and an embedding of the last user
+  message within `similarity` of a cached one, searched in a small local vector index
+
+Both tiers share one LRU with a TTL and a memory cap. Hits are replayed as a stream of
+chunks, so `/chat` SSE output looks the same as a live model response.
+
+Configured from the environment by `cached()`:
+
+    LLM_CACHE=true|false            (default true)
+    LLM_CACHE_TTL=3600              seconds
+    LLM_CACHE_MAX_BYTES=67108864    memory cap for cached responses
+    LLM_CACHE_SEMANTIC=false        enable the embedding tier (uses OpenAIEmbeddings)
+    LLM_CACHE_SIMILARITY=0.95
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.callbacks import CallbackManager
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.constants import TAG_NOSTREAM
+
+
+_WS = re.compile(r"\s+")
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+def _normalize_text(content) -> str:
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, default=str)
+    return _WS.sub(" ", content).strip().casefold()
+
+
+def _normalize_message(msg: BaseMessage):
+    item = [msg.type, _normalize_text(msg.content)]
+    tool_calls = getattr(msg, "tool_calls", None)
+    if tool_calls:
+        item.append([[tc["name"], tc["args"]] for tc in tool_calls])
+    if getattr(msg, "name", None):
+        item.append(msg.name)
+    return item
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def tools_hash(tools) -> str:
+    return _digest([convert_to_openai_tool(t) for t in tools])
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "bucket", "vector")
+
+    def __init__(self, value, expires_at, size, bucket=None, vector=None):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.bucket = bucket
+        self.vector = vector
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses with LRU + TTL eviction and a memory cap.
+    Thread-safe, so one instance can be shared by the sync and async backends.
+    """
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 64 * 1024 * 1024, embeddings=None, similarity: float = 0.95):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.embeddings = embeddings
+        self.similarity = similarity
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # semantic tier: conversation-prefix bucket -> {exact key: unit vector}
+        self._index: dict[str, dict[str, list[float]]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------------------------- Keys ----------------------------
+
+    @staticmethod
+    def keys(messages, scope: str):
+        """(exact key, semantic bucket, text to embed) for a prompt."""
+        normalized = [_normalize_message(m) for m in messages]
+        exact = _digest([scope, normalized])
+        if messages and isinstance(messages[-1], HumanMessage):
+            return exact, _digest([scope, normalized[:-1]]), normalized[-1][1]
+        return exact, None, None
+
+    # ---------------------------- Lookup / store ----------------------------
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.bucket is not None:
+            bucket = self._index.get(entry.bucket, {})
+            bucket.pop(key, None)
+            if not bucket:
+                self._index.pop(entry.bucket, None)
+
+    def lookup_exact(self, key):
+        with self._lock:
+            entry = self._get(key, time.monotonic())
+            if entry is not None:
+                self.hits_exact += 1
+                return entry.value
+            return None
+
+    def lookup_similar(self, bucket, vector):
+        with self._lock:
+            best_key, best = None, self.similarity
+            for key, other in self._index.get(bucket, {}).items():
+                score = sum(a * b for a, b in zip(vector, other))
+                if score >= best:
+                    best_key, best = key, score
+            if best_key is not None:
+                entry = self._get(best_key, time.monotonic())
+                if entry is not None:
+                    self.hits_semantic += 1
+                    return entry.value
+            return None
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self, key, value, bucket=None, vector=None):
+        size = len(json.dumps(value, default=str)) + (len(vector) * 8 if vector else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if vector is not None and bucket is not None:
+                self._index.setdefault(bucket, {})[key] = vector
+            else:
+                bucket = None
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, size, bucket, vector)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    # ---------------------------- Embeddings ----------------------------
+
+    @staticmethod
+    def _unit(vector):
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed(self, text):
+        return self._unit(self.embeddings.embed_query(text))
+
+    async def aembed(self, text):
+        return self._unit(await self.embeddings.aembed_query(text))
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_exact + self.hits_semantic
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+# ---------------------------- Cached values ----------------------------
+
+def _to_cached(message: BaseMessage):
+    return {
+        "content": message.content,
+        "tool_calls": [{"name": tc["name"], "args": tc["args"]} for tc in getattr(message, "tool_calls", None) or []],
+    }
+
+
+def _fresh_tool_calls(value):
+    # new ids: a replayed answer must not collide with tool call ids already in the thread
+    return [
+        {"name": tc["name"], "args": tc["args"], "id": f"call_{uuid.uuid4().hex[:24]}", "type": "tool_call"}
+        for tc in value["tool_calls"]
+    ]
+
+
+def _from_cached(value) -> AIMessage:
+    return AIMessage(content=value["content"], tool_calls=_fresh_tool_calls(value), response_metadata={"cache_hit": True})
+
+
+def _replay_chunks(value):
+    content = value["content"]
+    if isinstance(content, str) and content:
+        for piece in _TOKEN.findall(content):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+    elif content:
+        yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+    tool_call_chunks = [
+        {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": i, "type": "tool_call_chunk"}
+        for i, tc in enumerate(_fresh_tool_calls(value))
+    ]
+    yield ChatGenerationChunk(
+        message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks, response_metadata={"cache_hit": True})
+    )
+
+
+# ---------------------------- Chat model wrapper ----------------------------
+
+def child_config(run_manager) -> dict:
+    """
+    Config for the model a wrapper delegates to: a child run of the wrapper's run that
+    LangGraph does not stream, so chunks reach stream_mode="messages" once, from the wrapper.
+    """
+    callbacks = None
+    if run_manager is not None:
+        # what ParentRunManager.get_child() does; LLM run managers do not have it
+        callbacks = CallbackManager(handlers=[], parent_run_id=run_manager.run_id)
+        callbacks.set_handlers(run_manager.inheritable_handlers)
+        callbacks.add_tags(run_manager.inheritable_tags)
+        callbacks.add_metadata(run_manager.inheritable_metadata)
+    return {"callbacks": callbacks, "tags": [TAG_NOSTREAM]}
+
+
+class CachedChatModel(BaseChatModel):
+    """Chat model that serves repeated prompts from a `ResponseCache` and delegates the rest to `inner`."""
+
+    inner: Any
+    response_cache: Any
+    scope: str = ""
+
+    # the wrapper is the cache; keep LangChain's global llm cache out of it
+    cache: Any = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "cached-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={
+            "inner": self.inner.bind_tools(tools, **kwargs),
+            "scope": _digest([self.scope, tools_hash(tools), kwargs]),
+        })
+
+    def _inner_config(self, run_manager):
+        return child_config(run_manager)
+
+    def _cache_keys(self, messages, stop):
+        return ResponseCache.keys(messages, _digest([self.scope, stop]))
+
+    # ---------------------------- lookup ----------------------------
+
+    def _lookup(self, messages, stop):
+        exact, bucket, text = self._cache_keys(messages, stop)
+        cache = self.response_cache
+        value = cache.lookup_exact(exact)
+        vector = None
+        if value is None and cache.embeddings is not None and bucket is not None:
+            vector = cache.embed(text)
+            value = cache.lookup_similar(bucket, vector)
+        if value is None:
+            cache.record_miss()
+        return value, (exact, bucket, vector)
+
+    async def _alookup(self, messages, stop):
+        exact, bucket, text = self._cache_keys(messages, stop)
+        cache = self.response_cache
+        value = cache.lookup_exact(exact)
+        vector = None
+        if value is None and cache.embeddings is not None and bucket is not None:
+            vector = await cache.aembed(text)
+            value = cache.lookup_similar(bucket, vector)
+        if value is None:
+            cache.record_miss()
+        return value, (exact, bucket, vector)
+
+    def _store(self, keys, message):
+        exact, bucket, vector = keys
+        self.response_cache.store(exact, _to_cached(message), bucket, vector)
+
+    # ---------------------------- generate / stream ----------------------------
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        value, keys = self._lookup(messages, stop)
+        if value is not None:
+            return ChatResult(generations=[ChatGeneration(message=_from_cached(value))])
+        message = self.inner.invoke(messages, config=self._inner_config(run_manager), stop=stop, **kwargs)
+        self._store(keys, message)
+        message.id = None
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        value, keys = await self._alookup(messages, stop)
+        if value is not None:
+            return ChatResult(generations=[ChatGeneration(message=_from_cached(value))])
+        message = await self.inner.ainvoke(messages, config=self._inner_config(run_manager), stop=stop, **kwargs)
+        self._store(keys, message)
+        message.id = None
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        value, keys = self._lookup(messages, stop)
+        if value is not None:
+            yield from _replay_chunks(value)
+            return
+        full = None
+        for chunk in self.inner.stream(messages, config=self._inner_config(run_manager), stop=stop, **kwargs):
+            chunk.id = None
+            full = chunk if full is None else full + chunk
+            yield ChatGenerationChunk(message=chunk)
+        if full is not None:
+            self._store(keys, full)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        value, keys = await self._alookup(messages, stop)
+        if value is not None:
+            for chunk in _replay_chunks(value):
+                yield chunk
+            return
+        full = None
+        async for chunk in self.inner.astream(messages, config=self._inner_config(run_manager), stop=stop, **kwargs):
+            chunk.id = None
+            full = chunk if full is None else full + chunk
+            yield ChatGenerationChunk(message=chunk)
+        if full is not None:
+            self._store(keys, full)
+
+
+# ---------------------------- Shared instance ----------------------------
+
+_shared_cache: ResponseCache | None = None
+_shared_lock = threading.Lock()
+
+
+def response_cache() -> ResponseCache:
+    """The process-wide cache, built from the LLM_CACHE_* environment on first use."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            embeddings = None
+            if os.getenv("LLM_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes"):
+                from langchain_openai import OpenAIEmbeddings
+
+                embeddings = OpenAIEmbeddings(model=os.getenv("LLM_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"))
+            _shared_cache = ResponseCache(
+                ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                embeddings=embeddings,
+                similarity=float(os.getenv("LLM_CACHE_SIMILARITY", "0.95")),
+            )
+        return _shared_cache
+
+
+def cached(llm):
+    """Wrap `llm` with the shared response cache unless LLM_CACHE is disabled."""
+    if os.getenv("LLM_CACHE", "true").lower() in ("0", "false", "no"):
+        return llm
+    return CachedChatModel(inner=llm, response_cache=response_cache(), scope=getattr(llm, "model_name", ""))
@@ -1,15 +1,48 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel
 from typing import List, Optional
 
 # Your async graph builder + functions
-from async_chatbot import build_graph, retrieve_all_threads
+from async_chatbot import build_graph, retrieve_all_threads, tool_executor, mcp_pool, prompt_cache
+from batch_runner import BatchManager
+from checkpointers import open_checkpointer
+from retention import Retention, retention_enabled
+from search_index import SemanticIndex
+from tool_cache import tool_cache
+from sse_encoder import StreamEncoder, message_payload
+from stream_coalescer import CoalescingStream, StreamMetrics
+from turn_scheduler import SchedulerFull, turn_scheduler
+from telemetry import (
+    CONTENT_TYPE,
+    Family,
+    ModelTimer,
+    ProfilerMiddleware,
+    Profiles,
+    Registry,
+    batch_families,
+    checkpointer_families,
+    model_router_families,
+    prompt_cache_families,
+    retention_families,
+    scheduler_families,
+    stream_families,
+    telemetry_enabled,
+    tool_families,
+)
 from langchain_core.messages import HumanMessage
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from langchain_core.messages import BaseMessage
+import asyncio
 import json
+import sqlite3
+import hashlib
+import math
+import os
+import sys
+import time
 
 
 # ---------------------------- FastAPI App ----------------------------
@@ -23,18 +56,119 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# per-request sampling profiler, off unless PROFILER=on (see telemetry.py)
+profiles = Profiles()
+app.add_middleware(ProfilerMiddleware, profiles=profiles)
+
 
-# Global graph + checkpointer
+# Global graph + checkpointer; the graph is built in the background (see startup_event)
 chatbot = None
 checkpointer = None
+graph_task = None
+# background checkpoint pruning/archiving, on with RETENTION=on (see retention.py)
+retention = None
+# background embedding of indexed messages for /search?mode=semantic, on with SEARCH_EMBEDDINGS
+semantic_index = None
+
+# offline runs of JSONL job files, see POST /batch
+batches = BatchManager()
+
+# default /chat framing: "sse" or "ndjson"
+STREAM_FORMAT = os.getenv("STREAM_FORMAT", "sse")
+
+stream_metrics = StreamMetrics()
+
+# Prometheus metrics for GET /metrics (see telemetry.py)
+registry = Registry()
+model_timer = ModelTimer(registry) if telemetry_enabled() else None
+registry.register(lambda: tool_families(tool_executor))
+registry.register(lambda: scheduler_families(turn_scheduler()))
+registry.register(lambda: stream_families(stream_metrics))
+registry.register(lambda: checkpointer_families(checkpointer) if checkpointer is not None else [])
+registry.register(lambda: retention_families(retention) if retention is not None else [])
+registry.register(lambda: prompt_cache_families(prompt_cache))
+registry.register(lambda: batch_families(batches))
+registry.register(lambda: model_router_families(shared_model_router()) if shared_model_router() is not None else [])
+# phase -> seconds since startup began: "checkpointer", "graph"
+startup_seconds = {}
+registry.register(lambda: [
+    Family("app_startup_seconds", "gauge", "Time from startup until each phase was ready.").add(seconds, phase=phase)
+    for phase, seconds in startup_seconds.items()
+])
+
+
+async def build_chatbot(start):
+    global chatbot
+    try:
+        chatbot, _ = await build_graph(checkpointer)
+    except Exception as e:
+        print(f"Graph initialization failed: {e!r}")
+        raise
+    startup_seconds["graph"] = time.perf_counter() - start
+    print(f"Graph initialized successfully in {startup_seconds['graph']:.2f}s!")
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize async graph & checkpointer on startup."""
-    global chatbot, checkpointer
-    chatbot, checkpointer = await build_graph()
-    print("Graph initialized successfully!")
+    """
+    Open the checkpointer, then build the graph in the background: /threads and
+    /conversations are served right away, /chat waits for the graph (see graph_ready).
+    """
+    global checkpointer, graph_task, retention, semantic_index
+    start = time.perf_counter()
+    # sqlite (default), postgres or memory, picked by CHECKPOINT_BACKEND (see checkpointers.py)
+    checkpointer = await open_checkpointer()
+    startup_seconds["checkpointer"] = time.perf_counter() - start
+    if retention_enabled():
+        retention = Retention.from_env(checkpointer)
+        if retention is not None:
+            retention.start()
+    semantic_index = SemanticIndex.from_env(checkpointer)
+    if semantic_index is not None:
+        semantic_index.start()
+    graph_task = asyncio.create_task(build_chatbot(start))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop a pending graph build, batches, retention and embedding, close the checkpoint connection pool and the MCP sessions."""
+    if graph_task is not None and not graph_task.done():
+        graph_task.cancel()
+    await batches.aclose()
+    if retention is not None:
+        await retention.aclose()
+    if semantic_index is not None:
+        await semantic_index.aclose()
+    if checkpointer is not None:
+        await checkpointer.aclose()
+    await mcp_pool.aclose()
+
+
+async def graph_ready():
+    """The compiled graph, waiting for the startup build if it is still running."""
+    if chatbot is None and graph_task is not None:
+        # shielded: a cancelled request must not cancel the build for everyone else
+        await asyncio.shield(graph_task)
+    if chatbot is None:
+        raise RuntimeError("graph is not initialized")
+    return chatbot
+
+
+def shared_model_router():
+    """
+    The router of the chat model, if it routes between endpoints. Looked up without
+    importing model_router.py, which the graph build loads (see GRAPH_MODULES).
+    """
+    module = sys.modules.get("model_router")
+    return module.model_router() if module is not None else None
+
+
+def graph_state():
+    if chatbot is not None:
+        return "ready"
+    if graph_task is None or not graph_task.done():
+        return "building"
+    return "failed"
 
 
 # def serialize_message(msg):
@@ -68,61 +202,41 @@ async def startup_event():
 #     return base
 
 
-def serialize(stream_item):
+class ChatRequest(BaseModel):
+    thread_id: str
+    message: str
+    
+    
+async def load_conversations(thread_id: str, limit: Optional[int] = None, before: Optional[int] = None):
     """
-    stream_item = (chunk, metadata)
-    chunk = AIMessageChunk | ToolMessage | AIMessage | ToolMessageChunk
+    Read a window of the thread's messages straight from the checkpointer.
+    Returns (checkpoint_id, total, start, messages).
     """
-    if not isinstance(stream_item, tuple) or len(stream_item) != 2:
-        return None
+    return await checkpointer.aget_messages(thread_id, limit=limit, before=before)
 
-    chunk, _meta = stream_item
-    return serialize_message(chunk)
-
-
-def serialize_message(msg):
-    msg_type = msg.__class__.__name__
-
-    # Determine simplified role
-    if msg_type in ("AIMessage", "AIMessageChunk"):
-        role = "ai"
-    elif msg_type in ("ToolMessage",):
-        role = "tool"
-    elif msg_type in ("HumanMessage"):
-        role = "human"
-    else:
-        role = "unknown"
-
-    data = {
-        "role": role,
-        "content": getattr(msg, "content", None) or ""
-    }
 
-    # Include tool calls only if present
-    if hasattr(msg, "tool_calls") and msg.tool_calls:
-        data["tool_calls"] = msg.tool_calls
+def conversation_etag(checkpoint_id, limit, before, fields):
+    key = f"{checkpoint_id}|{limit}|{before}|{','.join(sorted(fields or []))}"
+    return 'W/"' + hashlib.sha1(key.encode()).hexdigest() + '"'
 
-    if hasattr(msg, "tool_call_chunks") and msg.tool_call_chunks:
-        data["tool_call_chunks"] = msg.tool_call_chunks
 
-    return data
-
-
-
-class ChatRequest(BaseModel):
-    thread_id: str
-    message: str
-    
-    
-async def load_conversations(thread_id: str):
-    state = await chatbot.aget_state(
-        config={"configurable": {"thread_id": thread_id}}
-    )
+def etag_matches(if_none_match, etag, exists=True):
+    """
+    Whether an If-None-Match header matches `etag`: a comma separated list compared
+    weakly (W/ ignored), or `*` for any current representation (RFC 9110 13.1.2).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return exists
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
 
-    if state and state.values and "messages" in state.values:
-        return state.values["messages"]
 
-    return []
+def project(data, fields):
+    if not fields:
+        return data
+    return {k: v for k, v in data.items() if k in fields}
 
 
 
@@ -133,48 +247,417 @@ async def load_conversations(thread_id: str):
 # ---------------------------- API ROUTES ----------------------------
 
 @app.post("/chat")
-async def chat_endpoint(payload: ChatRequest):
+async def chat_endpoint(payload: ChatRequest, request: Request, format: Optional[str] = None, compact: bool = False):
+    """
+    Stream the assistant's reply. `format=ndjson` switches from SSE to newline-delimited
+    JSON; `compact=true` sends plain text deltas as bare JSON strings (see sse_encoder.py).
+    Text deltas are coalesced and the run is cancelled if the client disconnects
+    (see stream_coalescer.py).
+
+    Turns of a thread run one at a time and the number of concurrent turns is capped
+    (see turn_scheduler.py); when the queue is full the response is a 429 with Retry-After.
+    A thread archived by retention is restored before the turn runs.
+    """
+    try:
+        encoder = StreamEncoder(format or STREAM_FORMAT, compact=compact)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-    async def event_stream():
-        async for chunk in chatbot.astream(
+    try:
+        graph = await graph_ready()
+    except Exception as e:
+        return JSONResponse({"error": f"graph unavailable: {e}"}, status_code=503)
+
+    try:
+        ticket = await turn_scheduler().acquire(payload.thread_id)
+    except SchedulerFull as e:
+        return JSONResponse(
+            {"error": str(e), "retry_after": e.retry_after},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    if retention is not None:
+        try:
+            await retention.ensure_hot(payload.thread_id)
+        except BaseException:
+            ticket.release()
+            raise
+
+    config = {"configurable": {"thread_id": payload.thread_id}}
+    if model_timer is not None:
+        config["callbacks"] = [model_timer]
+    stream = CoalescingStream(
+        graph.astream(
             {"messages": [HumanMessage(content=payload.message)]},
-            config={"configurable": {"thread_id": payload.thread_id}},
+            config=config,
             stream_mode= 'messages'
-        ):
-           
-            # yield f"data: {json.dumps(safe, ensure_ascii=False)}\n\n"
-            yield f"data: {(json.dumps(serialize(chunk)))}\n\n"
-
-        yield "data: [DONE]\n\n"
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+        ),
+        encoder,
+        is_disconnected=request.is_disconnected,
+        # end of turn: commit the turn's checkpoints if durability is "batched"
+        on_complete=checkpointer.aflush,
+        on_close=ticket.release,
+        metrics=stream_metrics,
+    )
+    # release also runs as a background task in case the body is never iterated
+    return StreamingResponse(stream, media_type=encoder.media_type, background=BackgroundTask(ticket.release))
 
 
 @app.get("/threads")
-async def threads_endpoint():
+async def threads_endpoint(limit: Optional[int] = None, after: Optional[str] = None):
     """
-    Fetch all thread IDs from async SQLite checkpointer.
+    Fetch one page of thread IDs from the thread catalog, most recently updated first.
+    Pass the returned `next` value as `after` to fetch the following page.
     """
-    threads = await retrieve_all_threads(checkpointer)
-    return {"threads": threads}
+    try:
+        threads, next_cursor = await retrieve_all_threads(checkpointer, limit=limit, after=after)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {
+        "threads": [t["thread_id"] for t in threads],
+        "next": next_cursor,
+    }
 
 
 @app.get("/conversations/{thread_id}")
-async def get_conversation(thread_id: str):
+async def get_conversation(
+    thread_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Latest messages of a thread, oldest first.
+
+    - `limit`: window size (default: whole history)
+    - `before`: list position to end the window at; pass `next_before` to page back
+    - `fields`: comma separated keys to keep, e.g. `role,content`
+    Responds 304 when `If-None-Match` matches the window's ETag. A thread archived by
+    retention is restored first.
+    """
     try:
-        messages = await load_conversations(thread_id)
+        if retention is not None:
+            await retention.ensure_hot(thread_id)
+        field_set = {f.strip() for f in fields.split(",") if f.strip()} if fields else None
+
+        checkpoint_id = await checkpointer.alatest_checkpoint_id(thread_id)
+        etag = conversation_etag(checkpoint_id, limit, before, field_set)
+        if etag_matches(request.headers.get("if-none-match"), etag, exists=checkpoint_id is not None):
+            return Response(status_code=304, headers={"ETag": etag})
 
-        serialized = [serialize_message(m) for m in messages]
+        checkpoint_id, total, start, messages = await load_conversations(thread_id, limit=limit, before=before)
+        # a turn may have committed in between, tag what was actually read
+        etag = conversation_etag(checkpoint_id, limit, before, field_set)
+        response.headers["ETag"] = etag
+
+        serialized = [project(message_payload(m), field_set) for m in messages]
 
         return {
             "thread_id": thread_id,
-            "messages": serialized
+            "messages": serialized,
+            "total": total,
+            "start": start,
+            "next_before": start if start > 0 else None,
         }
 
     except Exception as e:
         return {"error": str(e)}
 
 
+@app.get("/search")
+async def search_endpoint(q: str, limit: Optional[int] = None, offset: int = 0, mode: str = "fts", raw: bool = False):
+    """
+    Threads whose messages match `q`, best first, each with a snippet of its best match.
+    Pass the returned `next` value as `offset` for the following page.
+
+    - `mode=fts` (default): every word of `q` must match; `raw=true` takes FTS5 query syntax
+    - `mode=semantic`: nearest messages by embedding (needs SEARCH_EMBEDDINGS)
+    """
+    if mode == "semantic":
+        if semantic_index is None:
+            return JSONResponse({"error": "semantic search is not enabled (SEARCH_EMBEDDINGS, sqlite backend)"}, status_code=404)
+        return await semantic_index.asearch(q, limit=limit, offset=offset)
+    if mode != "fts":
+        return JSONResponse({"error": f"unknown mode {mode!r}, expected fts or semantic"}, status_code=400)
+    if getattr(checkpointer, "search_index", None) is None:
+        return JSONResponse({"error": "search is not enabled (SEARCH_INDEX=true, sqlite backend)"}, status_code=404)
+    try:
+        return await checkpointer.asearch(q, limit=limit, offset=offset, raw=raw)
+    except sqlite3.OperationalError as e:
+        return JSONResponse({"error": f"bad query: {e}"}, status_code=400)
+
+
+@app.post("/batch")
+async def create_batch(
+    request: Request,
+    concurrency: Optional[int] = None,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    batch_id: Optional[str] = None,
+):
+    """
+    Start a batch: the body is a JSONL file of `{"thread_id", "message", "id"?}` jobs
+    (see batch_runner.py). Returns the batch id; follow it on GET /batch/{batch_id}.
+    `rpm` / `tpm` override BATCH_RPM / BATCH_TPM for this batch. `batch_id` is set by
+    router.py, which sends every request of the batch to the same worker.
+    """
+    try:
+        graph = await graph_ready()
+    except Exception as e:
+        return JSONResponse({"error": f"graph unavailable: {e}"}, status_code=503)
+    try:
+        batch_id, jobs = batches.create((await request.body()).decode("utf-8"), batch_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    batches.start(batch_id, graph, checkpointer, concurrency=concurrency, rpm=rpm, tpm=tpm)
+    return JSONResponse({"batch_id": batch_id, "jobs": jobs}, status_code=202)
+
+
+@app.get("/batch/{batch_id}")
+async def batch_status(batch_id: str):
+    """
+    State, progress, throughput, error and rate limit stats of a batch.
+    """
+    try:
+        status = batches.status(batch_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if status is None:
+        return JSONResponse({"error": f"unknown batch {batch_id}"}, status_code=404)
+    return status
+
+
+@app.get("/batch/{batch_id}/results")
+async def batch_results(batch_id: str):
+    """
+    The output JSONL of a batch so far, one line per finished job.
+    """
+    try:
+        _, output_path = batches.paths(batch_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not os.path.exists(output_path):
+        return JSONResponse({"error": f"no results for batch {batch_id}"}, status_code=404)
+    return FileResponse(output_path, media_type="application/x-ndjson")
+
+
+@app.post("/batch/{batch_id}/resume")
+async def resume_batch(batch_id: str, concurrency: Optional[int] = None):
+    """
+    Run the jobs of a stopped batch that are not "ok" in its results yet.
+    """
+    try:
+        graph = await graph_ready()
+    except Exception as e:
+        return JSONResponse({"error": f"graph unavailable: {e}"}, status_code=503)
+    try:
+        if batches.status(batch_id) is None:
+            return JSONResponse({"error": f"unknown batch {batch_id}"}, status_code=404)
+        batches.start(batch_id, graph, checkpointer, concurrency=concurrency)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return JSONResponse({"batch_id": batch_id}, status_code=202)
+
+
+@app.delete("/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """
+    Stop a running batch; its finished jobs stay in the results and it can be resumed.
+    """
+    try:
+        batches.paths(batch_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {"cancelled": await batches.cancel(batch_id)}
+
+
+@app.get("/health")
+async def health():
+    """
+    Startup progress: the checkpointer is open and the graph is "building", "ready" or "failed".
+    """
+    body = {
+        "checkpointer": checkpointer is not None,
+        "graph": graph_state(),
+        "startup_seconds": startup_seconds,
+    }
+    if body["graph"] == "failed":
+        body["error"] = "cancelled" if graph_task.cancelled() else repr(graph_task.exception())
+    return body
+
+
+@app.get("/metrics/checkpointer")
+async def checkpointer_metrics():
+    """
+    Backend and connection pool wait times of the checkpointer.
+    """
+    return checkpointer.stats()
+
+
+@app.get("/metrics/retention")
+async def retention_metrics():
+    """
+    Retention policy, totals and the report of the last pass.
+    """
+    return retention.stats() if retention is not None else {"enabled": False}
+
+
+@app.post("/retention/run")
+async def run_retention(dry_run: bool = True):
+    """
+    Run a retention pass now. By default a dry run: nothing is deleted and the report
+    gives the checkpoints, threads and bytes a real pass would reclaim.
+    """
+    if retention is None:
+        return JSONResponse({"error": "retention is not enabled (RETENTION=on, sqlite backend)"}, status_code=404)
+    return await retention.run_pass(dry_run=dry_run)
+
+
+@app.post("/retention/restore/{thread_id}")
+async def restore_thread(thread_id: str):
+    """
+    Move an archived thread back into the hot database.
+    """
+    if retention is None:
+        return JSONResponse({"error": "retention is not enabled (RETENTION=on, sqlite backend)"}, status_code=404)
+    try:
+        restored = await retention.arestore(thread_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    if not restored:
+        return JSONResponse({"error": f"thread {thread_id} is not archived"}, status_code=404)
+    return {"thread_id": thread_id, "restored": True}
+
+
+@app.get("/retention/archived")
+async def archived_threads(limit: int = 100, after: str = ""):
+    """
+    One page of archived threads by thread id; pass the returned `next` as `after`.
+    """
+    if retention is None:
+        return JSONResponse({"error": "retention is not enabled (RETENTION=on, sqlite backend)"}, status_code=404)
+    rows = await asyncio.to_thread(retention.cold.list, limit, after)
+    return {
+        "threads": [
+            {"thread_id": thread_id, "archived_at": archived_at, "last_updated_at": last_updated_at}
+            for thread_id, archived_at, last_updated_at in rows
+        ],
+        "next": rows[-1][0] if len(rows) == limit else None,
+    }
+
+
+@app.get("/metrics/search")
+async def search_metrics():
+    """
+    /search latency and, when enabled, the progress of the embedding worker.
+    """
+    return {
+        "enabled": getattr(checkpointer, "search_index", None) is not None,
+        "fts": checkpointer.search_times.as_dict() if hasattr(checkpointer, "search_times") else None,
+        "semantic": semantic_index.stats() if semantic_index is not None else {"enabled": False},
+    }
+
+
+@app.get("/metrics/llm-cache")
+async def llm_cache_metrics():
+    """
+    Hit/miss counts, size and evictions of the model response cache.
+    """
+    from llm_cache import response_cache
+
+    return response_cache().stats()
+
+
+@app.get("/metrics/prompt-cache")
+async def prompt_cache_metrics():
+    """
+    Input tokens the provider served from its prompt cache, and prefix changes.
+    """
+    return prompt_cache.as_dict()
+
+
+@app.get("/metrics/models")
+async def model_metrics():
+    """
+    Hedges, failovers, cheap-model routes, breaker state and latency per model endpoint.
+    """
+    router = shared_model_router()
+    return router.stats() if router is not None else {"enabled": False}
+
+
+@app.get("/metrics/tools")
+async def tool_metrics():
+    """
+    Per-tool call, error and timeout counts with latency histograms.
+    """
+    return tool_executor.stats_dict()
+
+
+@app.get("/metrics/tool-prefetch")
+async def tool_prefetch_metrics():
+    """
+    Tool calls started while the model was streaming: used, discarded, and seconds saved.
+    """
+    return tool_executor.prefetch_stats()
+
+
+@app.get("/metrics/tool-cache")
+async def tool_cache_metrics():
+    """
+    Hit/miss counts per tool of the tool result cache.
+    """
+    cache = tool_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@app.get("/metrics/streams")
+async def stream_metrics_endpoint():
+    """
+    Frames, bytes, time to first byte and outcome of /chat streams.
+    """
+    return stream_metrics.as_dict()
+
+
+@app.get("/metrics/turns")
+async def turn_metrics():
+    """
+    Running and queued turns, admissions, rejections and queue wait times.
+    """
+    return turn_scheduler().stats()
+
+
+@app.get("/metrics/mcp")
+async def mcp_metrics():
+    """
+    Session state, reconnects and call counts per MCP server.
+    """
+    return mcp_pool.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Every metric above in the Prometheus text format, plus model TTFT and duration.
+    """
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """
+    Folded stacks sampled while the request that returned this `X-Profile-Id` ran.
+    """
+    profiler = profiles.get(profile_id)
+    if profiler is None:
+        return JSONResponse({"error": "unknown profile"}, status_code=404)
+    return PlainTextResponse(profiler.folded())
+
+
 # ---------------------------- Start Server ----------------------------
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
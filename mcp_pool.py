@@ -0,0 +1,264 @@
+"""
+Long-lived, pooled MCP client sessions with cached tool discovery.
+
+`MultiServerMCPClient.get_tools()` returns tools that open a new session (a new HTTP
+session, or a new subprocess for stdio servers) for every single tool call, and startup
+waits for discovery on every server. `McpSessionPool` takes the same connection config but:
+
+- keeps one long-lived session per server, owned by a background task. MCP multiplexes
+  concurrent requests over a session, so one is enough. The stdio `arith` server is
+  spawned once and reused.
+- pings each session every `health_interval` seconds and reconnects with exponential
+  backoff (plus jitter) when the ping or the transport fails
+- caches discovered tool schemas on disk (`MCP_TOOL_CACHE`). `get_tools()` builds tools
+  from the cache right away and refreshes it in the background. Only servers missing from
+  the cache are discovered before returning, each bounded by `discovery_timeout`, and a
+  server that doesn't answer is skipped instead of blocking startup.
+
+Call `aclose()` on shutdown to close the sessions (and stop stdio subprocesses). The MCP
+SDK and adapters are imported on first use, so importing this module stays cheap.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+
+
+logger = logging.getLogger(__name__)
+
+
+def _unsent_errors():
+    """
+    Raised by the session's write stream when the transport is already gone: the request
+    never reached the server, so it is safe to retry on a new session.
+    """
+    import anyio
+
+    return (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+
+def _lost_response_errors():
+    """
+    The transport died while waiting for the response. The request was sent and may have
+    run, so retrying could repeat a write; the error goes back to the caller instead.
+    """
+    import anyio
+
+    return (anyio.EndOfStream,)
+
+
+class _Server:
+    """One server's session, kept open and reconnected by `_run()`."""
+
+    def __init__(self, name, connection, pool):
+        self.name = name
+        self.connection = connection
+        self.pool = pool
+        self.fingerprint = hashlib.sha256(json.dumps(connection, sort_keys=True, default=str).encode()).hexdigest()
+        self.session = None
+        self.task = None
+        self._ready = asyncio.Event()
+        self._reconnect = asyncio.Event()
+        self._stop = asyncio.Event()
+        self.connects = 0
+        self.calls = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run(), name=f"mcp-session-{self.name}")
+
+    async def _run(self):
+        from langchain_mcp_adapters.sessions import create_session
+
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                async with create_session(self.connection) as session:
+                    await asyncio.wait_for(session.initialize(), self.pool.connect_timeout)
+                    self.session = session
+                    self.connects += 1
+                    attempt = 0
+                    self._ready.set()
+                    await self._supervise(session)
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.warning("MCP server %s: session lost: %r", self.name, e)
+            finally:
+                self.session = None
+                self._ready.clear()
+            if self._stop.is_set():
+                break
+            delay = min(self.pool.max_backoff, self.pool.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            try:
+                await asyncio.wait_for(self._stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _supervise(self, session):
+        """Return when the session should be replaced (or the pool is closing)."""
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._reconnect.wait(), self.pool.health_interval)
+            except asyncio.TimeoutError:
+                await asyncio.wait_for(session.send_ping(), self.pool.connect_timeout)
+                continue
+            self._reconnect.clear()
+            return
+
+    async def get_session(self):
+        self.start()
+        await asyncio.wait_for(self._ready.wait(), self.pool.connect_timeout)
+        return self.session
+
+    async def call_tool(self, name, arguments, progress_callback=None, **kwargs):
+        for attempt in (0, 1):
+            session = await self.get_session()
+            self.calls += 1
+            try:
+                return await session.call_tool(name, arguments, progress_callback=progress_callback, **kwargs)
+            except _lost_response_errors() as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                self._reconnect.set()
+                raise
+            except _unsent_errors() as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                self._reconnect.set()
+                if attempt:
+                    raise
+                self._ready.clear()
+
+    async def list_tools(self):
+        session = await self.get_session()
+        tools, cursor = [], None
+        while True:
+            page = await session.list_tools(cursor=cursor)
+            tools.extend(page.tools)
+            cursor = page.nextCursor
+            if not cursor:
+                return tools
+
+    async def aclose(self):
+        self._stop.set()
+        self._reconnect.set()
+        if self.task is not None:
+            await self.task
+
+    def stats(self):
+        return {
+            "connected": self.session is not None,
+            "connects": self.connects,
+            "calls": self.calls,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class McpSessionPool:
+
+    def __init__(
+        self,
+        connections: dict,
+        cache_path: str | None = None,
+        health_interval: float = 30.0,
+        connect_timeout: float = 10.0,
+        discovery_timeout: float = 10.0,
+        base_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
+        self.connections = connections
+        self.cache_path = cache_path or os.getenv("MCP_TOOL_CACHE", "mcp_tools.json")
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.discovery_timeout = discovery_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.servers = {name: _Server(name, connection, self) for name, connection in connections.items()}
+        self._refresh_task = None
+
+    # ---------------------------- Schema cache ----------------------------
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, discovered):
+        cache = self._load_cache()
+        for name, tools in discovered.items():
+            cache[name] = {
+                "fingerprint": self.servers[name].fingerprint,
+                "tools": [tool.model_dump(mode="json", exclude_none=True) for tool in tools],
+            }
+        tmp = f"{self.cache_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, self.cache_path)
+
+    # ---------------------------- Discovery ----------------------------
+
+    def _to_langchain(self, name, mcp_tools):
+        from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+
+        server = self.servers[name]
+        return [convert_mcp_tool_to_langchain_tool(server, tool, server_name=name) for tool in mcp_tools]
+
+    async def _discover(self, names):
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self.servers[name].list_tools(), self.discovery_timeout) for name in names),
+            return_exceptions=True,
+        )
+        discovered = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.warning("MCP server %s: tool discovery failed: %r", name, result)
+            else:
+                discovered[name] = result
+        if discovered:
+            self._save_cache(discovered)
+        return discovered
+
+    async def refresh(self, names=None):
+        """Re-discover tools and update the on-disk cache (used on the next `get_tools()`)."""
+        return await self._discover(list(names or self.servers))
+
+    async def get_tools(self):
+        """LangChain tools for every server, from the schema cache where possible."""
+        from mcp.types import Tool as MCPTool
+
+        cache = self._load_cache()
+        tools, cached, missing = [], [], []
+        for name, server in self.servers.items():
+            entry = cache.get(name)
+            if entry is not None and entry.get("fingerprint") == server.fingerprint:
+                tools.extend(self._to_langchain(name, [MCPTool.model_validate(t) for t in entry["tools"]]))
+                cached.append(name)
+                # connect now so the first tool call doesn't pay for the handshake
+                server.start()
+            else:
+                missing.append(name)
+
+        if missing:
+            for name, mcp_tools in (await self._discover(missing)).items():
+                tools.extend(self._to_langchain(name, mcp_tools))
+        if cached:
+            self._refresh_task = asyncio.create_task(self.refresh(cached))
+        return tools
+
+    # ---------------------------- Lifecycle ----------------------------
+
+    def stats(self):
+        return {name: server.stats() for name, server in self.servers.items()}
+
+    async def aclose(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        await asyncio.gather(*(server.aclose() for server in self.servers.values()), return_exceptions=True)
@@ -0,0 +1,276 @@
+"""
+Append-only message storage for checkpoints.
+
+`ChatState.messages` uses the `add_messages` reducer, so every checkpoint carries the
+whole conversation and a thread of n messages costs O(n^2) bytes on disk. With the
+message store enabled, each message is written once to `message_store`, keyed by
+(thread_id, message id), and the checkpoint keeps only a reference: the list of
+per-thread sequence ranges that make up the history, e.g. `[[1, 42]]` for a thread
+that only ever appended.
+
+Existing databases can be converted (and converted back) with:
+
+    python message_store.py migrate new_chatbot.db
+    python message_store.py inline new_chatbot.db
+"""
+import hashlib
+import sqlite3
+import sys
+import weakref
+from collections import OrderedDict, deque
+
+
+MESSAGES_CHANNEL = "messages"
+REFS_KEY = "__message_refs__"
+
+MESSAGE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_store (
+    thread_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, seq)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_message_store_message
+    ON message_store (thread_id, message_id, digest);
+"""
+
+INSERT_SQL = "INSERT OR IGNORE INTO message_store (thread_id, seq, message_id, digest, type, value) VALUES (?, ?, ?, ?, ?, ?)"
+KEYS_SQL = "SELECT message_id, digest, seq FROM message_store WHERE thread_id = ? ORDER BY seq"
+RANGE_SQL = "SELECT type, value FROM message_store WHERE thread_id = ? AND seq BETWEEN ? AND ? ORDER BY seq"
+
+
+def is_refs(value) -> bool:
+    return isinstance(value, dict) and REFS_KEY in value
+
+
+def to_ranges(seqs):
+    """[1, 2, 3, 7, 8] -> [[1, 3], [7, 8]]"""
+    ranges = []
+    for seq in seqs:
+        if ranges and ranges[-1][1] == seq - 1:
+            ranges[-1][1] = seq
+        else:
+            ranges.append([seq, seq])
+    return ranges
+
+
+def ref_length(refs) -> int:
+    return sum(end - start + 1 for start, end in refs[REFS_KEY])
+
+
+def window_ranges(refs, start: int, stop: int):
+    """Seq ranges covering list positions [start, stop) of a reference."""
+    window, pos = [], 0
+    for first, last in refs[REFS_KEY]:
+        size = last - first + 1
+        lo, hi = max(start, pos), min(stop, pos + size)
+        if lo < hi:
+            window.append([first + lo - pos, first + hi - pos - 1])
+        pos += size
+        if pos >= stop:
+            break
+    return window
+
+
+class _ThreadIndex:
+    """Which (message id, digest) pairs of a thread are stored, and under which seq."""
+
+    def __init__(self, rows=()):
+        self.next_seq = 1
+        # ids of the checkpoints this process encoded last; a parent outside them means
+        # another process (worker) wrote the thread since and the index is stale
+        self.written = deque(maxlen=32)
+        # message_id -> (digest, seq, weakref to the last message object seen with it)
+        self.by_id = {}
+        self.by_key = {}
+        for message_id, digest, seq in rows:
+            self.add(message_id, digest, seq, None)
+
+    def add(self, message_id, digest, seq, msg):
+        self.by_id[message_id] = (digest, seq, weakref.ref(msg) if msg is not None else None)
+        self.by_key[(message_id, digest)] = seq
+        self.next_seq = max(self.next_seq, seq + 1)
+
+
+class MessageStore:
+    """
+    Encodes the `messages` channel of a checkpoint into sequence references plus the
+    rows to insert, and decodes references back into messages.
+
+    Message objects already stored for a thread are recognised by identity, so an
+    append-only turn serializes only the new messages rather than the full history.
+    """
+
+    def __init__(self, serde, max_threads: int = 1024):
+        self.serde = serde
+        self.max_threads = max_threads
+        self._threads: OrderedDict[str, _ThreadIndex] = OrderedDict()
+
+    def load_index(self, thread_id: str, rows):
+        self._threads[thread_id] = _ThreadIndex(rows)
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+
+    def forget(self, thread_id: str):
+        self._threads.pop(thread_id, None)
+
+    def is_current(self, thread_id: str, parent_checkpoint_id) -> bool:
+        """False if the thread was extended by someone else since this index was loaded."""
+        index = self._threads.get(thread_id)
+        if index is None:
+            return False
+        return not (parent_checkpoint_id and index.written and parent_checkpoint_id not in index.written)
+
+    def encode(self, thread_id: str, checkpoint):
+        """
+        Return (checkpoint with the messages channel replaced by references, rows to
+        insert). The thread's index must be loaded first (see `load_index`).
+        """
+        messages = checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)
+        if not isinstance(messages, list):
+            return checkpoint, []
+
+        index = self._threads[thread_id]
+        self._threads.move_to_end(thread_id)
+        index.written.append(checkpoint["id"])
+        seqs, rows = [], []
+        for msg in messages:
+            message_id = getattr(msg, "id", None)
+            known = index.by_id.get(message_id) if message_id else None
+            if known is not None and known[2] is not None and known[2]() is msg:
+                seqs.append(known[1])
+                continue
+
+            type_, blob = self.serde.dumps_typed(msg)
+            digest = hashlib.blake2b(blob, digest_size=16).hexdigest()
+            message_id = message_id or digest
+            seq = index.by_key.get((message_id, digest))
+            if seq is None:
+                seq = index.next_seq
+                rows.append((thread_id, seq, message_id, digest, type_, blob))
+            index.add(message_id, digest, seq, msg)
+            seqs.append(seq)
+
+        channel_values = {**checkpoint["channel_values"], MESSAGES_CHANNEL: {REFS_KEY: to_ranges(seqs)}}
+        return {**checkpoint, "channel_values": channel_values}, rows
+
+    def decode_rows(self, rows):
+        return [self.serde.loads_typed((type_, value)) for type_, value in rows]
+
+    async def ahydrate(self, conn, checkpoint_tuple):
+        """Replace references in a loaded checkpoint tuple with the stored messages."""
+        if checkpoint_tuple is None:
+            return None
+        channel_values = checkpoint_tuple.checkpoint.get("channel_values", {})
+        refs = channel_values.get(MESSAGES_CHANNEL)
+        if not is_refs(refs):
+            return checkpoint_tuple
+
+        thread_id = str(checkpoint_tuple.config["configurable"]["thread_id"])
+        channel_values[MESSAGES_CHANNEL] = await self.aload_ranges(conn, thread_id, refs[REFS_KEY])
+        return checkpoint_tuple
+
+    async def aload_ranges(self, conn, thread_id: str, ranges):
+        messages = []
+        for start, end in ranges:
+            async with conn.execute(RANGE_SQL, (thread_id, start, end)) as cur:
+                messages.extend(self.decode_rows(await cur.fetchall()))
+        return messages
+
+    def hydrate_sync(self, conn: sqlite3.Connection, thread_id: str, checkpoint):
+        refs = checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)
+        if not is_refs(refs):
+            return checkpoint
+        messages = []
+        for start, end in refs[REFS_KEY]:
+            messages.extend(self.decode_rows(conn.execute(RANGE_SQL, (thread_id, start, end)).fetchall()))
+        checkpoint["channel_values"][MESSAGES_CHANNEL] = messages
+        return checkpoint
+
+
+# ---------------------------- Migration ----------------------------
+
+def _rewrite(path: str, transform) -> int:
+    from checkpoint_serde import serializer_from_env
+
+    # reads stock and compact blobs, writes the configured format (see checkpoint_serde.py)
+    serde = serializer_from_env()
+    store = MessageStore(serde)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(MESSAGE_STORE_SCHEMA)
+        threads = [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+        rewritten = 0
+        for thread_id in threads:
+            with conn:
+                store.load_index(thread_id, conn.execute(KEYS_SQL, (thread_id,)).fetchall())
+                rows = conn.execute(
+                    "SELECT checkpoint_ns, checkpoint_id, type, checkpoint FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id",
+                    (thread_id,),
+                ).fetchall()
+                for checkpoint_ns, checkpoint_id, type_, blob in rows:
+                    checkpoint = serde.loads_typed((type_, blob))
+                    updated = transform(conn, store, thread_id, checkpoint)
+                    if updated is None:
+                        continue
+                    conn.execute(
+                        "UPDATE checkpoints SET type = ?, checkpoint = ? WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        (*serde.dumps_typed(updated), thread_id, checkpoint_ns, checkpoint_id),
+                    )
+                    rewritten += 1
+            store.forget(thread_id)
+        return rewritten
+    finally:
+        conn.close()
+
+
+def _to_refs(conn, store, thread_id, checkpoint):
+    if is_refs(checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)):
+        return None
+    encoded, rows = store.encode(thread_id, checkpoint)
+    if encoded is checkpoint:
+        return None
+    conn.executemany(INSERT_SQL, rows)
+    return encoded
+
+
+def _to_inline(conn, store, thread_id, checkpoint):
+    if not is_refs(checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)):
+        return None
+    return store.hydrate_sync(conn, thread_id, checkpoint)
+
+
+def migrate(path: str) -> int:
+    """Move messages of every checkpoint into `message_store`. Returns checkpoints rewritten."""
+    rewritten = _rewrite(path, _to_refs)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return rewritten
+
+
+def inline(path: str) -> int:
+    """Undo `migrate`: put the full message list back into every checkpoint."""
+    rewritten = _rewrite(path, _to_inline)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM message_store")
+    finally:
+        conn.close()
+    return rewritten
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("migrate", "inline"):
+        print("usage: python message_store.py migrate|inline DB [DB ...]")
+        sys.exit(1)
+    command = migrate if sys.argv[1] == "migrate" else inline
+    for path in sys.argv[2:]:
+        print(f"{path}: rewrote {command(path)} checkpoints")
@@ -0,0 +1,46 @@
+"""
+Small in-process metric types shared by the backends.
+"""
+import threading
+
+
+# Upper bounds (seconds) of latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# Upper bounds of size histogram buckets, in bytes.
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, float("inf"))
+
+
+class Histogram:
+    """Count, total, max and a (non-cumulative) bucket histogram of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(self.bounds)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.buckets[i] += 1
+                    break
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_seconds": self.total,
+                "mean_seconds": self.total / self.count if self.count else 0.0,
+                "max_seconds": self.max,
+                "buckets": {
+                    ("+Inf" if bound == float("inf") else str(bound)): n
+                    for bound, n in zip(self.bounds, self.buckets)
+                },
+            }
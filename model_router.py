@@ -0,0 +1,449 @@
+"""
+Model routing, hedged requests and circuit breaking in front of the chat model.
+
+The graphs used one `ChatOpenAI(model="gpt-4o-mini")` with no timeout and no fallback,
+so a single slow upstream response set the p99 of /chat. `RoutedChatModel` wraps
+several chat models ("endpoints") and, for each call:
+
+- routes trivial turns (greetings, thanks, acknowledgements; see `trivial_turn`) to the
+  "cheap" endpoint when one is configured, and everything else to "primary"
+- hedges: if the chosen endpoint has not streamed its first chunk after its p95 time to
+  first chunk (clamped to [MODEL_HEDGE_MIN_DELAY, MODEL_HEDGE_MAX_DELAY]), sends the same
+  request to the next endpoint and streams whichever answers first; the other is cancelled
+- fails over to the next endpoint when a call fails before its first chunk, and skips
+  endpoints whose circuit breaker is open (MODEL_BREAKER_FAILURES consecutive failures
+  open it for MODEL_BREAKER_RESET seconds, then one trial call decides)
+
+Only the winning stream is passed on, chunk by chunk, so /chat streams exactly as
+before; once a chunk has been sent the call is committed to that endpoint. Hedging
+needs the async API; sync calls (the Streamlit graphs) get routing, breakers and
+failover only.
+
+Configured from the environment by `routed_chat_model()`:
+
+    MODEL_PRIMARY=gpt-4o-mini
+    MODEL_HEDGE=                     model to hedge/fail over to (empty: none)
+    MODEL_HEDGE_BASE_URL=            its endpoint, if not the default one
+    MODEL_HEDGE_DELAY=1.0            hedge delay until enough latencies are known
+    MODEL_HEDGE_MIN_DELAY=0.25
+    MODEL_HEDGE_MAX_DELAY=5
+    MODEL_CHEAP=                     model for trivial turns (empty: none)
+    MODEL_CHEAP_MAX_CHARS=160
+    MODEL_BREAKER_FAILURES=5
+    MODEL_BREAKER_RESET=30
+    MODEL_TIMEOUT=60                 request timeout of each endpoint
+    MODEL_MAX_RETRIES=1
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream, generate_from_stream
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+
+from llm_cache import child_config
+from metrics import Histogram
+
+
+# ---------------------------- Trivial turns ----------------------------
+
+SMALL_TALK = frozenset(
+    "hi hello hey hiya yo thanks thank you thx ty ok okay k cool great nice awesome perfect "
+    "got it bye goodbye see ya later good morning afternoon evening night cheers lol haha "
+    "that's thats all for now much so very a lot appreciate appreciated welcome".split()
+)
+_WORD = re.compile(r"[a-z']+")
+
+
+def trivial_turn(messages, max_chars: int = 160) -> bool:
+    """
+    True for a turn that needs no tools and no reasoning: the prompt ends with a short
+    user message made only of small talk, which is not the answer to a question the
+    assistant just asked (a bare "ok" may confirm a pending create or delete).
+    """
+    if not messages or not isinstance(messages[-1], HumanMessage):
+        return False
+    text = messages[-1].content
+    if not isinstance(text, str) or not text.strip() or len(text) > max_chars:
+        return False
+    previous = next((m for m in reversed(messages[:-1]) if isinstance(m, AIMessage)), None)
+    if previous is not None and isinstance(previous.content, str) and previous.content.rstrip().endswith("?"):
+        return False
+    words = _WORD.findall(text.lower())
+    return bool(words) and all(w in SMALL_TALK for w in words)
+
+
+# ---------------------------- Endpoint state ----------------------------
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures; half-open (one trial call) after `reset` seconds."""
+
+    def __init__(self, failures: int = 5, reset: float = 30.0):
+        self.failures = failures
+        self.reset = reset
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a call could go through now; unlike `acquire`, takes nothing."""
+        with self._lock:
+            return self.state == "closed" or time.monotonic() - self.opened_at >= self.reset
+
+    def acquire(self) -> bool:
+        """Permission for a call that is starting now; when not closed, this takes the one trial call."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset:
+                # let one call through every `reset` seconds; its outcome closes or reopens the breaker
+                self.state = "half_open"
+                self.opened_at = now
+                return True
+            return False
+
+    def release(self):
+        """Give back the trial of a call that ended without an outcome (e.g. a cancelled hedge)."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.state == "half_open" or self.consecutive >= self.failures:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """Latency window, breaker and counters of one routed model."""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, window: int = 200):
+        self.name = name
+        self.breaker = breaker
+        self._recent = deque(maxlen=window)
+        self.ttft = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        # hedged calls that lost the race and were cancelled
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def observe_ttft(self, seconds: float):
+        self.ttft.observe(seconds)
+        with self._lock:
+            self._recent.append(seconds)
+
+    def p95(self, min_samples: int = 20) -> float | None:
+        with self._lock:
+            if len(self._recent) < min_samples:
+                return None
+            ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wins": self.wins,
+            "cancelled": self.cancelled,
+            "p95_ttft_seconds": self.p95(),
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "ttft": self.ttft.as_dict(),
+        }
+
+
+class ModelRouter:
+    """Routing policy and per-endpoint state, shared by every bound copy of a `RoutedChatModel`."""
+
+    def __init__(
+        self,
+        names=("primary",),
+        hedge_delay: float = 1.0,
+        min_delay: float = 0.25,
+        max_delay: float = 5.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        cheap_max_chars: int = 160,
+        classifier=None,
+    ):
+        self.endpoints = {name: Endpoint(name, CircuitBreaker(breaker_failures, breaker_reset)) for name in names}
+        self.hedge_delay = hedge_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.cheap_max_chars = cheap_max_chars
+        # messages -> True for trivial turns; defaults to the `trivial_turn` heuristic
+        self.classifier = classifier
+        self.hedges = 0
+        self.failovers = 0
+        self.cheap_routes = 0
+
+    def delay(self, name: str) -> float:
+        """Seconds to wait for the first chunk of `name` before hedging."""
+        p95 = self.endpoints[name].p95()
+        if p95 is None:
+            return self.hedge_delay
+        return min(self.max_delay, max(self.min_delay, p95))
+
+    def order(self, names, messages):
+        """Endpoints to try, first choice first."""
+        order = [n for n in ("primary", "hedge") if n in names]
+        if "cheap" in names:
+            trivial = self.classifier(messages) if self.classifier else trivial_turn(messages, self.cheap_max_chars)
+            if trivial:
+                self.cheap_routes += 1
+                order.insert(0, "cheap")
+        return order
+
+    def stats(self):
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "cheap_routes": self.cheap_routes,
+            "endpoints": {name: e.as_dict() for name, e in self.endpoints.items()},
+        }
+
+
+# ---------------------------- Chat model wrapper ----------------------------
+
+async def _first(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class _Attempt:
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.first = asyncio.ensure_future(_first(stream))
+
+    async def cancel(self):
+        self.first.cancel()
+        try:
+            await self.first
+        except BaseException:
+            pass
+        await self.stream.aclose()
+
+
+class RoutedChatModel(BaseChatModel):
+    """Chat model that routes, hedges and fails over between `models` (endpoint name -> chat model)."""
+
+    models: dict
+    router: Any
+    # the primary model's name (llm_cache.py scopes cached responses by it)
+    model_name: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"models": {n: m.bind_tools(tools, **kwargs) for n, m in self.models.items()}})
+
+    def _inner_config(self, run_manager):
+        # only the winner's chunks are emitted, by the wrapper
+        return child_config(run_manager)
+
+    def _candidates(self, messages):
+        order = self.router.order(self.models, messages)
+        # only checks the breakers: a half-open trial is taken when the call is launched
+        allowed = [n for n in order if self.router.endpoints[n].breaker.available()]
+        # every breaker open: try the first choice anyway rather than fail the turn
+        return allowed or order[:1]
+
+    # ---------------------------- generate / stream ----------------------------
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        config = self._inner_config(run_manager)
+        names = self._candidates(messages)
+        error = None
+        for i, name in enumerate(names):
+            endpoint = self.router.endpoints[name]
+            # the first choice runs even when its breaker is open (see `_candidates`)
+            if not endpoint.breaker.acquire() and i > 0:
+                continue
+            if error is not None:
+                self.router.failovers += 1
+            endpoint.calls += 1
+            started = time.perf_counter()
+            stream = self.models[name].stream(messages, config=config, stop=stop, **kwargs)
+            try:
+                first = next(stream, None)
+            except Exception as e:
+                endpoint.errors += 1
+                endpoint.breaker.record_failure()
+                error = e
+                continue
+            endpoint.observe_ttft(time.perf_counter() - started)
+            endpoint.wins += 1
+            yield from self._committed(endpoint, first, stream)
+            return
+        raise error
+
+    def _committed(self, endpoint, first, stream):
+        try:
+            if first is not None:
+                first.id = None
+                yield ChatGenerationChunk(message=first)
+            for chunk in stream:
+                chunk.id = None
+                yield ChatGenerationChunk(message=chunk)
+        except Exception:
+            endpoint.errors += 1
+            endpoint.breaker.record_failure()
+            raise
+        endpoint.breaker.record_success()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        router = self.router
+        config = self._inner_config(run_manager)
+        names = self._candidates(messages)
+        attempts: list[_Attempt] = []
+        next_index = 0
+        winner = None
+
+        def launch(force=False):
+            """Start the next candidate whose breaker lets the call through; False if none is left."""
+            nonlocal next_index
+            while next_index < len(names):
+                name = names[next_index]
+                next_index += 1
+                # a breaker may have opened (or its trial been taken) since `_candidates`
+                if router.endpoints[name].breaker.acquire() or force:
+                    router.endpoints[name].calls += 1
+                    attempts.append(_Attempt(name, self.models[name].astream(messages, config=config, stop=stop, **kwargs)))
+                    return True
+            return False
+
+        try:
+            # the first choice runs even when its breaker is open (see `_candidates`)
+            launch(force=True)
+            hedge_at = time.perf_counter() + router.delay(names[0])
+            while winner is None:
+                # hedge once, while only the first choice is running
+                can_hedge = next_index < len(names) and len(attempts) == 1
+                timeout = max(0.0, hedge_at - time.perf_counter()) if can_hedge else None
+                done, _ = await asyncio.wait([a.first for a in attempts], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if launch():
+                        router.hedges += 1
+                    continue
+                for attempt in [a for a in attempts if a.first in done]:
+                    endpoint = router.endpoints[attempt.name]
+                    if attempt.first.exception() is None:
+                        winner = attempt
+                        break
+                    endpoint.errors += 1
+                    endpoint.breaker.record_failure()
+                    attempts.remove(attempt)
+                    error = attempt.first.exception()
+                if winner is None and not attempts:
+                    if not launch():
+                        raise error
+                    router.failovers += 1
+                    hedge_at = time.perf_counter() + router.delay(names[next_index - 1])
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    if winner is not None:
+                        router.endpoints[attempt.name].cancelled += 1
+                    await attempt.cancel()
+                    # no outcome: a trial call it held can be made again
+                    router.endpoints[attempt.name].breaker.release()
+
+        endpoint = router.endpoints[winner.name]
+        endpoint.observe_ttft(time.perf_counter() - winner.started)
+        endpoint.wins += 1
+        try:
+            chunk = winner.first.result()
+            if chunk is not None:
+                chunk.id = None
+                yield ChatGenerationChunk(message=chunk)
+                async for chunk in winner.stream:
+                    chunk.id = None
+                    yield ChatGenerationChunk(message=chunk)
+        except Exception:
+            endpoint.errors += 1
+            endpoint.breaker.record_failure()
+            raise
+        finally:
+            await winner.stream.aclose()
+        endpoint.breaker.record_success()
+
+
+# ---------------------------- Shared router ----------------------------
+
+_shared_router: ModelRouter | None = None
+
+
+def model_router() -> ModelRouter | None:
+    """The router of the model built by `routed_chat_model()`, if it routes between several endpoints."""
+    return _shared_router
+
+
+def _chat_openai(model: str, base_url: str | None = None):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        base_url=base_url or None,
+        timeout=float(os.getenv("MODEL_TIMEOUT", "60")),
+        max_retries=int(os.getenv("MODEL_MAX_RETRIES", "1")),
+        # report usage (and cached prompt tokens) for streamed responses too
+        stream_usage=True,
+    )
+
+
+def routed_chat_model():
+    """
+    The chat model for MODEL_PRIMARY, wrapped in a `RoutedChatModel` with the shared
+    router when MODEL_HEDGE or MODEL_CHEAP adds a second endpoint.
+    """
+    global _shared_router
+    models = {"primary": _chat_openai(os.getenv("MODEL_PRIMARY", "gpt-4o-mini"))}
+    if os.getenv("MODEL_HEDGE"):
+        models["hedge"] = _chat_openai(os.environ["MODEL_HEDGE"], os.getenv("MODEL_HEDGE_BASE_URL"))
+    if os.getenv("MODEL_CHEAP"):
+        models["cheap"] = _chat_openai(os.environ["MODEL_CHEAP"])
+    if len(models) == 1:
+        return models["primary"]
+    if _shared_router is None:
+        _shared_router = ModelRouter(
+            names=tuple(models),
+            hedge_delay=float(os.getenv("MODEL_HEDGE_DELAY", "1.0")),
+            min_delay=float(os.getenv("MODEL_HEDGE_MIN_DELAY", "0.25")),
+            max_delay=float(os.getenv("MODEL_HEDGE_MAX_DELAY", "5")),
+            breaker_failures=int(os.getenv("MODEL_BREAKER_FAILURES", "5")),
+            breaker_reset=float(os.getenv("MODEL_BREAKER_RESET", "30")),
+            cheap_max_chars=int(os.getenv("MODEL_CHEAP_MAX_CHARS", "160")),
+        )
+    return RoutedChatModel(models=models, router=_shared_router, model_name=models["primary"].model_name)
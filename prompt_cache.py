@@ -0,0 +1,86 @@
+"""
+Provider prompt caching: a byte-stable prompt prefix and the cached token ratio.
+
+OpenAI (and other providers) cache the longest prompt prefix they have seen recently, in
+blocks, and bill and prefill the cached part much cheaper. The prefix only matches if it
+is byte-identical: tool schemas first, then the system prompt, then the history. Before,
+`chat_node` rebuilt its system prompt string on every call and `bind_tools` serialized
+the tools in whatever order the MCP server listed them, and the history window slid on
+every turn (see history.py), so most calls only hit the cache for the first block or two.
+
+- `PromptPrefix`: the system message and tool schemas, converted once per compiled graph
+  and sorted by tool name, with a fingerprint of their bytes
+- `PromptCacheStats`: input and cached input tokens from the responses' `usage_metadata`
+  (`input_token_details.cache_read`), served on GET /metrics/prompt-cache
+
+ChatOpenAI only reports usage for streamed responses with `stream_usage=True`.
+"""
+import hashlib
+import json
+import textwrap
+import threading
+
+from langchain_core.messages import SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+class PromptPrefix:
+    """The static head of every chat prompt: tool schemas and the system message."""
+
+    def __init__(self, system_prompt: str, tools=()):
+        self.text = textwrap.dedent(system_prompt).strip()
+        self.tools = sorted(
+            (convert_to_openai_tool(t) for t in tools),
+            key=lambda t: t.get("function", {}).get("name", ""),
+        )
+        canonical = json.dumps([self.text, self.tools], sort_keys=True, separators=(",", ":"))
+        self.fingerprint = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+        # a fixed id so history.py counts its tokens once
+        self.system_message = SystemMessage(content=self.text, id=f"system-prompt-{self.fingerprint}")
+
+
+class PromptCacheStats:
+    """Cached input token totals of the chat model calls, and how often the prefix changed."""
+
+    def __init__(self):
+        self.calls = 0
+        # calls that reported usage (responses from llm_cache.py do not)
+        self.reported = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.cache_hits = 0
+        self.prefix_changes = 0
+        self.fingerprint = None
+        self._lock = threading.Lock()
+
+    def observe(self, message, prefix: PromptPrefix | None = None):
+        usage = getattr(message, "usage_metadata", None)
+        with self._lock:
+            self.calls += 1
+            if prefix is not None and prefix.fingerprint != self.fingerprint:
+                if self.fingerprint is not None:
+                    self.prefix_changes += 1
+                self.fingerprint = prefix.fingerprint
+            if not usage or not usage.get("input_tokens"):
+                return
+            cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+            self.reported += 1
+            self.input_tokens += usage["input_tokens"]
+            self.cached_tokens += cached
+            self.cache_hits += cached > 0
+
+    def ratio(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "reported": self.reported,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": self.cached_tokens / self.input_tokens if self.input_tokens else 0.0,
+                "cache_hits": self.cache_hits,
+                "prefix_fingerprint": self.fingerprint,
+                "prefix_changes": self.prefix_changes,
+            }
@@ -0,0 +1,564 @@
+"""
+Checkpoint retention for the SQLite checkpointer (sqlite_pool.py).
+
+LangGraph never deletes a checkpoint: a turn that calls a tool twice writes an "input"
+checkpoint plus one full snapshot per step, and every thread keeps all of them forever.
+`Retention` runs as a background task and applies, per thread:
+
+- drop_intermediate: once a turn is complete, keep only its last checkpoint; the
+  "input" checkpoint and the chat_node/tools steps before it go, with their writes
+- keep_last: keep at most N checkpoints per thread, the newest
+- archive_after: threads idle for longer are moved, as their latest state, into a
+  zlib-compressed cold store (a separate SQLite file) and deleted from the hot database
+
+Work is done in pages of `batch_size` threads, each a short write transaction, with a
+pause in between, so turns waiting for the writer connection are not held up; the
+planning reads use the reader connections. Threads written within the last `settle`
+seconds are left alone, so a turn in flight (or a batched-durability buffer, see
+sqlite_pool.py) is never touched. A pass only compacts threads written since the
+previous one; the first pass after startup looks at every thread.
+
+Freed pages are handed back to the filesystem with `PRAGMA incremental_vacuum` when the
+database uses auto_vacuum=INCREMENTAL (new databases do, see `SqlitePool.open`). An
+existing database can be converted offline, once, with --enable-incremental-vacuum.
+
+An archived thread comes back on its next use: /chat and /conversations call
+`ensure_hot`, which restores it from the cold store when the hot database has no
+checkpoint for it. POST /retention/restore/{thread_id} restores one explicitly.
+
+Enabled in main.py by RETENTION=on, configured by RETENTION_* (see `Retention.from_env`).
+From the command line, with the same configuration:
+
+    python retention.py new_chatbot.db --dry-run
+    python retention.py new_chatbot.db
+    python retention.py new_chatbot.db --restore THREAD_ID
+    python retention.py new_chatbot.db --enable-incremental-vacuum
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from metrics import Histogram
+from sqlite_pool import LATEST_ID_SQL, PooledAsyncSqliteSaver
+from thread_catalog import UPSERT_SQL as CATALOG_UPSERT_SQL
+
+
+logger = logging.getLogger(__name__)
+
+# threads last written in ((after_ts, after_id), upto], oldest first
+THREADS_SQL = """
+SELECT thread_id, last_updated_at, created_at, message_count
+FROM thread_catalog
+WHERE (last_updated_at, thread_id) > (?, ?) AND last_updated_at <= ?
+ORDER BY last_updated_at, thread_id
+LIMIT ?
+"""
+
+ROOT_CHECKPOINTS_SQL = (
+    "SELECT checkpoint_id, json_extract(CAST(metadata AS TEXT), '$.source') FROM checkpoints "
+    "WHERE thread_id = ? AND checkpoint_ns = '' ORDER BY checkpoint_id"
+)
+
+THREAD_BYTES_SQL = """
+SELECT
+    (SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints WHERE thread_id = :t)
+  + (SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes WHERE thread_id = :t)
+  + (SELECT COALESCE(SUM(LENGTH(value)), 0) FROM message_store WHERE thread_id = :t)
+"""
+
+THREAD_TABLES = ("checkpoints", "writes", "message_store", "thread_catalog", "search_messages")
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_threads (
+    thread_id TEXT PRIMARY KEY,
+    archived_at TEXT NOT NULL,
+    last_updated_at TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+"""
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# most SQLite builds allow 999 or more host parameters per statement
+MAX_PARAMS = 500
+
+
+def retention_enabled() -> bool:
+    return os.getenv("RETENTION", "off").lower() in ("1", "true", "yes", "on")
+
+
+def doomed(rows, keep_last: int = 0, drop_intermediate: bool = True):
+    """
+    Ids of the root checkpoints of one thread to delete, given its (checkpoint_id,
+    source) rows oldest first. The newest checkpoint is always kept.
+    """
+    if not rows:
+        return []
+    ids = [checkpoint_id for checkpoint_id, _ in rows]
+    kept = ids
+    if drop_intermediate:
+        # the last checkpoint of a turn is the one just before the next turn's "input"
+        kept = [checkpoint_id for (checkpoint_id, _), (_, source) in zip(rows, rows[1:]) if source == "input"]
+        kept.append(ids[-1])
+    if keep_last > 0:
+        kept = kept[-keep_last:]
+    kept = set(kept)
+    return [checkpoint_id for checkpoint_id in ids if checkpoint_id not in kept]
+
+
+def _chunks(items, size=MAX_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ColdStore:
+    """Archived threads: one zlib-compressed record per thread in its own SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(ARCHIVE_SCHEMA)
+        return conn
+
+    def put_many(self, rows):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO archived_threads VALUES (?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+
+    def has(self, thread_id: str) -> bool:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM archived_threads WHERE thread_id = ?", (thread_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def list(self, limit: int = 100, after: str = ""):
+        """(thread_id, archived_at, last_updated_at) rows ordered by thread id, after `after`."""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT thread_id, archived_at, last_updated_at FROM archived_threads "
+                "WHERE thread_id > ? ORDER BY thread_id LIMIT ?",
+                (after, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def get(self, thread_id: str):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT type, payload FROM archived_threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def delete(self, thread_id: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM archived_threads WHERE thread_id = ?", (thread_id,))
+        finally:
+            conn.close()
+
+
+class Retention:
+    """Background retention passes over a `PooledAsyncSqliteSaver` (see module docstring)."""
+
+    def __init__(
+        self,
+        checkpointer: PooledAsyncSqliteSaver,
+        *,
+        keep_last: int = 0,
+        drop_intermediate: bool = True,
+        archive_after: float | None = None,
+        archive_path: str = "archive.db",
+        settle: float = 300.0,
+        interval: float = 3600.0,
+        batch_size: int = 50,
+        pause: float = 0.05,
+        vacuum_pages: int = 256,
+    ):
+        self.checkpointer = checkpointer
+        self.keep_last = keep_last
+        self.drop_intermediate = drop_intermediate
+        self.archive_after = archive_after
+        self.cold = ColdStore(archive_path)
+        self.settle = settle
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        # threads written up to this timestamp were compacted by an earlier pass
+        self._watermark = ""
+        self._lock = asyncio.Lock()
+        self._restore_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.last_report: dict | None = None
+        self.totals = {
+            "passes": 0,
+            "failures": 0,
+            "checkpoints_deleted": 0,
+            "writes_deleted": 0,
+            "threads_archived": 0,
+            "threads_restored": 0,
+            "bytes_reclaimed": 0,
+            "pages_vacuumed": 0,
+        }
+        self.pass_times = Histogram()
+
+    @classmethod
+    def from_env(cls, checkpointer):
+        """Retention for the configured policies; None if the checkpointer is not the SQLite one."""
+        if not isinstance(checkpointer, PooledAsyncSqliteSaver):
+            logger.warning("retention: only the sqlite checkpoint backend is supported, not %s", type(checkpointer).__name__)
+            return None
+        archive_days = float(os.getenv("RETENTION_ARCHIVE_AFTER_DAYS", "30"))
+        return cls(
+            checkpointer,
+            keep_last=int(os.getenv("RETENTION_KEEP_LAST", "20")),
+            drop_intermediate=os.getenv("RETENTION_DROP_INTERMEDIATE", "true").lower() in ("1", "true", "yes"),
+            archive_after=archive_days * 86400 if archive_days > 0 else None,
+            archive_path=os.getenv("RETENTION_ARCHIVE_DB", "archive.db"),
+            settle=float(os.getenv("RETENTION_SETTLE_SECONDS", "300")),
+            interval=float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")),
+            batch_size=int(os.getenv("RETENTION_BATCH", "50")),
+            vacuum_pages=int(os.getenv("RETENTION_VACUUM_PAGES", "256")),
+        )
+
+    # ---------------------------- Passes ----------------------------
+
+    async def run_pass(self, dry_run: bool = False):
+        """
+        One retention pass. With `dry_run` nothing is changed and the report says what
+        would be deleted and how many bytes of checkpoint data that would reclaim.
+        """
+        async with self._lock:
+            start = time.perf_counter()
+            await self.checkpointer.setup()
+            report = {
+                "dry_run": dry_run,
+                "threads_scanned": 0,
+                "checkpoints_deleted": 0,
+                "writes_deleted": 0,
+                "threads_archived": 0,
+                "bytes_reclaimed": 0,
+                "archive_bytes": 0,
+            }
+            now = datetime.now(timezone.utc)
+            after = self._watermark
+            if self.archive_after is not None:
+                cutoff = (now - timedelta(seconds=self.archive_after)).isoformat()
+                await self._archive(cutoff, dry_run, report)
+                # archived threads are gone (or, in a dry run, would be)
+                after = max(after, cutoff)
+            if self.keep_last > 0 or self.drop_intermediate:
+                settled = (now - timedelta(seconds=self.settle)).isoformat()
+                await self._compact(after, settled, dry_run, report)
+                if not dry_run:
+                    self._watermark = settled
+            report.update(await self._vacuum(dry_run))
+            report["duration_s"] = round(time.perf_counter() - start, 3)
+
+            if not dry_run:
+                self.pass_times.observe(report["duration_s"])
+                self.totals["passes"] += 1
+                for key in ("checkpoints_deleted", "writes_deleted", "threads_archived", "bytes_reclaimed", "pages_vacuumed"):
+                    self.totals[key] += report[key]
+            self.last_report = report
+            return report
+
+    async def _threads(self, upto: str, after: str = ""):
+        """Pages of catalog rows last written in (after, upto], oldest first."""
+        cursor = (after, "")
+        while True:
+            async with self.checkpointer.reader() as saver:
+                async with saver.conn.execute(THREADS_SQL, (*cursor, upto, self.batch_size)) as cur:
+                    rows = await cur.fetchall()
+            if rows:
+                yield rows
+            if len(rows) < self.batch_size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+
+    async def _measure(self, conn, thread_id, checkpoint_ids):
+        """(checkpoint bytes, writes, writes bytes) of some root checkpoints of a thread."""
+        nbytes = nwrites = 0
+        for chunk in _chunks(checkpoint_ids):
+            marks = ", ".join("?" * len(chunk))
+            async with conn.execute(
+                f"SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints "
+                f"WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id IN ({marks})",
+                (thread_id, *chunk),
+            ) as cur:
+                nbytes += (await cur.fetchone())[0]
+            async with conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM writes "
+                f"WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id IN ({marks})",
+                (thread_id, *chunk),
+            ) as cur:
+                count, size = await cur.fetchone()
+            nwrites += count
+            nbytes += size
+        return nbytes, nwrites
+
+    async def _compact(self, after, upto, dry_run, report):
+        async for rows in self._threads(upto, after):
+            plan = {}
+            async with self.checkpointer.reader() as saver:
+                for thread_id, *_ in rows:
+                    async with saver.conn.execute(ROOT_CHECKPOINTS_SQL, (thread_id,)) as cur:
+                        checkpoint_ids = doomed(await cur.fetchall(), self.keep_last, self.drop_intermediate)
+                    if not checkpoint_ids:
+                        continue
+                    plan[thread_id] = checkpoint_ids
+                    nbytes, nwrites = await self._measure(saver.conn, thread_id, checkpoint_ids)
+                    report["checkpoints_deleted"] += len(checkpoint_ids)
+                    report["writes_deleted"] += nwrites
+                    report["bytes_reclaimed"] += nbytes
+            report["threads_scanned"] += len(rows)
+
+            if plan and not dry_run:
+                # only checkpoints older than the thread's newest are deleted, so a turn
+                # that started since the plan was made is not affected
+                async with self.checkpointer.pool.writer() as conn:
+                    try:
+                        for thread_id, checkpoint_ids in plan.items():
+                            for chunk in _chunks(checkpoint_ids):
+                                marks = ", ".join("?" * len(chunk))
+                                for table in ("writes", "checkpoints"):
+                                    await conn.execute(
+                                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id IN ({marks})",
+                                        (thread_id, *chunk),
+                                    )
+                        await conn.commit()
+                    except BaseException:
+                        await conn.rollback()
+                        raise
+            await asyncio.sleep(self.pause)
+
+    def _pack(self, record):
+        type_, blob = self.checkpointer.serde.dumps_typed(record)
+        return type_, zlib.compress(blob, 6)
+
+    async def _archive(self, cutoff, dry_run, report):
+        archived_at = datetime.now(timezone.utc).isoformat()
+        async for rows in self._threads(cutoff):
+            records = []
+            for thread_id, last_updated_at, created_at, message_count in rows:
+                checkpoint_tuple = await self.checkpointer.aget_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+                if checkpoint_tuple is None:
+                    continue
+                async with self.checkpointer.reader() as saver:
+                    async with saver.conn.execute(THREAD_BYTES_SQL, {"t": thread_id}) as cur:
+                        nbytes = (await cur.fetchone())[0]
+                record = {
+                    "checkpoint": checkpoint_tuple.checkpoint,
+                    "metadata": checkpoint_tuple.metadata,
+                    "catalog": [thread_id, created_at, last_updated_at, message_count],
+                }
+                # serializing a long history is CPU work, keep it off the event loop
+                type_, payload = await asyncio.to_thread(self._pack, record)
+                checkpoint_id = checkpoint_tuple.checkpoint["id"]
+                records.append((thread_id, archived_at, last_updated_at, checkpoint_id, type_, payload))
+                report["threads_archived"] += 1
+                report["bytes_reclaimed"] += nbytes
+                report["archive_bytes"] += len(payload)
+            report["threads_scanned"] += len(rows)
+
+            if records and not dry_run:
+                await asyncio.to_thread(self.cold.put_many, records)
+                await self._delete_archived(records, report)
+            await asyncio.sleep(self.pause)
+
+    async def _delete_archived(self, records, report):
+        async with self.checkpointer.pool.writer() as conn:
+            try:
+                for thread_id, _, _, checkpoint_id, _, _ in records:
+                    async with conn.execute(LATEST_ID_SQL, (thread_id,)) as cur:
+                        row = await cur.fetchone()
+                    if row is None or row[0] != checkpoint_id:
+                        # written to since it was read: keep it, the archived copy is stale
+                        # but a later pass replaces it
+                        report["threads_archived"] -= 1
+                        continue
+                    for table in THREAD_TABLES:
+                        await conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                    self.checkpointer.message_store.forget(thread_id)
+                    if self.checkpointer.search_index is not None:
+                        self.checkpointer.search_index.forget(thread_id)
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+    async def _vacuum(self, dry_run):
+        async with self.checkpointer.reader() as saver:
+            values = []
+            for pragma in ("auto_vacuum", "freelist_count", "page_size"):
+                async with saver.conn.execute(f"PRAGMA {pragma}") as cur:
+                    values.append((await cur.fetchone())[0])
+        mode, free, page_size = values
+        result = {"auto_vacuum": AUTO_VACUUM_MODES.get(mode, mode), "free_pages": free, "page_size": page_size, "pages_vacuumed": 0}
+        if dry_run or mode != 2:
+            return result
+        while free > 0:
+            pages = min(free, self.vacuum_pages)
+            async with self.checkpointer.pool.writer() as conn:
+                await conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+            free -= pages
+            result["pages_vacuumed"] += pages
+            await asyncio.sleep(self.pause)
+        return result
+
+    # ---------------------------- Restore ----------------------------
+
+    async def arestore(self, thread_id: str) -> bool:
+        """
+        Put an archived thread back into the hot database. False if it is not archived;
+        ValueError if the thread has been written to since it was archived (the archived
+        checkpoint would be older than the new ones and never become the latest).
+        """
+        async with self._restore_lock:
+            row = await asyncio.to_thread(self.cold.get, thread_id)
+            if row is None:
+                return False
+            if await self.checkpointer.alatest_checkpoint_id(thread_id) is not None:
+                raise ValueError(f"thread {thread_id} has new checkpoints since it was archived; not restoring over them")
+            await self._restore(thread_id, *row)
+            self.totals["threads_restored"] += 1
+            return True
+
+    async def ensure_hot(self, thread_id: str) -> bool:
+        """Restore `thread_id` if it is archived and not in the hot database. True if it was restored."""
+        if await self.checkpointer.alatest_checkpoint_id(thread_id) is not None:
+            return False
+        if not await asyncio.to_thread(self.cold.has, thread_id):
+            return False
+        try:
+            return await self.arestore(thread_id)
+        except ValueError:
+            # restored (or started afresh) by a concurrent request in the meantime
+            return False
+
+    async def _restore(self, thread_id, type_, payload):
+        record = self.checkpointer.serde.loads_typed((type_, zlib.decompress(payload)))
+        checkpoint = record["checkpoint"]
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        await self.checkpointer.aput(config, checkpoint, record["metadata"], checkpoint["channel_versions"])
+        await self.checkpointer.aflush()
+        async with self.checkpointer.pool.writer() as conn:
+            # aput dated the thread by its last checkpoint, bring back its creation time
+            await conn.execute(CATALOG_UPSERT_SQL, tuple(record["catalog"]))
+            await conn.commit()
+        await asyncio.to_thread(self.cold.delete, thread_id)
+
+    # ---------------------------- Lifecycle ----------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # first pass shortly after startup, not in the middle of it
+        await asyncio.sleep(min(self.interval, 60.0))
+        while True:
+            try:
+                report = await self.run_pass()
+                logger.info("retention pass: %s", report)
+            except Exception as e:
+                self.totals["failures"] += 1
+                logger.warning("retention pass failed: %r", e)
+            await asyncio.sleep(self.interval)
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "policy": {
+                "keep_last": self.keep_last,
+                "drop_intermediate": self.drop_intermediate,
+                "archive_after_s": self.archive_after,
+                "settle_s": self.settle,
+                "interval_s": self.interval,
+            },
+            "archive_db": self.cold.path,
+            **self.totals,
+            "pass_seconds": self.pass_times.as_dict(),
+            "last_report": self.last_report,
+        }
+
+
+# ---------------------------- Command line ----------------------------
+
+def enable_incremental_vacuum(path: str):
+    """Switch an existing database to auto_vacuum=INCREMENTAL (a full VACUUM: run it offline)."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def _main(args):
+    if args.enable_incremental_vacuum:
+        mode = enable_incremental_vacuum(args.db)
+        print(f"{args.db}: auto_vacuum={AUTO_VACUUM_MODES.get(mode, mode)}")
+        return
+
+    from thread_catalog import backfill
+
+    checkpointer = await PooledAsyncSqliteSaver.from_path(args.db, readers=2)
+    await checkpointer.setup()
+    try:
+        async with checkpointer.reader() as saver:
+            async with saver.conn.execute("SELECT EXISTS (SELECT 1 FROM thread_catalog)") as cur:
+                has_catalog = (await cur.fetchone())[0]
+        if not has_catalog:
+            # retention walks the thread catalog; databases from before it need a backfill
+            print(f"{args.db}: backfilled {await asyncio.to_thread(backfill, args.db)} threads into the catalog")
+
+        retention = Retention.from_env(checkpointer)
+        if args.restore:
+            try:
+                restored = await retention.arestore(args.restore)
+            except ValueError as e:
+                print(f"{args.restore}: {e}")
+                return
+            print(f"{args.restore}: {'restored' if restored else 'not archived'}")
+            return
+        report = await retention.run_pass(dry_run=args.dry_run)
+        for key, value in report.items():
+            print(f"{key:<20} {value}")
+    finally:
+        await checkpointer.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the RETENTION_* policies to a checkpoint database.")
+    parser.add_argument("db")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be deleted, change nothing")
+    parser.add_argument("--restore", metavar="THREAD_ID", help="move an archived thread back")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true")
+    asyncio.run(_main(parser.parse_args()))
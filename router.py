@@ -0,0 +1,123 @@
+"""
+Front router for several API workers (main.py processes) sharing one checkpointer.
+
+Requests that belong to a thread go to the worker that owns it on a consistent hash
+ring (see affinity.py): /chat by the `thread_id` of the body, /conversations/{thread_id}
+by path. A batch lives in the process that runs it, so /batch requests go by batch id:
+the router picks the id of a new batch (POST /batch?batch_id=...) and sends every
+/batch/{batch_id} request after it to the same worker. The batch's turns run there, not
+on their threads' owners (see batch_runner.py). Everything else (/threads,
+/metrics/...) is spread round-robin. Responses, including the /chat stream, are passed
+through as they arrive.
+
+    WORKER_URLS=http://127.0.0.1:8081,http://127.0.0.1:8082 uvicorn router:app --port 8080
+
+Each worker is a separate `uvicorn main:app --port 808N`, with CHECKPOINT_BACKEND=sqlite
+(workers on one host, same CHECKPOINT_DB) or postgres (several hosts).
+"""
+import itertools
+import json
+import os
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from affinity import HashRing
+
+
+# hop-by-hop headers, and the ones httpx recomputes
+SKIP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "content-length", "upgrade"}
+
+
+class Router:
+
+    def __init__(self, workers):
+        self.workers = [w.rstrip("/") for w in workers]
+        self.ring = HashRing(self.workers)
+        self._next = itertools.cycle(self.workers)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None), limits=httpx.Limits(max_connections=None))
+        self.requests = {w: 0 for w in self.workers}
+
+    def worker_for(self, path: str, body: bytes, params=()):
+        if path == "/chat":
+            try:
+                thread_id = json.loads(body).get("thread_id")
+            except (ValueError, AttributeError):
+                thread_id = None
+            if thread_id is not None:
+                return self.ring.node_for(str(thread_id))
+        elif path.startswith("/conversations/"):
+            return self.ring.node_for(path[len("/conversations/"):])
+        elif path.startswith("/batch/"):
+            return self.ring.node_for("batch:" + path[len("/batch/"):].split("/", 1)[0])
+        elif path == "/batch":
+            batch_id = dict(params).get("batch_id")
+            if batch_id is not None:
+                return self.ring.node_for("batch:" + batch_id)
+        return next(self._next)
+
+    async def forward(self, request: Request):
+        body = await request.body()
+        path = request.url.path
+        params = list(request.query_params.multi_items())
+        if path == "/batch" and request.method == "POST" and "batch_id" not in request.query_params:
+            params.append(("batch_id", uuid.uuid4().hex[:12]))
+        worker = self.worker_for(path, body, params)
+        self.requests[worker] += 1
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in SKIP_HEADERS}
+        upstream = self.client.build_request(
+            request.method, worker + path, params=params, headers=headers, content=body
+        )
+        try:
+            response = await self.client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            return JSONResponse({"error": f"worker {worker} unavailable: {e}"}, status_code=502)
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in SKIP_HEADERS},
+            background=BackgroundTask(response.aclose),
+        )
+
+    def stats(self):
+        return {"workers": self.workers, "requests": dict(self.requests)}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def create_app(workers) -> FastAPI:
+    router = Router(workers)
+    app = FastAPI()
+    app.state.router = router
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        await router.aclose()
+
+    @app.get("/metrics/router")
+    async def router_metrics():
+        """
+        Requests forwarded to each worker.
+        """
+        return router.stats()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+    async def proxy(request: Request):
+        return await router.forward(request)
+
+    return app
+
+
+WORKER_URLS = [u.strip() for u in os.getenv("WORKER_URLS", "").split(",") if u.strip()]
+app = create_app(WORKER_URLS) if WORKER_URLS else None
+
+
+if __name__ == "__main__":
+    if app is None:
+        raise SystemExit("Set WORKER_URLS to the comma separated base URLs of the API workers")
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("ROUTER_PORT", "8080")))
@@ -0,0 +1,519 @@
+"""
+Search over stored conversations.
+
+Finding a past conversation meant scrolling the thread list; searching by content would
+mean deserializing every checkpoint. Instead, the SQLite checkpointer (sqlite_pool.py)
+keeps a full-text index next to the checkpoint tables:
+
+- `search_messages` holds one row per human / AI message (tool calls and tool results
+  are not indexed), keyed by (thread_id, message id). Rows are written in the same
+  transaction as the checkpoint that introduced the message; a message that is already
+  indexed is skipped without touching the database (see `SearchIndex.rows`).
+- `search_fts` is an external-content FTS5 table over it (porter stemming, unicode
+  case folding), kept in sync by triggers, so the text is stored once.
+
+`asearch` answers `GET /search?q=`: matching messages are ranked with BM25 and grouped
+per thread. Each result is a thread with its best score, its number of matching messages
+and a highlighted snippet of the best one; `offset` pages through threads. Only the
+newest `max_hits` matching messages are ranked, so a query matching millions of
+messages costs the same as one matching `max_hits`: older matches of very common terms
+can fall out of the results (see benchmarks/search.py for latencies).
+
+With `SEARCH_EMBEDDINGS=<provider>:<model>` (any model `langchain.embeddings.init_embeddings`
+knows, e.g. `openai:text-embedding-3-small`) a `SemanticIndex` also embeds indexed messages
+in the background into a sqlite-vec table, and `GET /search?mode=semantic` ranks by cosine
+distance. That search is a brute-force scan of the vectors, so it is much slower than FTS
+at millions of messages.
+
+Index an existing database (and, with --embed, compute its embeddings) with:
+
+    python search_index.py new_chatbot.db
+    python search_index.py new_chatbot.db --embed
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import struct
+import time
+from collections import OrderedDict
+
+from message_store import MESSAGES_CHANNEL, MessageStore
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+INDEXED_ROLES = ("human", "ai")
+# highlight markers of the snippets, rendered as bold by Markdown clients
+SNIPPET_OPEN, SNIPPET_CLOSE = "**", "**"
+SNIPPET_TOKENS = 16
+STOPWORDS = frozenset("""
+a about an and are as at be but by did do does for from had has have how i in is it its me my
+of on or our so that the their them then there these they this to was we were what when
+where which who why will with you your
+""".split())
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_messages (
+    id INTEGER PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    UNIQUE (thread_id, message_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+    content, content='search_messages', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS search_messages_ai AFTER INSERT ON search_messages BEGIN
+    INSERT INTO search_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS search_messages_ad AFTER DELETE ON search_messages BEGIN
+    INSERT INTO search_fts (search_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS search_messages_au AFTER UPDATE OF content ON search_messages BEGIN
+    INSERT INTO search_fts (search_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO search_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+# a message edited in place (same id, new content) is re-indexed
+UPSERT_SQL = """
+INSERT INTO search_messages (thread_id, message_id, role, content, ts) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (thread_id, message_id) DO UPDATE SET content = excluded.content
+WHERE search_messages.content != excluded.content
+"""
+
+DELETE_THREAD_SQL = "DELETE FROM search_messages WHERE thread_id = ?"
+
+# best message per thread among the newest `max_hits` matches; `best` is the bare column
+# of the MIN() row, so it is the rowid of the thread's best match
+SEARCH_SQL = """
+SELECT m.thread_id, hits.rowid AS best, MIN(hits.rank) AS score, COUNT(*) AS matches
+FROM (SELECT rowid, rank FROM search_fts WHERE search_fts MATCH ? ORDER BY rowid DESC LIMIT ?) AS hits
+JOIN search_messages m ON m.id = hits.rowid
+GROUP BY m.thread_id
+ORDER BY score, m.thread_id
+LIMIT ? OFFSET ?
+"""
+
+# FTS5's snippet() would run the whole MATCH again (it ignores `rowid IN`), so snippets
+# are cut from the content of the page's best messages instead, see `snippet()`
+BEST_SQL = "SELECT id, message_id, role, ts, content FROM search_messages WHERE id IN ({marks})"
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def message_text(msg) -> str:
+    """The text of a message: string content, or the text blocks of list content."""
+    content = getattr(msg, "content", None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or (isinstance(block, dict) and block.get("type") == "text")
+        )
+    return ""
+
+
+def query_terms(query: str) -> list[str]:
+    """The words of a query, without FTS5 operators."""
+    return [w for w in re.findall(r"\w+", query) if w not in ("AND", "OR", "NOT", "NEAR")]
+
+
+def snippet(text: str, terms, size: int = SNIPPET_TOKENS) -> str:
+    """
+    About `size` words of `text` around its first match, with matching words between
+    SNIPPET_OPEN and SNIPPET_CLOSE. A word matches a term when it starts with the term's
+    first five letters, or is a prefix of them: close to, but looser than, FTS5's porter
+    stemming ("zebras" ~ "zebra", "running" ~ "run").
+    """
+    stems = [t.lower()[:5] for t in terms]
+    words = text.split()
+
+    def matches(word):
+        word = word.lower().strip(".,;:!?\"'()[]{}")
+        return any(word.startswith(stem) or (len(word) >= 3 and stem.startswith(word)) for stem in stems)
+
+    hits = [i for i, word in enumerate(words) if matches(word)]
+    start = max(0, hits[0] - size // 4) if hits else 0
+    window = words[start:start + size]
+    out = " ".join(f"{SNIPPET_OPEN}{w}{SNIPPET_CLOSE}" if matches(w) else w for w in window)
+    return ("…" if start > 0 else "") + out + ("…" if start + size < len(words) else "")
+
+
+def to_match(query: str) -> str:
+    """
+    An FTS5 query for plain user text: every word must match, in any order. Stopwords
+    are dropped (unless the query has nothing else): they match almost every message,
+    and BM25 has to count the messages containing each term of the query.
+    FTS5 syntax is not interpreted.
+    """
+    words = re.findall(r"\w+", query.lower())
+    words = [w for w in words if w not in STOPWORDS] or words
+    return " ".join(f'"{w}"' for w in words)
+
+
+class SearchIndex:
+    """
+    Builds the `search_messages` rows for checkpoint writes. Remembers, per thread, which
+    messages are already indexed (message id -> content hash), so a checkpoint only
+    yields rows for new or edited messages. Least recently written threads are
+    forgotten beyond `max_threads`; their next checkpoint re-sends every message and the
+    upsert skips the unchanged ones.
+    """
+
+    def __init__(self, max_threads: int = 1024):
+        self.max_threads = max_threads
+        self._seen: OrderedDict[str, dict] = OrderedDict()
+
+    def forget(self, thread_id: str):
+        self._seen.pop(thread_id, None)
+
+    def rows(self, thread_id: str, checkpoint) -> list[tuple]:
+        from sse_encoder import role_of
+
+        messages = checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL) or []
+        seen = self._seen.pop(thread_id, None)
+        if seen is None:
+            seen = {}
+        self._seen[thread_id] = seen
+        while len(self._seen) > self.max_threads:
+            self._seen.popitem(last=False)
+
+        rows = []
+        for msg in messages:
+            message_id = getattr(msg, "id", None)
+            if message_id is None:
+                continue
+            text = message_text(msg)
+            # str hashes are cached on the object, and messages are shared between checkpoints
+            key = hash(text)
+            if seen.get(message_id) == key:
+                continue
+            seen[message_id] = key
+            role = role_of(msg)
+            if role in INDEXED_ROLES and text.strip():
+                rows.append((thread_id, message_id, role, text, checkpoint["ts"]))
+        return rows
+
+
+async def asearch(conn, query: str, limit=None, offset: int = 0, raw: bool = False, max_hits: int | None = None):
+    """
+    One page of threads matching `query`, best first, on an aiosqlite connection.
+    `raw=True` passes `query` to FTS5 as is (phrases, NEAR, OR, column filters...);
+    a syntax error then raises sqlite3.OperationalError. `max_hits` defaults to
+    SEARCH_MAX_HITS (1000).
+    """
+    if max_hits is None:
+        max_hits = int(os.getenv("SEARCH_MAX_HITS", "1000"))
+    limit = clamp_limit(limit)
+    offset = max(0, int(offset or 0))
+    match = query if raw else to_match(query)
+    if not match.strip():
+        return {"query": query, "results": [], "next": None}
+
+    async with conn.execute(SEARCH_SQL, (match, max_hits, limit, offset)) as cur:
+        threads = await cur.fetchall()
+    messages = {}
+    if threads:
+        marks = ",".join("?" * len(threads))
+        async with conn.execute(BEST_SQL.format(marks=marks), [best for _t, best, _s, _m in threads]) as cur:
+            messages = {row[0]: row[1:] for row in await cur.fetchall()}
+    terms = query_terms(match)
+
+    results = []
+    for thread_id, best, score, matches in threads:
+        message_id, role, ts, content = messages[best]
+        results.append({
+            "thread_id": thread_id,
+            # bm25 is lower-is-better and negative, report higher-is-better
+            "score": round(-score, 4),
+            "matches": matches,
+            "message_id": message_id,
+            "role": role,
+            "ts": ts,
+            "snippet": snippet(content, terms),
+        })
+    return {"query": query, "results": results, "next": offset + limit if len(threads) == limit else None}
+
+
+# ---------------------------- Semantic index ----------------------------
+
+VECTOR_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_vector_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+PENDING_SQL = "SELECT id, content FROM search_messages WHERE id > ? ORDER BY id LIMIT ?"
+
+KNN_SQL = """
+WITH knn AS (
+    SELECT rowid, distance FROM search_vectors WHERE embedding MATCH ? AND k = ?
+)
+SELECT m.thread_id, m.message_id, m.role, m.ts, m.content, knn.distance
+FROM knn JOIN search_messages m ON m.id = knn.rowid
+ORDER BY knn.distance
+"""
+
+
+def _vector(values) -> bytes:
+    return struct.pack(f"{len(values)}f", *values)
+
+
+class SemanticIndex:
+    """
+    Embeddings of `search_messages` in a sqlite-vec table of the same database, filled
+    in the background: every `interval` seconds the messages indexed since the last
+    pass are embedded in batches of `batch_size`. Edited messages keep their first
+    embedding; vectors of deleted threads are dropped from results and removed by the
+    next `embed_pending(rebuild=True)` (`python search_index.py DB --embed --rebuild`).
+
+    Uses its own connection, the only one that loads the sqlite-vec extension.
+    """
+
+    def __init__(self, path: str, embeddings, model: str, batch_size: int = 64, interval: float = 5.0):
+        self.path = path
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_size = batch_size
+        self.interval = interval
+        self._conn = None
+        self._task = None
+        self.totals = {"embedded": 0, "passes": 0, "failures": 0, "searches": 0}
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls, checkpointer):
+        """A SemanticIndex for SEARCH_EMBEDDINGS, or None when unset or the checkpointer isn't SQLite."""
+        from sqlite_pool import PooledAsyncSqliteSaver
+
+        model = os.getenv("SEARCH_EMBEDDINGS", "")
+        if not model or not isinstance(checkpointer, PooledAsyncSqliteSaver):
+            return None
+        from langchain.embeddings import init_embeddings
+
+        return cls(
+            checkpointer.pool.path,
+            init_embeddings(model),
+            model,
+            batch_size=int(os.getenv("SEARCH_EMBEDDINGS_BATCH", "64")),
+            interval=float(os.getenv("SEARCH_EMBEDDINGS_INTERVAL", "5")),
+        )
+
+    # ---------------------------- Storage (worker thread) ----------------------------
+
+    def _connection(self):
+        if self._conn is None:
+            import sqlite_vec
+
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+            conn.executescript(SEARCH_SCHEMA + VECTOR_STATE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _state(self, conn):
+        return dict(conn.execute("SELECT key, value FROM search_vector_state").fetchall())
+
+    def _reset(self, conn):
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS search_vectors")
+            conn.execute("DELETE FROM search_vector_state")
+            conn.execute("INSERT INTO search_vector_state VALUES ('model', ?), ('watermark', '0')", (self.model,))
+
+    def _pending(self):
+        conn = self._connection()
+        state = self._state(conn)
+        if state.get("model") != self.model:
+            # another model's vectors are not comparable with this one's queries
+            self._reset(conn)
+            state = self._state(conn)
+        return conn.execute(PENDING_SQL, (int(state["watermark"]), self.batch_size)).fetchall()
+
+    def _store(self, rows, vectors):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS search_vectors USING vec0("
+                f"embedding float[{len(vectors[0])}] distance_metric=cosine)"
+            )
+            ids = [row_id for row_id, _content in rows]
+            conn.execute(f"DELETE FROM search_vectors WHERE rowid IN ({','.join('?' * len(ids))})", ids)
+            conn.executemany(
+                "INSERT INTO search_vectors (rowid, embedding) VALUES (?, ?)",
+                [(row_id, _vector(v)) for row_id, v in zip(ids, vectors)],
+            )
+            conn.execute("UPDATE search_vector_state SET value = ? WHERE key = 'watermark'", (str(ids[-1]),))
+
+    def _knn(self, vector, k):
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_vectors'").fetchone() is None:
+            return []
+        return conn.execute(KNN_SQL, (_vector(vector), k)).fetchall()
+
+    # ---------------------------- Embedding and search ----------------------------
+
+    async def embed_pending(self, rebuild: bool = False) -> int:
+        """Embed every message indexed since the last call; returns how many were embedded."""
+        if rebuild:
+            await asyncio.to_thread(lambda: self._reset(self._connection()))
+        embedded = 0
+        while True:
+            rows = await asyncio.to_thread(self._pending)
+            if not rows:
+                break
+            vectors = await self.embeddings.aembed_documents([content for _id, content in rows])
+            await asyncio.to_thread(self._store, rows, vectors)
+            embedded += len(rows)
+        self.totals["embedded"] += embedded
+        self.totals["passes"] += 1
+        return embedded
+
+    async def asearch(self, query: str, limit=None, offset: int = 0):
+        """One page of threads nearest to `query`, best first; same shape as `asearch`."""
+        limit = clamp_limit(limit)
+        offset = max(0, int(offset or 0))
+        if not query.strip():
+            return {"query": query, "results": [], "next": None}
+        self.totals["searches"] += 1
+        vector = await self.embeddings.aembed_query(query)
+        # several nearest messages can belong to one thread
+        k = min(4096, (offset + limit) * 4)
+        best = {}
+        for thread_id, message_id, role, ts, content, distance in await asyncio.to_thread(self._knn, vector, k):
+            if thread_id in best:
+                best[thread_id]["matches"] += 1
+                continue
+            best[thread_id] = {
+                "thread_id": thread_id,
+                "score": round(1.0 - distance, 4),
+                "matches": 1,
+                "message_id": message_id,
+                "role": role,
+                "ts": ts,
+                "snippet": content if len(content) <= 200 else content[:200] + "…",
+            }
+        results = list(best.values())[offset:offset + limit]
+        return {"query": query, "results": results, "next": offset + limit if len(results) == limit else None}
+
+    # ---------------------------- Lifecycle ----------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.embed_pending()
+            except Exception as e:
+                self.totals["failures"] += 1
+                self.last_error = repr(e)
+                logger.warning("embedding pass failed: %r", e)
+            await asyncio.sleep(self.interval)
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self):
+        return {"model": self.model, "interval": self.interval, **self.totals, "last_error": self.last_error}
+
+
+# ---------------------------- Backfill ----------------------------
+
+def backfill(path: str, serde=None, batch_size: int = 500) -> tuple[int, int]:
+    """
+    Index the messages of every thread's latest root checkpoint of an existing database
+    (already indexed messages are skipped). Threads are read and written in batches, so
+    the checkpointer can keep serving. Returns (threads, messages written).
+    """
+    from checkpoint_serde import serializer_from_env
+
+    serde = serde or serializer_from_env()
+    store = MessageStore(serde)
+    index = SearchIndex(max_threads=1)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SEARCH_SCHEMA)
+        thread_ids = [t for (t,) in conn.execute("SELECT DISTINCT thread_id FROM checkpoints WHERE checkpoint_ns = ''")]
+        written = 0
+        for i in range(0, len(thread_ids), batch_size):
+            rows = []
+            for thread_id in thread_ids[i:i + batch_size]:
+                type_, blob = conn.execute(
+                    "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id,),
+                ).fetchone()
+                checkpoint = store.hydrate_sync(conn, thread_id, serde.loads_typed((type_, blob)))
+                rows.extend(index.rows(thread_id, checkpoint))
+            with conn:
+                written += conn.executemany(UPSERT_SQL, rows).rowcount
+        return len(thread_ids), written
+    finally:
+        conn.close()
+
+
+async def _embed(path, rebuild):
+    model = os.getenv("SEARCH_EMBEDDINGS", "")
+    if not model:
+        raise SystemExit("--embed needs SEARCH_EMBEDDINGS=<provider>:<model>")
+    from langchain.embeddings import init_embeddings
+
+    index = SemanticIndex(path, init_embeddings(model), model, batch_size=int(os.getenv("SEARCH_EMBEDDINGS_BATCH", "64")))
+    try:
+        return await index.embed_pending(rebuild=rebuild)
+    finally:
+        await index.aclose()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the search index of an existing checkpoint database.")
+    parser.add_argument("path", nargs="?", default=os.getenv("CHECKPOINT_DB", "new_chatbot.db"))
+    parser.add_argument("--embed", action="store_true", help="also embed the indexed messages (SEARCH_EMBEDDINGS)")
+    parser.add_argument("--rebuild", action="store_true", help="with --embed: drop and recompute every embedding")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"{args.path}: not found")
+    start = time.perf_counter()
+    threads, written = backfill(args.path)
+    print(f"{args.path}: indexed {written} messages of {threads} threads in {time.perf_counter() - start:.1f}s")
+    if args.embed:
+        start = time.perf_counter()
+        embedded = asyncio.run(_embed(args.path, args.rebuild))
+        print(f"{args.path}: embedded {embedded} messages in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
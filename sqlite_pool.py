@@ -0,0 +1,492 @@
+"""
+Pooled async SQLite checkpointer for the FastAPI backend.
+
+A single aiosqlite connection serializes every read behind every checkpoint write.
+Here the database runs in WAL mode with one writer connection (writes are serialized
+through it) and a bounded set of reader connections, so `/threads` and
+`/conversations` reads run in parallel with streaming turns.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from langgraph.checkpoint.base import WRITES_IDX_MAP, BaseCheckpointSaver, get_checkpoint_metadata
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from message_store import (
+    INSERT_SQL as MESSAGE_INSERT_SQL,
+    KEYS_SQL as MESSAGE_KEYS_SQL,
+    MESSAGE_STORE_SCHEMA,
+    MESSAGES_CHANNEL,
+    MessageStore,
+    is_refs,
+    ref_length,
+    window_ranges,
+)
+from metrics import BYTE_BUCKETS, Histogram
+from search_index import (
+    DELETE_THREAD_SQL as SEARCH_DELETE_SQL,
+    SEARCH_SCHEMA,
+    UPSERT_SQL as SEARCH_UPSERT_SQL,
+    SearchIndex,
+    asearch,
+)
+from thread_catalog import UPSERT_SQL, CatalogAsyncSqliteSaver, alist_threads, catalog_row
+
+
+# synchronous=NORMAL is durable across application crashes in WAL mode; only an
+# OS crash / power loss can drop the last few commits.
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative = KiB, i.e. 64 MiB per connection
+    "temp_store": "MEMORY",
+}
+
+LATEST_ID_SQL = "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' ORDER BY checkpoint_id DESC LIMIT 1"
+LATEST_SQL = "SELECT checkpoint_id, type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' ORDER BY checkpoint_id DESC LIMIT 1"
+
+# A batched flush that hits a lock is re-queued for the next flush, at most this many times in a row.
+FLUSH_MAX_RETRIES = 3
+
+# Upper bounds (seconds) of the wait-time histogram buckets.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+def _is_transient(error):
+    """A write that failed only because another connection holds the lock."""
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+
+class SqlitePool:
+    """
+    One writer connection plus `readers` reader connections to the same WAL database.
+    Use `async with pool.reader() as conn` / `async with pool.writer() as conn`.
+    """
+
+    def __init__(self, path: str, readers: int | None = None, pragmas: dict | None = None):
+        self.path = path
+        self.size = readers or min(32, os.cpu_count() or 4)
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.writer_conn: aiosqlite.Connection | None = None
+        self.reader_conns: list[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue | None = None
+        self._write_lock = asyncio.Lock()
+        self.reader_waits = Histogram(WAIT_BUCKETS)
+        self.writer_waits = Histogram(WAIT_BUCKETS)
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        pragmas = "".join(f"PRAGMA {name}={value};" for name, value in self.pragmas.items())
+        if read_only:
+            pragmas += "PRAGMA query_only=ON;"
+        # executescript steps every statement to completion, so no PRAGMA cursor keeps a lock open
+        await conn.executescript(pragmas)
+        return conn
+
+    async def open(self):
+        if self.writer_conn is not None:
+            return self
+        # journal_mode is persistent, set it once from the writer before readers attach;
+        # auto_vacuum only takes on a new database, it lets retention.py free pages
+        self.writer_conn = await self._connect(read_only=False)
+        await self.writer_conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; PRAGMA journal_mode=WAL;")
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await self._connect(read_only=True)
+            self.reader_conns.append(conn)
+            self._idle.put_nowait(conn)
+        return self
+
+    async def close(self):
+        for conn in self.reader_conns:
+            await conn.close()
+        self.reader_conns = []
+        if self.writer_conn is not None:
+            await self.writer_conn.close()
+            self.writer_conn = None
+
+    @asynccontextmanager
+    async def reader(self):
+        start = time.perf_counter()
+        conn = await self._idle.get()
+        self.reader_waits.observe(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        start = time.perf_counter()
+        async with self._write_lock:
+            self.writer_waits.observe(time.perf_counter() - start)
+            yield self.writer_conn
+
+    def stats(self):
+        return {
+            "readers": self.size,
+            "readers_idle": self._idle.qsize() if self._idle else 0,
+            "reader_wait": self.reader_waits.as_dict(),
+            "writer_wait": self.writer_waits.as_dict(),
+        }
+
+
+class PooledAsyncSqliteSaver(BaseCheckpointSaver[str]):
+    """
+    Checkpointer over a `SqlitePool`.
+
+    Reads borrow a reader connection for the duration of the call and reuse the stock
+    AsyncSqliteSaver queries on it. Writes (checkpoint, pending writes and the
+    thread catalog row) are queued and committed by the single writer connection;
+    callers that arrive while a commit is in flight are committed together with the
+    next one.
+
+    Durability modes:
+
+    - "sync" (default): `aput` / `aput_writes` return only after their transaction
+      has committed, exactly like AsyncSqliteSaver.
+    - "batched": intermediate checkpoints of a turn (chat_node -> tools -> chat_node)
+      stay in memory and are committed in one transaction when `aflush()` is called
+      at the end of the turn, when `flush_max_items` writes are buffered, when the
+      oldest buffered write is `flush_max_delay` seconds old, or on `aclose()`.
+      A flush that fails because the database is locked keeps its writes for the next
+      flush (up to `flush_max_retries` times in a row); any other failure drops them.
+
+    With `message_store=True` each message is stored once in `message_store` and
+    checkpoints keep only sequence references to it (see message_store.py); reads
+    put the messages back, so the graph sees ordinary checkpoints.
+
+    With `search_index=True` new human / AI messages are added to the full-text index
+    in the checkpoint's transaction, and `asearch` queries it (see search_index.py).
+
+    Crash semantics of "batched": a process crash loses the buffered writes, i.e. at
+    most the turn in flight (or `flush_max_delay` seconds of writes). Every flush is a
+    single transaction, so the database never holds a partial turn: the thread
+    resumes from the last checkpoint of the previous flushed turn and the user's
+    message has to be resent. Reads of a thread with buffered writes flush first, so
+    readers always see their own turns; the thread catalog may lag by up to
+    `flush_max_delay`.
+    """
+
+    def __init__(
+        self,
+        pool: SqlitePool,
+        *,
+        serde=None,
+        durability: str = "sync",
+        flush_max_items: int = 64,
+        flush_max_delay: float = 1.0,
+        flush_max_retries: int = FLUSH_MAX_RETRIES,
+        message_store: bool = False,
+        search_index: bool = False,
+    ):
+        super().__init__(serde=serde)
+        if durability not in ("sync", "batched"):
+            raise ValueError(f"Unknown durability mode: {durability!r}")
+        self.pool = pool
+        self.durability = durability
+        self.flush_max_items = flush_max_items
+        self.flush_max_delay = flush_max_delay
+        self.flush_max_retries = flush_max_retries
+        self.store_messages = message_store
+        # always available for reads, so databases migrated by message_store.py stay readable
+        self.message_store = MessageStore(self.serde)
+        self.search_index = SearchIndex() if search_index else None
+        self.writer_saver: CatalogAsyncSqliteSaver | None = None
+        self.reader_savers: dict[int, AsyncSqliteSaver] = {}
+        self.is_setup = False
+        self._setup_lock = asyncio.Lock()
+        # queued (sql, rows) statements, committed in order by `aflush`
+        self._buffer: list[tuple[str, list[tuple]]] = []
+        self._buffered_threads: set[str] = set()
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+        # consecutive batched flushes re-queued after a lock error
+        self._flush_retries = 0
+        # checkpoint I/O, exported by GET /metrics (see telemetry.py)
+        self.read_times = Histogram()
+        self.commit_times = Histogram()
+        self.write_bytes = Histogram(BYTE_BUCKETS)
+        self.search_times = Histogram()
+
+    @classmethod
+    async def from_path(cls, path: str, readers: int | None = None, **kwargs):
+        pool = await SqlitePool(path, readers=readers).open()
+        return cls(pool, **kwargs)
+
+    async def setup(self):
+        if self.is_setup:
+            return
+        async with self._setup_lock:
+            if self.is_setup:
+                return
+            await self.pool.open()
+            self.writer_saver = CatalogAsyncSqliteSaver(self.pool.writer_conn, serde=self.serde)
+            await self.writer_saver.setup()
+            await self.pool.writer_conn.executescript(MESSAGE_STORE_SCHEMA + SEARCH_SCHEMA)
+            for conn in self.pool.reader_conns:
+                saver = AsyncSqliteSaver(conn, serde=self.serde)
+                # tables already exist and reader connections are query_only
+                saver.is_setup = True
+                saver._has_task_path = self.writer_saver._has_task_path
+                self.reader_savers[id(conn)] = saver
+            self.is_setup = True
+
+    # ---------------------------- Reads ----------------------------
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrow a reader connection together with its AsyncSqliteSaver."""
+        await self.setup()
+        async with self.pool.reader() as conn:
+            yield self.reader_savers[id(conn)]
+
+    async def _flush_for(self, config):
+        if not self._buffered_threads:
+            return
+        if config is None or str(config["configurable"]["thread_id"]) in self._buffered_threads:
+            await self.aflush()
+
+    async def _hydrate(self, saver, checkpoint_tuple):
+        return await self.message_store.ahydrate(saver.conn, checkpoint_tuple)
+
+    async def aget_tuple(self, config):
+        start = time.perf_counter()
+        await self._flush_for(config)
+        async with self.reader() as saver:
+            checkpoint_tuple = await self._hydrate(saver, await saver.aget_tuple(config))
+        self.read_times.observe(time.perf_counter() - start)
+        return checkpoint_tuple
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        await self._flush_for(config)
+        async with self.reader() as saver:
+            # collect first: hydrating needs the connection the listing cursor is using
+            items = [item async for item in saver.alist(config, filter=filter, before=before, limit=limit)]
+            for item in items:
+                yield await self._hydrate(saver, item)
+
+    async def aget_delta_channel_history(self, *, config, channels):
+        await self._flush_for(config)
+        async with self.reader() as saver:
+            return await saver.aget_delta_channel_history(config=config, channels=channels)
+
+    async def alatest_checkpoint_id(self, thread_id: str):
+        """Id of the newest root checkpoint of a thread (cheap: no blob is read)."""
+        await self._flush_for({"configurable": {"thread_id": thread_id}})
+        async with self.reader() as saver:
+            async with saver.conn.execute(LATEST_ID_SQL, (str(thread_id),)) as cur:
+                row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def aget_messages(self, thread_id: str, limit: int | None = None, before: int | None = None):
+        """
+        A window of the thread's latest message history: up to `limit` messages ending
+        just before list position `before` (default: the end). Returns
+        (checkpoint_id, total, start, messages) where `start` is the position of the
+        first returned message. With the message store only the window is read and
+        deserialized; with full snapshots the checkpoint is loaded and sliced.
+        """
+        started = time.perf_counter()
+        await self._flush_for({"configurable": {"thread_id": thread_id}})
+        async with self.reader() as saver:
+            async with saver.conn.execute(LATEST_SQL, (str(thread_id),)) as cur:
+                row = await cur.fetchone()
+            if row is None:
+                return None, 0, 0, []
+            checkpoint_id, type_, blob = row
+            messages = self.serde.loads_typed((type_, blob)).get("channel_values", {}).get(MESSAGES_CHANNEL) or []
+
+            total = ref_length(messages) if is_refs(messages) else len(messages)
+            stop = total if before is None else max(0, min(before, total))
+            start = 0 if limit is None else max(0, stop - limit)
+            if is_refs(messages):
+                window = await self.message_store.aload_ranges(
+                    saver.conn, str(thread_id), window_ranges(messages, start, stop)
+                )
+            else:
+                window = messages[start:stop]
+        self.read_times.observe(time.perf_counter() - started)
+        return checkpoint_id, total, start, window
+
+    async def alist_threads(self, limit=None, after=None):
+        """One page of the thread catalog, most recently updated first: (threads, next_cursor)."""
+        async with self.reader() as saver:
+            return await alist_threads(saver.conn, limit=limit, after=after)
+
+    async def asearch(self, query: str, limit=None, offset: int = 0, raw: bool = False):
+        """One page of threads whose messages match `query`, best first (see search_index.py)."""
+        start = time.perf_counter()
+        async with self.reader() as saver:
+            page = await asearch(saver.conn, query, limit=limit, offset=offset, raw=raw)
+        self.search_times.observe(time.perf_counter() - start)
+        return page
+
+    # ---------------------------- Writes ----------------------------
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        message_rows = []
+        stored = checkpoint
+        if self.store_messages:
+            if not self.message_store.is_current(thread_id, config["configurable"].get("checkpoint_id")):
+                await self._load_message_index(thread_id)
+            stored, message_rows = self.message_store.encode(thread_id, checkpoint)
+        type_, serialized_checkpoint = self.serde.dumps_typed(stored)
+        serialized_metadata = json.dumps(
+            get_checkpoint_metadata(config, metadata), ensure_ascii=False
+        ).encode("utf-8", "ignore")
+        statements = [(MESSAGE_INSERT_SQL, message_rows)] if message_rows else []
+        statements.append((
+            "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(
+                thread_id,
+                checkpoint_ns,
+                checkpoint["id"],
+                config["configurable"].get("checkpoint_id"),
+                type_,
+                serialized_checkpoint,
+                serialized_metadata,
+            )],
+        ))
+        row = catalog_row(config, checkpoint)
+        if row is not None:
+            statements.append((UPSERT_SQL, [row]))
+        if self.search_index is not None and not checkpoint_ns:
+            search_rows = self.search_index.rows(thread_id, checkpoint)
+            if search_rows:
+                statements.append((SEARCH_UPSERT_SQL, search_rows))
+        self.write_bytes.observe(
+            len(serialized_checkpoint) + len(serialized_metadata) + sum(len(r[-1]) for r in message_rows)
+        )
+        await self._write(thread_id, statements)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self.setup()
+        query = (
+            "INSERT OR REPLACE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            if all(w[0] in WRITES_IDX_MAP for w in writes)
+            else "INSERT OR IGNORE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        thread_id = str(config["configurable"]["thread_id"])
+        rows = [
+            (
+                thread_id,
+                str(config["configurable"]["checkpoint_ns"]),
+                str(config["configurable"]["checkpoint_id"]),
+                task_id,
+                task_path,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                *self.serde.dumps_typed(value),
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        self.write_bytes.observe(sum(len(r[-1]) for r in rows))
+        await self._write(thread_id, [(query, rows)])
+
+    async def _load_message_index(self, thread_id):
+        # the index of a thread with buffered writes is never evicted before they commit
+        await self._flush_for({"configurable": {"thread_id": thread_id}})
+        async with self.reader() as saver:
+            async with saver.conn.execute(MESSAGE_KEYS_SQL, (thread_id,)) as cur:
+                rows = await cur.fetchall()
+        self.message_store.load_index(thread_id, rows)
+
+    async def _write(self, thread_id, statements):
+        self._buffer.extend(statements)
+        self._buffered_threads.add(thread_id)
+        if self.durability == "sync" or len(self._buffer) >= self.flush_max_items:
+            await self.aflush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_max_delay, self._flush_in_background
+            )
+
+    def _flush_in_background(self):
+        self._flush_timer = None
+        self._flush_task = asyncio.ensure_future(self.aflush())
+
+    async def aflush(self):
+        """Commit every buffered write in a single transaction."""
+        async with self.pool.writer() as conn:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._buffer:
+                return
+            buffer, self._buffer = self._buffer, []
+            self._buffered_threads = set()
+            start = time.perf_counter()
+            try:
+                for sql, rows in buffer:
+                    await conn.executemany(sql, rows)
+                await conn.commit()
+                self.commit_times.observe(time.perf_counter() - start)
+                self._flush_retries = 0
+            except BaseException as e:
+                await conn.rollback()
+                threads = {rows[0][0] for _sql, rows in buffer if rows}
+                if (
+                    self.durability == "batched"
+                    and _is_transient(e)
+                    and self._flush_retries < self.flush_max_retries
+                ):
+                    # keep the writes so a later flush (or aclose) can retry them
+                    self._flush_retries += 1
+                    self._buffer[:0] = buffer
+                    self._buffered_threads.update(threads)
+                else:
+                    # dropped, as AsyncSqliteSaver does; reload the indexes from what committed
+                    self._flush_retries = 0
+                    for thread_id in threads:
+                        self.message_store.forget(thread_id)
+                        if self.search_index is not None:
+                            self.search_index.forget(thread_id)
+                raise
+
+    async def adelete_thread(self, thread_id):
+        await self.setup()
+        await self.aflush()
+        async with self.pool.writer() as conn:
+            await self.writer_saver.adelete_thread(thread_id)
+            await conn.execute("DELETE FROM message_store WHERE thread_id = ?", (str(thread_id),))
+            await conn.execute(SEARCH_DELETE_SQL, (str(thread_id),))
+            await conn.commit()
+        self.message_store.forget(str(thread_id))
+        if self.search_index is not None:
+            self.search_index.forget(str(thread_id))
+
+    async def aclose(self):
+        if self.is_setup:
+            await self.aflush()
+        await self.pool.close()
+        self.is_setup = False
+
+    def stats(self):
+        return {
+            "backend": "sqlite",
+            **self.pool.stats(),
+            "read": self.read_times.as_dict(),
+            "commit": self.commit_times.as_dict(),
+            "write_bytes": self.write_bytes.as_dict(),
+            "search": self.search_times.as_dict(),
+        }
+
+    def get_next_version(self, current, channel):
+        return AsyncSqliteSaver.get_next_version(self, current, channel)
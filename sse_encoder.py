@@ -0,0 +1,142 @@
+"""
+Encoder for the /chat token stream.
+
+Every `(chunk, metadata)` item from `chatbot.astream(..., stream_mode="messages")` used to
+go through a class-name based `serialize_message()` and `json.dumps`. `StreamEncoder`
+writes frames as bytes instead:
+
+- plain AI text chunks (the vast majority) take a fast path: a precomputed frame prefix
+  plus the JSON-encoded text delta. Empty deltas are not sent at all.
+- other messages (tool call chunks, tool results, full messages from cache hits) get
+  the same `{"role", "content", "tool_calls", "tool_call_chunks"}` object as before,
+  plus `name` on tool results, with the role looked up once per message class
+- JSON is encoded with orjson when it is installed, else with a preconfigured stdlib encoder
+
+Framing:
+
+    sse      (default)  data: {"role":"ai","content":"Hel"}\\n\\n ... data: [DONE]\\n\\n
+    ndjson              {"role":"ai","content":"Hel"}\\n ... {"done":true}\\n
+
+With `compact=True`, plain AI text chunks are sent as a bare JSON string ("Hel")
+instead of an object; everything else is unchanged.
+"""
+import json
+
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+    SystemMessage,
+    ToolMessage,
+    ToolMessageChunk,
+)
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def stdlib_dumps(obj) -> bytes:
+    return _json_encoder.encode(obj).encode()
+
+
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=str)
+
+except ImportError:
+    dumps = stdlib_dumps
+
+
+FRAMINGS = ("sse", "ndjson")
+MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+_BASE_ROLES = (
+    (AIMessage, "ai"),
+    (AIMessageChunk, "ai"),
+    (ToolMessage, "tool"),
+    (ToolMessageChunk, "tool"),
+    (HumanMessage, "human"),
+    (HumanMessageChunk, "human"),
+    (SystemMessage, "system"),
+)
+_roles: dict[type, str] = {}
+
+
+def role_of(msg) -> str:
+    cls = type(msg)
+    role = _roles.get(cls)
+    if role is None:
+        role = next((r for base, r in _BASE_ROLES if issubclass(cls, base)), "unknown")
+        _roles[cls] = role
+    return role
+
+
+def message_payload(msg) -> dict:
+    data = {
+        "role": role_of(msg),
+        "content": getattr(msg, "content", None) or "",
+    }
+    # tool results carry the tool's name
+    name = getattr(msg, "name", None)
+    if name:
+        data["name"] = name
+    # Include tool calls only if present
+    tool_calls = getattr(msg, "tool_calls", None)
+    if tool_calls:
+        data["tool_calls"] = tool_calls
+    tool_call_chunks = getattr(msg, "tool_call_chunks", None)
+    if tool_call_chunks:
+        data["tool_call_chunks"] = tool_call_chunks
+    return data
+
+
+class StreamEncoder:
+
+    def __init__(self, framing: str = "sse", compact: bool = False, json_dumps=None):
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown stream framing {framing!r}, expected one of {FRAMINGS}")
+        self.framing = framing
+        self.compact = compact
+        self.media_type = MEDIA_TYPES[framing]
+        self._dumps = json_dumps or dumps
+        if framing == "sse":
+            self._prefix, self._suffix = b"data: ", b"\n\n"
+            self.done = b"data: [DONE]\n\n"
+            self.heartbeat = b": ping\n\n"
+        else:
+            self._prefix, self._suffix = b"", b"\n"
+            self.done = b'{"done":true}\n'
+            self.heartbeat = b"\n"
+        if compact:
+            self._text_prefix, self._text_suffix = self._prefix, self._suffix
+        else:
+            self._text_prefix = self._prefix + b'{"role":"ai","content":'
+            self._text_suffix = b"}" + self._suffix
+
+    @staticmethod
+    def text_delta(stream_item) -> str | None:
+        """The text of a plain AI text chunk (possibly ""), None for any other item."""
+        if type(stream_item) is not tuple or len(stream_item) != 2:
+            return None
+        msg = stream_item[0]
+        if type(msg) is AIMessageChunk and not msg.tool_call_chunks and type(msg.content) is str:
+            return msg.content
+        return None
+
+    def text_frame(self, text: str) -> bytes:
+        return self._text_prefix + self._dumps(text) + self._text_suffix
+
+    def encode(self, stream_item) -> bytes | None:
+        """One frame for a `(chunk, metadata)` stream item; None when there is nothing to send."""
+        if type(stream_item) is not tuple or len(stream_item) != 2:
+            return None
+        msg = stream_item[0]
+        if type(msg) is AIMessageChunk and not msg.tool_call_chunks:
+            content = msg.content
+            if type(content) is str:
+                if not content:
+                    return None
+                return self._text_prefix + self._dumps(content) + self._text_suffix
+        return self._prefix + self._dumps(message_payload(msg)) + self._suffix
@@ -0,0 +1,211 @@
+"""
+Coalescing, heartbeats and disconnect handling for the /chat stream.
+
+`CoalescingStream` sits between `chatbot.astream(..., stream_mode="messages")` and the
+HTTP response. Instead of one frame (and one write) per token:
+
+- consecutive text deltas are merged into one frame, flushed once `flush_bytes` of text
+  is buffered or `flush_ms` after the first buffered delta. The very first delta is sent
+  immediately, so coalescing does not add to time to first byte. Any other item (tool call
+  chunks, tool results) flushes the buffered text first, so order is preserved.
+  A slow client naturally gets fewer, larger frames: tokens queue up while a write is
+  blocked and are sent as one frame afterwards.
+- a heartbeat (an SSE comment, or an empty NDJSON line) is written after `heartbeat`
+  seconds without output, e.g. while a slow tool runs, so proxies keep the connection open
+- the client connection is checked at least every `poll` seconds. On disconnect, the
+  graph run is cancelled (the `astream` generator is closed), so no more tokens or tool
+  calls are spent on an abandoned request.
+
+Each stream's frames, writes, bytes, time to first byte and outcome are recorded in a
+`StreamMetrics`. Defaults come from the environment:
+
+    STREAM_FLUSH_BYTES=64    0 disables coalescing
+    STREAM_FLUSH_MS=30
+    STREAM_HEARTBEAT_S=15
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import BYTE_BUCKETS, Histogram
+
+
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, float("inf"))
+
+
+class StreamMetrics:
+    """Aggregates of finished streams plus the most recent per-stream records."""
+
+    def __init__(self, recent: int = 50):
+        self.ttfb = Histogram()
+        self.duration = Histogram()
+        self.frames = Histogram(COUNT_BUCKETS)
+        self.bytes = Histogram(BYTE_BUCKETS)
+        self.outcomes = {"completed": 0, "disconnected": 0, "failed": 0}
+        self.recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def record(self, stats: dict):
+        if stats["ttfb_seconds"] is not None:
+            self.ttfb.observe(stats["ttfb_seconds"])
+        self.duration.observe(stats["duration_seconds"])
+        self.frames.observe(stats["frames"])
+        self.bytes.observe(stats["bytes"])
+        with self._lock:
+            self.outcomes[stats["outcome"]] += 1
+            self.recent.append(stats)
+
+    def as_dict(self):
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            recent = list(self.recent)
+        return {
+            "streams": outcomes,
+            "ttfb": self.ttfb.as_dict(),
+            "duration": self.duration.as_dict(),
+            "frames_per_stream": self.frames.as_dict(),
+            "bytes_per_stream": self.bytes.as_dict(),
+            "recent": recent,
+        }
+
+
+class CoalescingStream:
+    """Async iterable of response bytes for one `astream` run (see module docstring)."""
+
+    def __init__(
+        self,
+        items,
+        encoder,
+        *,
+        is_disconnected=None,
+        on_complete=None,
+        on_close=None,
+        metrics: StreamMetrics | None = None,
+        flush_bytes: int | None = None,
+        flush_ms: float | None = None,
+        heartbeat: float | None = None,
+        poll: float = 1.0,
+    ):
+        self.items = items
+        self.encoder = encoder
+        self.is_disconnected = is_disconnected
+        # awaited after the last item and before the end-of-stream frame
+        self.on_complete = on_complete
+        # called once the stream has ended, however it ended
+        self.on_close = on_close
+        self.metrics = metrics
+        self.flush_bytes = int(os.getenv("STREAM_FLUSH_BYTES", "64")) if flush_bytes is None else flush_bytes
+        self.flush_delay = (float(os.getenv("STREAM_FLUSH_MS", "30")) if flush_ms is None else flush_ms) / 1000
+        self.heartbeat = float(os.getenv("STREAM_HEARTBEAT_S", "15")) if heartbeat is None else heartbeat
+        self.poll = poll
+        self.created = time.perf_counter()
+        self.stats = {
+            "items": 0,
+            "frames": 0,
+            "writes": 0,
+            "heartbeats": 0,
+            "bytes": 0,
+            "ttfb_seconds": None,
+            "duration_seconds": 0.0,
+            "outcome": "failed",
+        }
+
+    def _wrote(self, data: bytes, frames: int):
+        stats = self.stats
+        if stats["ttfb_seconds"] is None:
+            stats["ttfb_seconds"] = time.perf_counter() - self.created
+        stats["frames"] += frames
+        stats["writes"] += 1
+        stats["bytes"] += len(data)
+
+    async def _client_gone(self) -> bool:
+        return self.is_disconnected is not None and await self.is_disconnected()
+
+    async def __aiter__(self):
+        encoder = self.encoder
+        iterator = self.items.__aiter__()
+        pending = None
+        text, text_bytes, text_since = [], 0, 0.0
+        last_write = last_poll = time.perf_counter()
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                now = time.perf_counter()
+                deadline = min(last_write + self.heartbeat, last_poll + self.poll)
+                if text:
+                    deadline = min(deadline, text_since + self.flush_delay)
+                done, _ = await asyncio.wait((pending,), timeout=max(0.0, deadline - now))
+
+                frame = None
+                if done:
+                    try:
+                        item = pending.result()
+                    except StopAsyncIteration:
+                        pending = None
+                        break
+                    pending = None
+                    self.stats["items"] += 1
+                    delta = encoder.text_delta(item)
+                    if delta is None:
+                        frame = encoder.encode(item)
+                    elif delta:
+                        if not text:
+                            text_since = time.perf_counter()
+                        text.append(delta)
+                        text_bytes += len(delta)
+
+                now = time.perf_counter()
+                out, frames = b"", 0
+                # the first delta goes out at once: coalescing must not delay time to first byte
+                if text and (frame is not None or text_bytes >= self.flush_bytes or now >= text_since + self.flush_delay
+                             or not self.stats["writes"]):
+                    out, frames = encoder.text_frame("".join(text)), 1
+                    text, text_bytes = [], 0
+                if frame is not None:
+                    out, frames = out + frame, frames + 1
+                if not out and now >= last_write + self.heartbeat:
+                    out = encoder.heartbeat
+                    self.stats["heartbeats"] += 1
+                if out:
+                    yield out
+                    self._wrote(out, frames)
+                    last_write = time.perf_counter()
+
+                if now - last_poll >= self.poll:
+                    last_poll = time.perf_counter()
+                    if await self._client_gone():
+                        self.stats["outcome"] = "disconnected"
+                        return
+
+            if text:
+                out = encoder.text_frame("".join(text))
+                yield out
+                self._wrote(out, 1)
+            if self.on_complete is not None:
+                await self.on_complete()
+            yield encoder.done
+            self._wrote(encoder.done, 1)
+            self.stats["outcome"] = "completed"
+        except (asyncio.CancelledError, GeneratorExit):
+            # the server cancelled or closed the response, which it does when the client went away
+            self.stats["outcome"] = "disconnected"
+            raise
+        finally:
+            try:
+                if pending is not None:
+                    # cancelling the pending step also cancels the graph run
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+                else:
+                    aclose = getattr(iterator, "aclose", None)
+                    if aclose is not None:
+                        await aclose()
+            finally:
+                if self.on_close is not None:
+                    self.on_close()
+                self.stats["duration_seconds"] = time.perf_counter() - self.created
+                if self.metrics is not None:
+                    self.metrics.record(dict(self.stats))
@@ -0,0 +1,398 @@
+"""
+Local instrumentation for the FastAPI backend, without a network collector.
+
+- `Registry` renders metrics in the Prometheus text format (GET /metrics). Metric types
+  that already exist in the app are exported as they are: tool latency per tool
+  (tool_executor.py), turn queueing (turn_scheduler.py), stream frames/bytes/TTFB
+  (stream_coalescer.py), checkpoint read/commit time and bytes (sqlite_pool.py,
+  checkpointers.py).
+- `ModelTimer` is a callback handler for time to first token and total time of each
+  model call, per model. main.py passes it in the /chat run config.
+- `ProfilerMiddleware` samples the event loop thread's stack while a request that
+  carries `X-Profile: 1` is being served, when PROFILER=on. The response gets an
+  `X-Profile-Id` header; GET /debug/profiles/{id} returns the samples as folded stacks
+  (flamegraph.pl / speedscope input). The loop thread serves every request, so
+  concurrent requests show up in each other's profiles.
+
+Overhead budget: instrumentation may add at most 2% to the CPU time of a turn
+(measured by `python -m benchmarks.telemetry_overhead`). TELEMETRY=off turns off the
+model timer, the only per-token part.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import Histogram
+
+
+# ---------------------------- Exposition ----------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def histogram_samples(histogram: Histogram, labels: dict | None = None):
+    """Cumulative `_bucket`, `_sum` and `_count` samples of a `metrics.Histogram`."""
+    labels = labels or {}
+    snapshot = histogram.as_dict()
+    samples, cumulative = [], 0
+    for bound, n in zip(histogram.bounds, snapshot["buckets"].values()):
+        cumulative += n
+        samples.append(("_bucket", {**labels, "le": _number(bound)}, cumulative))
+    if histogram.bounds[-1] != float("inf"):
+        samples.append(("_bucket", {**labels, "le": "+Inf"}, snapshot["count"]))
+    samples.append(("_sum", labels, snapshot["total_seconds"]))
+    samples.append(("_count", labels, snapshot["count"]))
+    return samples
+
+
+class Family:
+    """One metric: name, type, help and its samples as (suffix, labels, value)."""
+
+    __slots__ = ("name", "kind", "help", "samples")
+
+    def __init__(self, name, kind, help, samples=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples = samples if samples is not None else []
+
+    def add(self, value, **labels):
+        self.samples.append(("", labels, value))
+        return self
+
+    def add_histogram(self, histogram: Histogram, **labels):
+        self.samples.extend(histogram_samples(histogram, labels))
+        return self
+
+
+class LabeledHistograms:
+    """A histogram metric owned by the registry, one `Histogram` per label set."""
+
+    def __init__(self, name, help, buckets=None):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._children: dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, Histogram(self.buckets) if self.buckets else Histogram())
+        return child
+
+    def collect(self):
+        family = Family(self.name, "histogram", self.help)
+        for key, child in list(self._children.items()):
+            family.add_histogram(child, **dict(key))
+        return [family]
+
+
+class Registry:
+    """Collectors are callables returning `Family` lists; they run on every scrape."""
+
+    def __init__(self):
+        self._collectors = []
+
+    def register(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def histogram(self, name, help, buckets=None) -> LabeledHistograms:
+        metric = LabeledHistograms(name, help, buckets)
+        self.register(metric.collect)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for collector in self._collectors:
+            for family in collector():
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                for suffix, labels, value in family.samples:
+                    lines.append(f"{family.name}{suffix}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------------------- Model timing ----------------------------
+
+class ModelTimer(BaseCallbackHandler):
+    """Time to first token and total duration of each chat model call, per model."""
+
+    # called on the thread that runs the model, no executor hop
+    run_inline = True
+
+    def __init__(self, registry: Registry):
+        self.ttft = registry.histogram("model_ttft_seconds", "Time from model call to its first streamed token.")
+        self.duration = registry.histogram("model_duration_seconds", "Duration of model calls.")
+        self.tokens = Counter()
+        self.errors = Counter()
+        registry.register(self.collect)
+        # run_id -> [model, start, first token seen]
+        self._runs: dict = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self._runs[run_id] = [model, time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        if token:
+            self.tokens[run[0]] += 1
+        # the first chunk may carry a tool call instead of text; it still ends the wait
+        if not run[2]:
+            run[2] = True
+            self.ttft.labels(model=run[0]).observe(time.perf_counter() - run[1])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.duration.labels(model=run[0]).observe(time.perf_counter() - run[1])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.errors[run[0]] += 1
+
+    def collect(self):
+        tokens = Family("model_stream_tokens_total", "counter", "Streamed model tokens.")
+        errors = Family("model_errors_total", "counter", "Failed model calls.")
+        for model, n in list(self.tokens.items()):
+            tokens.add(n, model=model)
+        for model, n in list(self.errors.items()):
+            errors.add(n, model=model)
+        return [tokens, errors]
+
+
+def telemetry_enabled() -> bool:
+    return os.getenv("TELEMETRY", "on").lower() not in ("0", "off", "false", "no")
+
+
+# ---------------------------- Sampling profiler ----------------------------
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds into folded-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.started = self.stopped = None
+
+    def _run(self):
+        frames = sys._current_frames
+        while not self._stop.wait(self.interval):
+            frame = frames().get(self.thread_id)
+            if frame is not None and frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py"):
+                # the event loop waiting for I/O or timers
+                self.samples["(idle)"] += 1
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+        return self
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+
+class Profiles:
+    """Settings of the per-request profiler and the most recent profiles."""
+
+    def __init__(self, enabled: bool | None = None, interval: float | None = None, keep: int = 20):
+        self.enabled = os.getenv("PROFILER", "off").lower() in ("1", "on", "true", "yes") if enabled is None else enabled
+        self.interval = float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000 if interval is None else interval
+        self.keep = keep
+        self._profiles: OrderedDict[str, SamplingProfiler] = OrderedDict()
+
+    def add(self, profile_id: str, profiler: SamplingProfiler):
+        self._profiles[profile_id] = profiler
+        while len(self._profiles) > self.keep:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str):
+        return self._profiles.get(profile_id)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware: profile requests that send `X-Profile: 1` (see module docstring)."""
+
+    def __init__(self, app, profiles: Profiles):
+        self.app = app
+        self.profiles = profiles
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiles.enabled or scope["type"] != "http" or (b"x-profile", b"1") not in scope["headers"]:
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex[:12]
+        profiler = SamplingProfiler(threading.get_ident(), self.profiles.interval).start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiles.add(profile_id, profiler.stop())
+
+
+# ---------------------------- App collectors ----------------------------
+
+def tool_families(executor):
+    calls = Family("tool_calls_total", "counter", "Tool calls by outcome.")
+    latency = Family("tool_duration_seconds", "histogram", "Tool call latency (timeouts excluded).")
+    for name, stats in list(executor.stats.items()):
+        calls.add(stats.calls - stats.errors, tool=name, outcome="ok")
+        calls.add(stats.errors, tool=name, outcome="error")
+        calls.add(stats.timeouts, tool=name, outcome="timeout")
+        latency.add_histogram(stats.latency, tool=name)
+    prefetch = executor.prefetch_stats()
+    prefetches = Family("tool_prefetches_total", "counter", "Tool calls started while the model was streaming, by outcome.")
+    for outcome in ("started", "used", "discarded"):
+        prefetches.add(prefetch[outcome], outcome=outcome)
+    saved = Family("tool_prefetch_saved_seconds_total", "counter", "Tool time overlapped with model streaming.")
+    return [calls, latency, prefetches, saved.add(prefetch["seconds_saved"])]
+
+
+def scheduler_families(scheduler):
+    stats = scheduler.stats()
+    return [
+        Family("turns_running", "gauge", "Turns running now.").add(stats["running"]),
+        Family("turns_queued", "gauge", "Turns waiting for admission.").add(stats["queued"]),
+        Family("turns_total", "counter", "Turns by admission outcome.")
+        .add(stats["admitted"], outcome="admitted")
+        .add(stats["rejected"], outcome="rejected")
+        .add(stats["timed_out"], outcome="timed_out"),
+        Family("turn_queue_wait_seconds", "histogram", "Time turns waited for admission.").add_histogram(scheduler.wait_times),
+        Family("turn_duration_seconds", "histogram", "Time from admission to release.").add_histogram(scheduler.turn_times),
+    ]
+
+
+def stream_families(metrics):
+    streams = Family("streams_total", "counter", "Finished /chat streams by outcome.")
+    for outcome, n in metrics.as_dict()["streams"].items():
+        streams.add(n, outcome=outcome)
+    return [
+        streams,
+        Family("stream_ttfb_seconds", "histogram", "Time to the first byte of /chat streams.").add_histogram(metrics.ttfb),
+        Family("stream_duration_seconds", "histogram", "Duration of /chat streams.").add_histogram(metrics.duration),
+        # _sum over time is the frame rate: rate(stream_frames_sum[1m])
+        Family("stream_frames", "histogram", "Frames per /chat stream.").add_histogram(metrics.frames),
+        Family("stream_bytes", "histogram", "Bytes per /chat stream.").add_histogram(metrics.bytes),
+    ]
+
+
+def checkpointer_families(checkpointer):
+    families = [
+        Family("checkpoint_read_seconds", "histogram", "Checkpoint read latency.").add_histogram(checkpointer.read_times),
+        Family("checkpoint_commit_seconds", "histogram", "Checkpoint write/commit latency.").add_histogram(checkpointer.commit_times),
+    ]
+    write_bytes = getattr(checkpointer, "write_bytes", None)
+    if write_bytes is not None:
+        families.append(Family("checkpoint_write_bytes", "histogram", "Serialized bytes per checkpoint write.").add_histogram(write_bytes))
+    pool = getattr(checkpointer, "pool", None)
+    if hasattr(pool, "reader_waits"):
+        families.append(
+            Family("checkpoint_pool_wait_seconds", "histogram", "Wait for a checkpoint database connection.")
+            .add_histogram(pool.reader_waits, role="reader")
+            .add_histogram(pool.writer_waits, role="writer")
+        )
+    return families
+
+
+def retention_families(retention):
+    totals = retention.totals
+    return [
+        Family("retention_passes_total", "counter", "Completed retention passes.").add(totals["passes"]),
+        Family("retention_failures_total", "counter", "Retention passes that raised.").add(totals["failures"]),
+        Family("retention_checkpoints_deleted_total", "counter", "Checkpoints deleted by retention.").add(totals["checkpoints_deleted"]),
+        Family("retention_threads_archived_total", "counter", "Threads moved to the cold store.").add(totals["threads_archived"]),
+        Family("retention_threads_restored_total", "counter", "Threads moved back from the cold store.").add(totals["threads_restored"]),
+        Family("retention_bytes_reclaimed_total", "counter", "Checkpoint bytes deleted from the hot database.").add(totals["bytes_reclaimed"]),
+        Family("retention_pages_vacuumed_total", "counter", "Database pages released by incremental vacuum.").add(totals["pages_vacuumed"]),
+        Family("retention_pass_seconds", "histogram", "Duration of a retention pass.").add_histogram(retention.pass_times),
+    ]
+
+
+def prompt_cache_families(stats):
+    totals = stats.as_dict()
+    return [
+        Family("prompt_input_tokens_total", "counter", "Chat model input tokens reported by the provider.").add(totals["input_tokens"]),
+        Family("prompt_cached_tokens_total", "counter", "Input tokens served from the provider's prompt cache.").add(totals["cached_tokens"]),
+        Family("prompt_prefix_changes_total", "counter", "Times the system prompt and tool schemas changed.").add(totals["prefix_changes"]),
+    ]
+
+
+def model_router_families(router):
+    calls = Family("model_calls_total", "counter", "Chat model calls by endpoint and outcome.")
+    breaker = Family("model_breaker_open", "gauge", "1 while the endpoint's circuit breaker is open or half-open.")
+    ttft = Family("model_endpoint_ttft_seconds", "histogram", "Time to first chunk of the calls each endpoint won.")
+    for name, endpoint in router.endpoints.items():
+        calls.add(endpoint.wins, endpoint=name, outcome="won")
+        calls.add(endpoint.errors, endpoint=name, outcome="error")
+        calls.add(endpoint.cancelled, endpoint=name, outcome="cancelled")
+        breaker.add(int(endpoint.breaker.state != "closed"), endpoint=name)
+        ttft.add_histogram(endpoint.ttft, endpoint=name)
+    return [
+        calls,
+        breaker,
+        ttft,
+        Family("model_hedges_total", "counter", "Requests duplicated to the next endpoint after the hedge delay.").add(router.hedges),
+        Family("model_failovers_total", "counter", "Requests retried on the next endpoint after a failure.").add(router.failovers),
+        Family("model_cheap_routes_total", "counter", "Turns routed to the cheap model.").add(router.cheap_routes),
+    ]
+
+
+def batch_families(batches):
+    totals = batches.totals()
+    return [
+        Family("batch_jobs_total", "counter", "Finished batch jobs by outcome.")
+        .add(totals["ok"], outcome="ok")
+        .add(totals["errors"], outcome="error"),
+        Family("batch_retries_total", "counter", "Batch jobs retried after a rate limit.").add(totals["retries"]),
+        Family("batches_running", "gauge", "Batches running now.").add(totals["running"]),
+    ]
@@ -0,0 +1,40 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from checkpoint_serde import CompactSerializer
+
+
+def test_message_changed_between_dumps_round_trips():
+    serde = CompactSerializer(codec="zlib")
+    message = HumanMessage(content="hi")
+    serde.loads_typed(serde.dumps_typed({"messages": [message]}))
+
+    # add_messages assigns the id in place after the input write was serialized
+    message.id = "assigned"
+    message.content = "hi again"
+    loaded = serde.loads_typed(serde.dumps_typed({"messages": [message]}))["messages"][0]
+
+    assert loaded.id == "assigned"
+    assert loaded.content == "hi again"
+
+
+def test_round_trip_keeps_fields():
+    serde = CompactSerializer(codec="zlib")
+    messages = [
+        HumanMessage(content="what is 2+2", id="h1"),
+        AIMessage(content="", id="a1", tool_calls=[{"name": "calculator", "args": {"a": 2, "b": 2}, "id": "c1"}]),
+    ]
+    loaded = serde.loads_typed(serde.dumps_typed({"messages": messages}))["messages"]
+    assert [(m.id, m.content) for m in loaded] == [("h1", "what is 2+2"), ("a1", "")]
+    assert loaded[1].tool_calls[0]["args"] == {"a": 2, "b": 2}
+
+
+def test_nested_change_between_dumps_round_trips():
+    serde = CompactSerializer(codec="zlib")
+    message = AIMessage(content="", id="a1", tool_calls=[{"name": "search", "args": {"q": "old"}, "id": "c1"}])
+    first = serde.dumps_typed({"messages": [message]})
+    assert serde.dumps_typed({"messages": [message]}) == first
+
+    # the memo is keyed on the content, so an in-place change of a nested value misses it
+    message.tool_calls[0]["args"]["q"] = "new"
+    loaded = serde.loads_typed(serde.dumps_typed({"messages": [message]}))["messages"][0]
+    assert loaded.tool_calls[0]["args"] == {"q": "new"}
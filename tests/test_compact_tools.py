@@ -0,0 +1,57 @@
+import sqlite3
+from typing import Annotated, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import StateGraph
+from langgraph.graph.message import add_messages
+
+import message_store
+import thread_catalog
+from checkpoint_serde import CompactSerializer
+
+
+class State(TypedDict):
+    messages: Annotated[list[BaseMessage], add_messages]
+
+
+def write_compact_db(path, threads=2, turns=3):
+    graph = StateGraph(State)
+    graph.add_node("reply", lambda state: {"messages": [AIMessage(content=f"reply {len(state['messages'])}")]})
+    graph.set_entry_point("reply")
+    conn = sqlite3.connect(path, check_same_thread=False)
+    chatbot = graph.compile(checkpointer=SqliteSaver(conn, serde=CompactSerializer(codec="zlib")))
+    for thread in range(threads):
+        for turn in range(turns):
+            chatbot.invoke({"messages": [("user", f"turn {turn}")]}, {"configurable": {"thread_id": f"t{thread}"}})
+    conn.close()
+
+
+def latest_messages(path, thread_id):
+    conn = sqlite3.connect(path)
+    try:
+        state = SqliteSaver(conn, serde=CompactSerializer()).get({"configurable": {"thread_id": thread_id}})
+        return [(m.type, m.content) for m in state["channel_values"]["messages"]]
+    finally:
+        conn.close()
+
+
+def test_catalog_backfill_reads_compact_blobs(tmp_path):
+    path = str(tmp_path / "compact.db")
+    write_compact_db(path)
+    assert sqlite3.connect(path).execute("SELECT DISTINCT type FROM checkpoints").fetchall() == [("compact",)]
+
+    assert thread_catalog.backfill(path) == 2
+    rows = sqlite3.connect(path).execute("SELECT thread_id, message_count FROM thread_catalog ORDER BY thread_id").fetchall()
+    assert rows == [("t0", 6), ("t1", 6)]
+
+
+def test_message_store_migrate_and_inline_read_compact_blobs(tmp_path):
+    path = str(tmp_path / "compact.db")
+    write_compact_db(path)
+    before = latest_messages(path, "t0")
+
+    assert message_store.migrate(path) > 0
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM message_store WHERE thread_id = 't0'").fetchone()[0] == 6
+    assert message_store.inline(path) > 0
+    assert latest_messages(path, "t0") == before
@@ -0,0 +1,20 @@
+from main import conversation_etag, etag_matches
+
+
+def test_if_none_match_list_and_weak_comparison():
+    etag = conversation_etag("cp1", 20, None, {"role"})
+    strong = etag.removeprefix("W/")
+    other = conversation_etag("cp0", 20, None, {"role"})
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(strong, etag)
+    assert etag_matches(f'{other}, {strong}', etag)
+    assert etag_matches(f'{other},{etag}', etag)
+    assert not etag_matches(other, etag)
+    assert not etag_matches(None, etag)
+
+
+def test_if_none_match_star():
+    etag = conversation_etag("cp1", None, None, None)
+    assert etag_matches("*", etag)
+    assert not etag_matches(" * ", etag, exists=False)
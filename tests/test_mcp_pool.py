@@ -0,0 +1,52 @@
+import asyncio
+
+import anyio
+
+from mcp_pool import McpSessionPool
+
+
+class FlakySession:
+    """Fails the first call with `error`, then answers."""
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    async def call_tool(self, name, arguments, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise self.error
+        return "ok"
+
+
+def call_with(error):
+    async def run():
+        server = McpSessionPool({"s": {}}).servers["s"]
+        session = FlakySession(error)
+
+        async def get_session():
+            return session
+
+        server.get_session = get_session
+        try:
+            return await server.call_tool("write_note", {"text": "x"}), session.calls
+        except Exception as e:
+            return e, session.calls
+
+    return asyncio.run(run())
+
+
+def test_retries_when_the_request_was_never_sent():
+    assert call_with(anyio.ClosedResourceError()) == ("ok", 2)
+    assert call_with(anyio.BrokenResourceError()) == ("ok", 2)
+
+
+def test_does_not_retry_after_the_request_was_sent():
+    error, calls = call_with(anyio.EndOfStream())
+    assert isinstance(error, anyio.EndOfStream)
+    assert calls == 1
+
+
+def test_other_errors_are_not_retried():
+    error = ValueError("bad arguments")
+    assert call_with(error) == (error, 1)
@@ -0,0 +1,100 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from sqlite_pool import PooledAsyncSqliteSaver, SqlitePool
+from thread_catalog import UPSERT_SQL
+
+
+def catalog_ids(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [r[0] for r in conn.execute("SELECT thread_id FROM thread_catalog ORDER BY thread_id")]
+    finally:
+        conn.close()
+
+
+def with_saver(path, body, **kwargs):
+    async def run():
+        pool = await SqlitePool(path, readers=1, pragmas={"busy_timeout": 10}).open()
+        saver = PooledAsyncSqliteSaver(pool, **kwargs)
+        await saver.setup()
+        try:
+            await body(saver)
+        finally:
+            saver._buffer = []
+            await saver.aclose()
+
+    asyncio.run(run())
+
+
+def locked(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+
+def row(thread_id):
+    return [(UPSERT_SQL, [(thread_id, "2026-01-01", "2026-01-01", 1)])]
+
+
+def test_batched_flush_keeps_writes_while_locked(tmp_path):
+    path = str(tmp_path / "c.db")
+
+    async def run(saver):
+        await saver._write("t0", row("t0"))
+        lock = locked(path)
+        with pytest.raises(sqlite3.OperationalError):
+            await saver.aflush()
+        lock.rollback()
+        lock.close()
+        await saver.aflush()
+
+    with_saver(path, run, durability="batched", flush_max_retries=2)
+    assert catalog_ids(path) == ["t0"]
+
+
+def test_batched_flush_drops_writes_after_max_retries(tmp_path):
+    path = str(tmp_path / "c.db")
+
+    async def run(saver):
+        await saver._write("t0", row("t0"))
+        lock = locked(path)
+        for _ in range(3):
+            with pytest.raises(sqlite3.OperationalError):
+                await saver.aflush()
+        lock.rollback()
+        lock.close()
+        assert saver._buffer == []
+
+    with_saver(path, run, durability="batched", flush_max_retries=2)
+    assert catalog_ids(path) == []
+
+
+def test_batched_flush_drops_writes_on_other_errors(tmp_path):
+    path = str(tmp_path / "c.db")
+
+    async def run(saver):
+        await saver._write("t0", [("INSERT INTO missing_table VALUES (?)", [("t0",)])])
+        with pytest.raises(sqlite3.OperationalError):
+            await saver.aflush()
+        assert saver._buffer == []
+
+    with_saver(path, run, durability="batched")
+
+
+def test_sync_write_is_dropped_when_it_fails(tmp_path):
+    path = str(tmp_path / "c.db")
+
+    async def run(saver):
+        lock = locked(path)
+        with pytest.raises(sqlite3.OperationalError):
+            await saver._write("t0", row("t0"))
+        lock.rollback()
+        lock.close()
+        assert saver._buffer == []
+        await saver._write("t1", row("t1"))
+
+    with_saver(path, run)
+    assert catalog_ids(path) == ["t1"]
@@ -0,0 +1,64 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import thread_catalog
+from checkpointers import MemoryCheckpointer
+
+
+def catalog_db(threads=6):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(thread_catalog.CATALOG_SCHEMA)
+    for i in range(threads):
+        ts = f"2026-01-01T00:00:0{i}"
+        conn.execute(thread_catalog.UPSERT_SQL, (f"t{i}", ts, ts, 1))
+    return conn
+
+
+def touch(conn, thread_id, ts):
+    conn.execute(thread_catalog.UPSERT_SQL, (thread_id, ts, ts, 2))
+
+
+def ids(threads):
+    return [t["thread_id"] for t in threads]
+
+
+def test_cursor_survives_update_of_its_thread():
+    conn = catalog_db()
+    first, cursor = thread_catalog.list_threads(conn, limit=3)
+    assert ids(first) == ["t5", "t4", "t3"]
+
+    # the cursor thread moves to the top between pages
+    touch(conn, "t3", "2026-01-01T00:00:09")
+    second, cursor = thread_catalog.list_threads(conn, limit=3, after=cursor)
+    assert ids(second) == ["t2", "t1", "t0"]
+
+
+def test_cursor_survives_deletion_of_its_thread():
+    conn = catalog_db()
+    _, cursor = thread_catalog.list_threads(conn, limit=3)
+    conn.execute("DELETE FROM thread_catalog WHERE thread_id = 't3'")
+    second, _ = thread_catalog.list_threads(conn, limit=3, after=cursor)
+    assert ids(second) == ["t2", "t1", "t0"]
+
+
+def test_memory_checkpointer_cursor():
+    saver = MemoryCheckpointer()
+    for i in range(6):
+        ts = f"2026-01-01T00:00:0{i}"
+        saver.catalog[f"t{i}"] = [ts, ts, 1]
+
+    first, cursor = asyncio.run(saver.alist_threads(limit=3))
+    saver.catalog["t3"][1] = "2026-01-01T00:00:09"
+    del saver.catalog["t4"]
+    second, next_cursor = asyncio.run(saver.alist_threads(limit=3, after=cursor))
+    assert ids(first) == ["t5", "t4", "t3"]
+    assert ids(second) == ["t2", "t1", "t0"]
+    assert next_cursor is not None
+    assert asyncio.run(saver.alist_threads(limit=3, after=next_cursor)) == ([], None)
+
+
+def test_malformed_cursor():
+    with pytest.raises(ValueError):
+        thread_catalog.list_threads(catalog_db(), after="t3")
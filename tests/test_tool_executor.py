@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from tool_executor import ToolExecutor, ToolPolicy
+
+
+def slow_tool(seconds):
+    state = {"running": 0, "peak": 0}
+    lock = threading.Lock()
+
+    @tool
+    def slow(q: str) -> str:
+        """Sleeps, then echoes q."""
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(seconds)
+        with lock:
+            state["running"] -= 1
+        return q
+
+    return slow, state
+
+
+def calls(n):
+    return [{"name": "slow", "args": {"q": str(i)}, "id": f"call-{i}", "type": "tool_call"} for i in range(n)]
+
+
+def test_timed_out_sync_call_keeps_its_concurrency_slot():
+    slow, state = slow_tool(0.3)
+    executor = ToolExecutor(default=ToolPolicy(timeout=0.1, max_concurrency=1), prefetch=False)
+
+    async def run():
+        first = await executor.arun({"slow": slow}, [AIMessage(content="", tool_calls=calls(1))])
+        # the first call's thread is still running; the second must wait for it
+        second = await executor.arun({"slow": slow}, [AIMessage(content="", tool_calls=calls(1))])
+        return first["messages"] + second["messages"]
+
+    messages = asyncio.run(run())
+    executor.pool.shutdown(wait=True)
+    assert [m.status for m in messages] == ["error", "error"]
+    assert state["peak"] == 1
+
+
+def test_timeouts_are_recorded_at_the_timeout():
+    slow, _ = slow_tool(0.3)
+    executor = ToolExecutor(default=ToolPolicy(timeout=0.1, max_concurrency=4), prefetch=False)
+    asyncio.run(executor.arun({"slow": slow}, [AIMessage(content="", tool_calls=calls(2))]))
+    executor.run({"slow": slow}, [AIMessage(content="", tool_calls=calls(1))])
+    executor.pool.shutdown(wait=True)
+    stats = executor.stats["slow"].as_dict()
+    assert (stats["calls"], stats["errors"], stats["timeouts"]) == (3, 3, 3)
+    assert stats["latency"]["count"] == 3
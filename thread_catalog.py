@@ -0,0 +1,253 @@
+"""
+Thread catalog kept next to the LangGraph checkpoint tables.
+
+Listing threads used to mean walking every checkpoint with `checkpointer.list(None)`,
+which deserializes every blob in the database. The catalog keeps one row per thread,
+updated on each checkpoint write, so `/threads` only ever touches one page of rows.
+
+Backfill existing databases with:
+
+    python thread_catalog.py chatbot.db new_chatbot.db
+"""
+import base64
+import json
+import os
+import sys
+import sqlite3
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_catalog (
+    thread_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    last_updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_thread_catalog_last_updated
+    ON thread_catalog (last_updated_at, thread_id);
+"""
+
+UPSERT_SQL = """
+INSERT INTO thread_catalog (thread_id, created_at, last_updated_at, message_count)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (thread_id) DO UPDATE SET
+    created_at = MIN(thread_catalog.created_at, excluded.created_at),
+    last_updated_at = MAX(thread_catalog.last_updated_at, excluded.last_updated_at),
+    message_count = CASE
+        WHEN excluded.last_updated_at >= thread_catalog.last_updated_at
+        THEN excluded.message_count
+        ELSE thread_catalog.message_count
+    END
+"""
+
+# Newest first; ties on the timestamp are broken by thread_id so the cursor is total.
+FIRST_PAGE_SQL = """
+SELECT thread_id, created_at, last_updated_at, message_count
+FROM thread_catalog
+ORDER BY last_updated_at DESC, thread_id DESC
+LIMIT ?
+"""
+
+NEXT_PAGE_SQL = """
+SELECT thread_id, created_at, last_updated_at, message_count
+FROM thread_catalog
+WHERE (last_updated_at, thread_id) < (?, ?)
+ORDER BY last_updated_at DESC, thread_id DESC
+LIMIT ?
+"""
+
+
+def catalog_row(config, checkpoint):
+    """
+    Build the catalog upsert parameters for a checkpoint write,
+    or None for subgraph checkpoints (only root threads are listed).
+    """
+    if config["configurable"].get("checkpoint_ns", ""):
+        return None
+
+    messages = checkpoint.get("channel_values", {}).get("messages") or []
+    ts = checkpoint["ts"]
+    return (str(config["configurable"]["thread_id"]), ts, ts, len(messages))
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def encode_cursor(last_updated_at, thread_id):
+    """
+    Opaque cursor for the row (last_updated_at, thread_id). It carries the sort key itself,
+    so the next page is right even if that thread was updated or deleted in between.
+    """
+    raw = json.dumps([last_updated_at, thread_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(last_updated_at, thread_id) of a cursor from `encode_cursor`; ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_updated_at, thread_id = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid thread cursor: {cursor!r}") from e
+    if not isinstance(last_updated_at, str) or not isinstance(thread_id, str):
+        raise ValueError(f"invalid thread cursor: {cursor!r}")
+    return last_updated_at, thread_id
+
+
+def to_page(rows, limit):
+    threads = [
+        {
+            "thread_id": thread_id,
+            "created_at": created_at,
+            "last_updated_at": last_updated_at,
+            "message_count": message_count,
+        }
+        for thread_id, created_at, last_updated_at, message_count in rows
+    ]
+    last = threads[-1] if threads else None
+    next_cursor = encode_cursor(last["last_updated_at"], last["thread_id"]) if len(threads) == limit else None
+    return threads, next_cursor
+
+
+def list_threads(conn: sqlite3.Connection, limit=None, after=None):
+    """
+    Return one page of threads (newest first) and the cursor for the next page.
+    `after` is the cursor returned with the previous page.
+    """
+    limit = clamp_limit(limit)
+    if after is None:
+        rows = conn.execute(FIRST_PAGE_SQL, (limit,)).fetchall()
+    else:
+        rows = conn.execute(NEXT_PAGE_SQL, (*decode_cursor(after), limit)).fetchall()
+    return to_page(rows, limit)
+
+
+async def alist_threads(conn, limit=None, after=None):
+    """Async variant of `list_threads` for an aiosqlite connection."""
+    limit = clamp_limit(limit)
+    if after is None:
+        cur = await conn.execute(FIRST_PAGE_SQL, (limit,))
+    else:
+        cur = await conn.execute(NEXT_PAGE_SQL, (*decode_cursor(after), limit))
+    async with cur:
+        rows = await cur.fetchall()
+    return to_page(rows, limit)
+
+
+# ---------------------------- Checkpointers ----------------------------
+
+class CatalogSqliteSaver(SqliteSaver):
+    """SqliteSaver that keeps `thread_catalog` up to date on every checkpoint write."""
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(CATALOG_SCHEMA)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        row = catalog_row(config, checkpoint)
+        if row is not None:
+            with self.cursor() as cur:
+                cur.execute(UPSERT_SQL, row)
+        return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_catalog WHERE thread_id = ?", (str(thread_id),))
+
+
+class CatalogAsyncSqliteSaver(AsyncSqliteSaver):
+    """AsyncSqliteSaver that keeps `thread_catalog` up to date on every checkpoint write."""
+
+    catalog_ready = False
+
+    async def setup(self) -> None:
+        await super().setup()
+        if self.catalog_ready:
+            return
+        async with self.lock:
+            if not self.catalog_ready:
+                await self.conn.executescript(CATALOG_SCHEMA)
+                await self.conn.commit()
+                self.catalog_ready = True
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        row = catalog_row(config, checkpoint)
+        if row is not None:
+            async with self.lock:
+                await self.conn.execute(UPSERT_SQL, row)
+                await self.conn.commit()
+        return next_config
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM thread_catalog WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+
+# ---------------------------- Backfill ----------------------------
+
+def backfill(path: str, serde=None) -> int:
+    """
+    Rebuild `thread_catalog` for an existing checkpoint database.
+    Only the first and last root checkpoint of each thread are deserialized.
+    Returns the number of threads written.
+    """
+    from checkpoint_serde import serializer_from_env
+
+    # reads stock and compact blobs (see checkpoint_serde.py)
+    serde = serde or serializer_from_env()
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(CATALOG_SCHEMA)
+        bounds = conn.execute(
+            """
+            SELECT thread_id, MIN(checkpoint_id), MAX(checkpoint_id)
+            FROM checkpoints
+            WHERE checkpoint_ns = ''
+            GROUP BY thread_id
+            """
+        ).fetchall()
+
+        def load(thread_id, checkpoint_id):
+            type_, blob = conn.execute(
+                "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id = ?",
+                (thread_id, checkpoint_id),
+            ).fetchone()
+            return serde.loads_typed((type_, blob))
+
+        rows = []
+        for thread_id, first_id, last_id in bounds:
+            first = load(thread_id, first_id)
+            last = first if first_id == last_id else load(thread_id, last_id)
+            messages = last.get("channel_values", {}).get("messages") or []
+            rows.append((thread_id, first["ts"], last["ts"], len(messages)))
+
+        with conn:
+            conn.executemany(UPSERT_SQL, rows)
+        return len(rows)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or ["chatbot.db", "new_chatbot.db"]
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"{path}: not found, skipping")
+            continue
+        print(f"{path}: backfilled {backfill(path)} threads")
@@ -1,12 +1,15 @@
 import streamlit as st
-from langgraph_backend import chatbot
-from langchain_core.messages import HumanMessage
+from frontend_client import cache_ttl, chat_history, frontend_backend
+from turn_scheduler import SchedulerFull
 import uuid
 
+# this graph module in the default "local" mode; FRONTEND_BACKEND=http talks to the
+# FastAPI app and FRONTEND_BACKEND=inprocess shares one async graph (see frontend_client.py)
+backend = frontend_backend("langgraph_backend")
 
 # ---------------------------------------------- UTility functions -----------------------------------------
 def generate_thread():
-    thread_id = uuid.uuid4()
+    thread_id = str(uuid.uuid4())
     return thread_id
 
 def reset_chat():
@@ -19,10 +22,18 @@ def add_thread(thread_id):
     if thread_id not in st.session_state['chat_threads']:
         st.session_state['chat_threads'].append(thread_id)
         
+# cached for every session; a thread's entries are cleared when one of its turns completes
+@st.cache_data(ttl=cache_ttl(), show_spinner=False)
+def retrieve_all_threads():
+    return backend.threads()
+
+@st.cache_data(ttl=cache_ttl(), show_spinner=False)
 def load_conversations(thread_id):
-    if chatbot.get_state(config = {'configurable': {'thread_id': thread_id}}).values:
-        return chatbot.get_state(config = {'configurable': {'thread_id': thread_id}}).values['messages']
-    
+    return chat_history(backend.messages(thread_id))
+
+def turn_completed(thread_id):
+    load_conversations.clear(thread_id)
+    retrieve_all_threads.clear()
     
 
 
@@ -34,6 +45,7 @@ if 'message_history' not in st.session_state:
 if 'thread_id' not in st.session_state:
     st.session_state['thread_id'] = generate_thread()
     
+# threads started in this session; the others come from retrieve_all_threads()
 if 'chat_threads' not in st.session_state:
     st.session_state['chat_threads'] = []
     
@@ -48,21 +60,13 @@ if st.sidebar.button("New Chat"):
     
 st.sidebar.header("Conversations")
 
-for thread_id in st.session_state['chat_threads'][::-1]:
+known_threads = retrieve_all_threads()
+new_threads = [t for t in st.session_state['chat_threads'][::-1] if t not in known_threads]
+
+for thread_id in new_threads + known_threads:
     if st.sidebar.button(str(thread_id)):
         st.session_state['thread_id'] = thread_id
-        messages = load_conversations(thread_id)
-        temp_messages = []
-        if messages:
-            for msg in messages:
-                if isinstance(msg, HumanMessage):
-                    role = 'user'
-                else:
-                    role = 'assistant'
-                
-                temp_messages.append({'role': role, 'content': msg.content})
-        
-        st.session_state['message_history'] = temp_messages
+        st.session_state['message_history'] = load_conversations(thread_id)
     
 # -------------------------------------------------- MAIN UI ---------------------------------------------
  
@@ -78,17 +82,23 @@ if user_input:
     with st.chat_message('user'):
         st.text(user_input)
     
-    CONFIG = {'configurable': {'thread_id': st.session_state['thread_id']}}
+    thread_id = st.session_state['thread_id']
     
+    def ai_stream():
+        # turns are scheduled per thread and capped globally by the backend
+        for event in backend.stream(thread_id, user_input):
+            if event['role'] == 'ai':
+                yield event['content']
+
     with st.chat_message('assistant'):
-        ai_message = st.write_stream(
-            message_chunk.content for message_chunk, metadata in chatbot.stream(
-            {"messages": [HumanMessage(content=user_input)]},
-            config=CONFIG,
-            stream_mode="messages"
-            )
-        )
-    st.session_state['message_history'].append({"role": "assistant", "content": ai_message})
+        try:
+            ai_message = st.write_stream(ai_stream())
+        except SchedulerFull as e:
+            ai_message = None
+            st.warning(f"The assistant is busy right now, please try again in {e.retry_after:.0f} seconds.")
+    if ai_message is not None:
+        st.session_state['message_history'].append({"role": "assistant", "content": ai_message})
+        turn_completed(thread_id)
     
     
     
\ No newline at end of file
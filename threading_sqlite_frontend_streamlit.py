@@ -1,12 +1,15 @@
 import streamlit as st
-from langgraph_sqlit_tools_backened import chatbot, retrieve_all_threads
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from frontend_client import cache_ttl, chat_history, frontend_backend
+from turn_scheduler import SchedulerFull
 import uuid
 
+# this graph module in the default "local" mode; FRONTEND_BACKEND=http talks to the
+# FastAPI app and FRONTEND_BACKEND=inprocess shares one async graph (see frontend_client.py)
+backend = frontend_backend("langgraph_sqlit_tools_backened")
 
 # ---------------------------------------------- UTility functions -----------------------------------------
 def generate_thread():
-    thread_id = uuid.uuid4()
+    thread_id = str(uuid.uuid4())
     return thread_id
 
 def reset_chat():
@@ -19,10 +22,18 @@ def add_thread(thread_id):
     if thread_id not in st.session_state['chat_threads']:
         st.session_state['chat_threads'].append(thread_id)
         
+# cached for every session; a thread's entries are cleared when one of its turns completes
+@st.cache_data(ttl=cache_ttl(), show_spinner=False)
+def retrieve_all_threads():
+    return backend.threads()
+
+@st.cache_data(ttl=cache_ttl(), show_spinner=False)
 def load_conversations(thread_id):
-    if chatbot.get_state(config = {'configurable': {'thread_id': thread_id}}).values:
-        return chatbot.get_state(config = {'configurable': {'thread_id': thread_id}}).values['messages']
-    
+    return chat_history(backend.messages(thread_id))
+
+def turn_completed(thread_id):
+    load_conversations.clear(thread_id)
+    retrieve_all_threads.clear()
     
 
 
@@ -34,8 +45,9 @@ if 'message_history' not in st.session_state:
 if 'thread_id' not in st.session_state:
     st.session_state['thread_id'] = generate_thread()
     
+# threads started in this session; the others come from retrieve_all_threads()
 if 'chat_threads' not in st.session_state:
-    st.session_state['chat_threads'] = retrieve_all_threads()
+    st.session_state['chat_threads'] = []
     
 add_thread(st.session_state['thread_id'])
     
@@ -57,36 +69,14 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-for thread_id in reversed(st.session_state['chat_threads']):
+known_threads = retrieve_all_threads()
+new_threads = [t for t in reversed(st.session_state['chat_threads']) if t not in known_threads]
+
+for thread_id in new_threads + known_threads:
     if st.sidebar.button(str(thread_id)):
         st.session_state['thread_id'] = thread_id
-        messages = load_conversations(thread_id)
-        temp_messages = []
-        if messages:
-            for msg in messages:
-                # ---- 1. Detect and exclude tool calls ----
-                if hasattr(msg, "tool_calls") and msg.tool_calls:
-                    continue
-
-                # For OpenAI/Anthropic style messages
-                if hasattr(msg, "additional_kwargs") and "tool_calls" in msg.additional_kwargs:
-                    continue
-
-                # ---- 2. Detect and exclude tool call results ----
-                if hasattr(msg, "tool_call_id") and msg.tool_call_id:
-                    continue
-
-                if hasattr(msg, "additional_kwargs") and "tool_call_id" in msg.additional_kwargs:
-                    continue
-                
-                if isinstance(msg, HumanMessage):
-                    role = 'user'
-                else:
-                    role = 'assistant'
-                    
-                temp_messages.append({'role': role, 'content': msg.content})
-        
-        st.session_state['message_history'] = temp_messages
+        # tool calls and tool results are left out (see chat_history)
+        st.session_state['message_history'] = load_conversations(thread_id)
     
 # -------------------------------------------------- MAIN UI ---------------------------------------------
  
@@ -102,29 +92,18 @@ if user_input:
     with st.chat_message('user'):
         st.text(user_input)
     
-    CONFIG = {
-        'configurable': {'thread_id': st.session_state['thread_id']},
-        'metadata': {
-            'thread_id': st.session_state['thread_id']
-        },
-        'run_name': 'chat_turn'
-        }
-    
-    
+    thread_id = st.session_state['thread_id']
     
     with st.chat_message("assistant"):
         status_box = {"box": None}
 
         def ai_stream_only():
-            for message_chunk, metadata in chatbot.stream(
-                {"messages": [HumanMessage(content=user_input)]},
-                config=CONFIG,
-                stream_mode="messages"
-            ):
+            # turns are scheduled per thread and capped globally by the backend
+            for event in backend.stream(thread_id, user_input):
 
                 # ---- Tool Events Rendering ----
-                if isinstance(message_chunk, ToolMessage):
-                    tool_name = getattr(message_chunk, "name", "tool")
+                if event['role'] == 'tool':
+                    tool_name = event.get("name", "tool")
                     if status_box['box'] is None:
                         status_box['box'] = st.status(
                             f" Using `{tool_name}` ...", expanded=True
@@ -137,11 +116,15 @@ if user_input:
                         )
 
                 # ---- Stream Assistant Tokens ----
-                if isinstance(message_chunk, AIMessage):
-                    yield message_chunk.content
+                if event['role'] == 'ai':
+                    yield event['content']
 
 
-        ai_message = st.write_stream(ai_stream_only())
+        try:
+            ai_message = st.write_stream(ai_stream_only())
+        except SchedulerFull as e:
+            ai_message = None
+            st.warning(f"The assistant is busy right now, please try again in {e.retry_after:.0f} seconds.")
         
         if status_box['box'] is not None:
             status_box['box'].update(
@@ -151,7 +134,9 @@ if user_input:
             )
     
 
-    st.session_state['message_history'].append({"role": "assistant", "content": ai_message})
+    if ai_message is not None:
+        st.session_state['message_history'].append({"role": "assistant", "content": ai_message})
+        turn_completed(thread_id)
     
     
     
\ No newline at end of file
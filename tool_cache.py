@@ -0,0 +1,220 @@
+"""
+Result cache for tool calls.
+
+Tools opt in declaratively with `cacheable(tool, ttl=..., key=...)`, which records a
+`CachePolicy` in the tool's metadata. `ToolExecutor` looks cacheable calls up in the
+shared `ToolResultCache` before running them; a hit is still returned as a ToolMessage
+(with `response_metadata["cache_hit"]`), so the graph behaves exactly as on a miss.
+Only successful results are stored.
+
+`key` normalizes the call arguments before hashing: `exact_key` (the default) uses the
+arguments as given, `text_key` also ignores case and extra whitespace in strings, so
+"Weather  in Paris" and "weather in paris" share an entry.
+
+Configured from the environment by `tool_cache()`:
+
+    TOOL_CACHE=memory|sqlite|off   (default memory; sqlite is shared across workers and restarts)
+    TOOL_CACHE_DB=tool_cache.db
+    TOOL_CACHE_MAX_ENTRIES=10000
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import ToolMessage
+
+
+_WS = re.compile(r"\s+")
+
+
+def exact_key(args):
+    return args
+
+
+def text_key(args):
+    """Arguments with strings casefolded and whitespace collapsed."""
+    if isinstance(args, str):
+        return _WS.sub(" ", args).strip().casefold()
+    if isinstance(args, dict):
+        return {k: text_key(v) for k, v in args.items()}
+    if isinstance(args, (list, tuple)):
+        return [text_key(v) for v in args]
+    return args
+
+
+class CachePolicy:
+    def __init__(self, ttl: float | None = None, key=exact_key):
+        # ttl=None: never expires (deterministic tools)
+        self.ttl = ttl
+        self.key = key
+
+
+def cacheable(tool, ttl: float | None = None, key=exact_key):
+    """Declare `tool` cacheable for `ttl` seconds (None: forever). Returns the tool."""
+    tool.metadata = {**(tool.metadata or {}), "cache": CachePolicy(ttl, key)}
+    return tool
+
+
+def cache_policy(tool) -> CachePolicy | None:
+    return (tool.metadata or {}).get("cache")
+
+
+# ---------------------------- Stores ----------------------------
+
+class MemoryStore:
+    """In-process LRU of key -> (expires_at, value)."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteStore:
+    """Entries in a local SQLite file, shared by every process that opens it."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tool_cache (
+        key TEXT PRIMARY KEY,
+        expires_at REAL,
+        value TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = "tool_cache.db", max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.executescript("PRAGMA busy_timeout=5000; PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;" + self.SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key, now):
+        with self._lock:
+            row = self.conn.execute("SELECT expires_at, value FROM tool_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[0] is not None and row[0] <= now):
+            return None
+        return json.loads(row[1])
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tool_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(value)),
+            )
+            self._writes += 1
+            if self._writes % 256 == 0:
+                self._prune(time.time())
+
+    def _prune(self, now):
+        self.conn.execute("DELETE FROM tool_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self.conn.execute(
+            "DELETE FROM tool_cache WHERE key NOT IN (SELECT key FROM tool_cache ORDER BY rowid DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0]
+
+
+# ---------------------------- Cache ----------------------------
+
+class ToolResultCache:
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self._counts: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, policy: CachePolicy, args) -> str:
+        normalized = json.dumps([name, policy.key(args)], sort_keys=True, default=str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _count(self, name, hit: bool):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def lookup(self, tool, call) -> ToolMessage | None:
+        """A ToolMessage answering `call` from the cache, or None on a miss."""
+        policy = cache_policy(tool)
+        if policy is None:
+            return None
+        content = self.store.get(self.key(call["name"], policy, call["args"]), time.time())
+        self._count(call["name"], content is not None)
+        if content is None:
+            return None
+        return ToolMessage(
+            content=content,
+            name=call["name"],
+            tool_call_id=call["id"],
+            response_metadata={"cache_hit": True},
+        )
+
+    def save(self, tool, call, message: ToolMessage):
+        policy = cache_policy(tool)
+        if policy is None or message.status == "error":
+            return
+        expires_at = time.time() + policy.ttl if policy.ttl is not None else None
+        self.store.put(self.key(call["name"], policy, call["args"]), message.content, expires_at)
+
+    def stats(self):
+        with self._lock:
+            counts = {name: list(c) for name, c in self._counts.items()}
+        hits = sum(c[0] for c in counts.values())
+        misses = sum(c[1] for c in counts.values())
+        return {
+            "entries": len(self.store),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "tools": {name: {"hits": h, "misses": m} for name, (h, m) in counts.items()},
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def tool_cache() -> ToolResultCache | None:
+    """The process-wide cache, built from the TOOL_CACHE_* environment; None when disabled."""
+    global _shared_cache
+    backend = os.getenv("TOOL_CACHE", "memory").lower()
+    if backend in ("0", "false", "no", "off"):
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            max_entries = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "10000"))
+            if backend == "sqlite":
+                store = SqliteStore(os.getenv("TOOL_CACHE_DB", "tool_cache.db"), max_entries=max_entries)
+            else:
+                store = MemoryStore(max_entries=max_entries)
+            _shared_cache = ToolResultCache(store)
+        return _shared_cache
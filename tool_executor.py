@@ -0,0 +1,386 @@
+"""
+Tool execution node with per-tool timeouts and concurrency limits.
+
+Replaces `ToolNode(tools)`: all tool calls of an AIMessage run concurrently, async tools
+on the event loop and sync tools (e.g. `calculator`, DuckDuckGo search) on a bounded
+thread pool. Each tool has a timeout and a semaphore capping its in-flight calls.
+A call that times out or fails becomes an error ToolMessage, so the model still gets
+the results of the other calls and can answer with what it has.
+
+Policies come from the environment (`TOOL_TIMEOUT`, `TOOL_MAX_CONCURRENCY`,
+`TOOL_THREADS`) and can be overridden per tool name. With a `ToolResultCache`, calls to
+tools declared `cacheable` are answered from the cache when possible (see tool_cache.py).
+
+Read-only tools are also prefetched (`TOOL_PREFETCH`, default on): `astream` streams the
+model's reply and starts each such call as soon as its arguments are complete JSON, while
+the model is still streaming the rest. The tools node then awaits the running call
+instead of starting it; calls the final message doesn't contain (or contains with other
+arguments) are cancelled. A tool is read-only if it is marked with `read_only(tool)`, is
+`cacheable`, or is an MCP tool annotated `readOnlyHint`; mark it `read_only(tool, False)`
+to opt out.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.messages.utils import message_chunk_to_message
+
+from metrics import Histogram
+from tool_cache import ToolResultCache, cache_policy
+
+
+class ToolPolicy:
+    def __init__(self, timeout: float = 30.0, max_concurrency: int = 8):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+
+
+class _ToolStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "latency": self.latency.as_dict(),
+        }
+
+
+def read_only(tool, value: bool = True):
+    """Declare whether `tool` has no side effects, so it may be prefetched. Returns the tool."""
+    tool.metadata = {**(tool.metadata or {}), "prefetch": value}
+    return tool
+
+
+def prefetchable(tool) -> bool:
+    metadata = tool.metadata or {}
+    if "prefetch" in metadata:
+        return bool(metadata["prefetch"])
+    return cache_policy(tool) is not None or metadata.get("readOnlyHint") is True
+
+
+def is_sync_tool(tool) -> bool:
+    """True when the tool (a BaseTool) has no native async implementation."""
+    from langchain_core.tools import BaseTool
+
+    if getattr(tool, "coroutine", None) is not None:
+        return False
+    if getattr(tool, "func", None) is not None:
+        # Tool / StructuredTool without a coroutine: their _arun only runs func in a thread
+        return True
+    return type(tool)._arun is BaseTool._arun
+
+
+class ToolExecutor:
+
+    def __init__(
+        self,
+        default: ToolPolicy | None = None,
+        policies: dict | None = None,
+        threads: int | None = None,
+        cache: ToolResultCache | None = None,
+        prefetch: bool | None = None,
+    ):
+        self.default = default or ToolPolicy(
+            timeout=float(os.getenv("TOOL_TIMEOUT", "30")),
+            max_concurrency=int(os.getenv("TOOL_MAX_CONCURRENCY", "8")),
+        )
+        self.policies = dict(policies or {})
+        self.cache = cache
+        self.prefetch = (
+            os.getenv("TOOL_PREFETCH", "true").lower() in ("1", "true", "yes") if prefetch is None else prefetch
+        )
+        self.pool = ThreadPoolExecutor(
+            max_workers=threads or int(os.getenv("TOOL_THREADS", "16")),
+            thread_name_prefix="tool",
+        )
+        self.stats: dict[str, _ToolStats] = {}
+        self._async_limits: dict[str, asyncio.Semaphore] = {}
+        self._sync_limits: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        # tool call id -> _Prefetch, until the tools node claims it
+        self._prefetched: dict[str, _Prefetch] = {}
+        self.prefetch_counts = {"started": 0, "used": 0, "discarded": 0}
+        self.prefetch_saved = 0.0
+
+    def policy(self, name: str) -> ToolPolicy:
+        return self.policies.get(name, self.default)
+
+    def _stats(self, name):
+        with self._lock:
+            return self.stats.setdefault(name, _ToolStats())
+
+    def _record(self, name, seconds, message):
+        stats = self._stats(name)
+        with self._lock:
+            stats.calls += 1
+            if message.status == "error":
+                stats.errors += 1
+        stats.latency.observe(seconds)
+
+    def _timed_out(self, name, call):
+        stats = self._stats(name)
+        with self._lock:
+            stats.timeouts += 1
+        timeout = self.policy(name).timeout
+        message = ToolMessage(
+            content=f"Tool '{name}' did not answer within {timeout:g}s; no result is available. "
+                    f"Answer with the information you already have.",
+            name=name,
+            tool_call_id=call["id"],
+            status="error",
+        )
+        # counted at the timeout, the latency the caller saw
+        self._record(name, timeout, message)
+        return message
+
+    @staticmethod
+    def _error(name, call, error):
+        return ToolMessage(
+            content=f"Error: {error!r}\n Please fix your mistakes.",
+            name=name,
+            tool_call_id=call["id"],
+            status="error",
+        )
+
+    @staticmethod
+    def _tool_calls(state):
+        messages = state["messages"] if isinstance(state, dict) else state
+        last = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+        return last.tool_calls if last is not None else []
+
+    @staticmethod
+    def _as_message(name, call, result):
+        if isinstance(result, ToolMessage):
+            return result
+        return ToolMessage(content=str(result), name=name, tool_call_id=call["id"])
+
+    # ---------------------------- async ----------------------------
+
+    def _async_limit(self, name):
+        limit = self._async_limits.get(name)
+        if limit is None:
+            limit = self._async_limits[name] = asyncio.Semaphore(self.policy(name).max_concurrency)
+        return limit
+
+    async def _arun_one(self, tools, call, config):
+        name = call["name"]
+        tool = tools.get(name)
+        if tool is None:
+            return self._error(name, call, ValueError(f"{name} is not a valid tool, try one of {sorted(tools)}."))
+        if self.cache is not None:
+            hit = self.cache.lookup(tool, call)
+            if hit is not None:
+                return hit
+
+        start = time.perf_counter()
+        try:
+            if is_sync_tool(tool):
+                # the thread holds the limit, so a timed-out call keeps its slot until it returns
+                work = asyncio.get_running_loop().run_in_executor(self.pool, self._invoke_limited, tool, call, config)
+                result = await asyncio.wait_for(work, self.policy(name).timeout)
+            else:
+                async with self._async_limit(name):
+                    work = tool.ainvoke({**call, "type": "tool_call"}, config)
+                    result = await asyncio.wait_for(work, self.policy(name).timeout)
+            message = self._as_message(name, call, result)
+        except asyncio.TimeoutError:
+            return self._timed_out(name, call)
+        except Exception as e:
+            message = self._error(name, call, e)
+        self._record(name, time.perf_counter() - start, message)
+        if self.cache is not None:
+            self.cache.save(tool, call, message)
+        return message
+
+    async def _arun_claimed(self, tools, call, config):
+        prefetch = self._prefetched.pop(call["id"], None)
+        if prefetch is None:
+            return await self._arun_one(tools, call, config)
+        if not prefetch.matches(call):
+            self._discard(prefetch)
+            return await self._arun_one(tools, call, config)
+        claimed = time.perf_counter()
+        message = await prefetch.task
+        with self._lock:
+            self.prefetch_counts["used"] += 1
+            self.prefetch_saved += min(prefetch.finished or claimed, claimed) - prefetch.started
+        return message
+
+    async def arun(self, tools, state, config=None):
+        calls = self._tool_calls(state)
+        messages = await asyncio.gather(*(self._arun_claimed(tools, call, config) for call in calls))
+        return {"messages": list(messages)}
+
+    # ---------------------------- prefetch ----------------------------
+
+    def _start_prefetch(self, tools, call, config):
+        tool = tools.get(call["name"])
+        if tool is None or call["id"] in self._prefetched or not prefetchable(tool):
+            return None
+        self._expire_prefetches()
+        prefetch = _Prefetch(call, asyncio.ensure_future(self._arun_one(tools, call, config)))
+        self._prefetched[call["id"]] = prefetch
+        with self._lock:
+            self.prefetch_counts["started"] += 1
+        return prefetch
+
+    def _discard(self, prefetch):
+        prefetch.task.cancel()
+        with self._lock:
+            self.prefetch_counts["discarded"] += 1
+
+    def _expire_prefetches(self, max_age: float = 300.0):
+        """Cancel prefetches no tools node claimed (e.g. the run was interrupted)."""
+        now = time.perf_counter()
+        for call_id, prefetch in list(self._prefetched.items()):
+            if now - prefetch.started > max_age:
+                del self._prefetched[call_id]
+                self._discard(prefetch)
+
+    async def astream(self, model, messages, tools, config=None) -> AIMessage:
+        """
+        `model.ainvoke(messages)`, streamed so that read-only tool calls in the reply start
+        running as soon as their arguments are complete. `tools` maps names to tools.
+        """
+        if not self.prefetch:
+            return await model.ainvoke(messages, config)
+        started = {}
+        full = None
+        try:
+            async for chunk in model.astream(messages, config):
+                full = chunk if full is None else full + chunk
+                if not getattr(chunk, "tool_call_chunks", None):
+                    continue
+                # chunks are merged by index, so these are the calls streamed so far
+                for call in _complete_calls(full):
+                    if call["id"] not in started:
+                        started[call["id"]] = self._start_prefetch(tools, call, config)
+        except BaseException:
+            for prefetch in filter(None, started.values()):
+                self._prefetched.pop(prefetch.call["id"], None)
+                self._discard(prefetch)
+            raise
+        message = message_chunk_to_message(full)
+        final = {call["id"]: call for call in getattr(message, "tool_calls", [])}
+        for call_id, prefetch in started.items():
+            if prefetch is not None and not prefetch.matches(final.get(call_id)):
+                self._prefetched.pop(call_id, None)
+                self._discard(prefetch)
+        return message
+
+    # ---------------------------- sync ----------------------------
+
+    def _sync_limit(self, name):
+        with self._lock:
+            limit = self._sync_limits.get(name)
+            if limit is None:
+                limit = self._sync_limits[name] = threading.BoundedSemaphore(self.policy(name).max_concurrency)
+            return limit
+
+    def _invoke_limited(self, tool, call, config):
+        with self._sync_limit(call["name"]):
+            return tool.invoke({**call, "type": "tool_call"}, config)
+
+    def run(self, tools, state, config=None):
+        calls = self._tool_calls(state)
+        started = []
+        for call in calls:
+            tool = tools.get(call["name"])
+            hit = self.cache.lookup(tool, call) if tool is not None and self.cache is not None else None
+            if hit is not None or tool is None:
+                started.append((call, tool, hit, None))
+                continue
+            started.append((call, tool, self.pool.submit(self._invoke_limited, tool, call, config), time.perf_counter()))
+
+        messages = []
+        for call, tool, future, start in started:
+            name = call["name"]
+            if isinstance(future, ToolMessage):
+                messages.append(future)
+                continue
+            if future is None:
+                messages.append(self._error(name, call, ValueError(f"{name} is not a valid tool, try one of {sorted(tools)}.")))
+                continue
+            remaining = self.policy(name).timeout - (time.perf_counter() - start)
+            try:
+                message = self._as_message(name, call, future.result(timeout=max(0.0, remaining)))
+            except FutureTimeout:
+                # the worker thread can't be interrupted; its result is discarded when it finishes
+                future.cancel()
+                messages.append(self._timed_out(name, call))
+                continue
+            except Exception as e:
+                message = self._error(name, call, e)
+            self._record(name, time.perf_counter() - start, message)
+            if self.cache is not None:
+                self.cache.save(tool, call, message)
+            messages.append(message)
+        return {"messages": messages}
+
+    # ---------------------------- graph node ----------------------------
+
+    def node(self, tools):
+        """A graph node (usable from both `invoke` and `ainvoke`) executing `tools`."""
+        from langchain_core.runnables import RunnableLambda
+
+        by_name = {tool.name: tool for tool in tools}
+        return RunnableLambda(
+            lambda state, config: self.run(by_name, state, config),
+            afunc=lambda state, config: self.arun(by_name, state, config),
+            name="tools",
+        )
+
+    def stats_dict(self):
+        with self._lock:
+            items = list(self.stats.items())
+        return {name: stats.as_dict() for name, stats in items}
+
+    def prefetch_stats(self):
+        with self._lock:
+            return {
+                "enabled": self.prefetch,
+                **self.prefetch_counts,
+                "pending": len(self._prefetched),
+                "seconds_saved": self.prefetch_saved,
+            }
+
+
+class _Prefetch:
+    """A tool call started while the model was still streaming its reply."""
+
+    def __init__(self, call, task):
+        self.call = call
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished = None
+        task.add_done_callback(self._done)
+
+    def _done(self, _task):
+        self.finished = time.perf_counter()
+
+    def matches(self, call) -> bool:
+        return call is not None and call["name"] == self.call["name"] and call["args"] == self.call["args"]
+
+
+def _complete_calls(chunk):
+    """Tool calls of a partial AIMessageChunk whose arguments are already complete JSON."""
+    for part in chunk.tool_call_chunks:
+        args = part.get("args") or ""
+        if not part.get("id") or not part.get("name") or not args.rstrip().endswith("}"):
+            continue
+        try:
+            parsed = json.loads(args)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            yield {"name": part["name"], "args": parsed, "id": part["id"]}
@@ -0,0 +1,232 @@
+"""
+Turn scheduling in front of graph execution.
+
+Two concurrent runs on the same thread_id race on the same checkpoint lineage, and
+nothing limited how many runs hit the model at once. `TurnScheduler` admits turns:
+
+- per thread: turns run one at a time, in arrival order (FIFO)
+- globally: at most `max_concurrent` turns run at once. Waiting turns are admitted
+  round-robin across threads, so one busy thread can't starve the others.
+- when `max_queued` turns are already waiting (or a turn waits longer than `timeout`),
+  `SchedulerFull` is raised with a `retry_after` estimate derived from recent turn
+  durations. The FastAPI app turns it into a 429 with a Retry-After header.
+
+The scheduler is thread-safe and serves both async callers (`async with
+scheduler.aturn(thread_id)`, used by main.py) and sync ones (`with
+scheduler.turn(thread_id)`, used by the "local" mode of the Streamlit frontends, which
+runs each session on its own thread; see frontend_client.py). `turn_scheduler()` returns the process-wide instance, configured by:
+
+    MAX_CONCURRENT_TURNS=16
+    MAX_QUEUED_TURNS=64
+    TURN_QUEUE_TIMEOUT=60   seconds a turn may wait for admission
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import Histogram
+
+
+class SchedulerFull(Exception):
+    def __init__(self, retry_after: float, reason: str = "too many queued turns"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted (or waiting) turn. `release()` is idempotent."""
+
+    __slots__ = ("scheduler", "thread_id", "enqueued_at", "admitted_at", "_wake", "_released")
+
+    def __init__(self, scheduler, thread_id, wake):
+        self.scheduler = scheduler
+        self.thread_id = thread_id
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at = None
+        self._wake = wake
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self)
+
+
+class TurnScheduler:
+
+    def __init__(self, max_concurrent: int = 16, max_queued: int = 64, timeout: float | None = 60.0):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # thread_id -> FIFO of waiting tickets; dict order is the round-robin order
+        self._waiting: OrderedDict[str, deque] = OrderedDict()
+        self._queued = 0
+        self._running: set[str] = set()
+        self._avg_turn = 5.0
+        self.wait_times = Histogram()
+        self.turn_times = Histogram()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_depth = 0
+
+    # ---------------------------- core ----------------------------
+
+    def _retry_after(self) -> float:
+        # seconds until the queue ahead of a new turn has drained, at the current turn rate
+        rounds = math.ceil((self._queued + 1) / self.max_concurrent)
+        return max(1.0, round(rounds * self._avg_turn, 1))
+
+    def _enqueue(self, thread_id, wake) -> Ticket:
+        with self._lock:
+            ticket = Ticket(self, thread_id, wake)
+            self._waiting.setdefault(thread_id, deque()).append(ticket)
+            self._queued += 1
+            woken = self._dispatch()
+            if ticket.admitted_at is None and self._queued > self.max_queued:
+                self._withdraw(ticket)
+                self.rejected += 1
+                raise SchedulerFull(self._retry_after())
+            self.max_depth = max(self.max_depth, self._queued)
+        for t in woken:
+            t._wake()
+        return ticket
+
+    def _dispatch(self):
+        """Admit waiting turns while there is capacity. Caller holds the lock; returns tickets to wake."""
+        woken = []
+        while len(self._running) < self.max_concurrent:
+            thread_id = next((tid for tid in self._waiting if tid not in self._running), None)
+            if thread_id is None:
+                break
+            queue = self._waiting.pop(thread_id)
+            ticket = queue.popleft()
+            if queue:
+                # back of the round-robin order
+                self._waiting[thread_id] = queue
+            self._queued -= 1
+            self._running.add(thread_id)
+            ticket.admitted_at = time.perf_counter()
+            self.admitted += 1
+            self.wait_times.observe(ticket.admitted_at - ticket.enqueued_at)
+            woken.append(ticket)
+        return woken
+
+    def _withdraw(self, ticket: Ticket):
+        """Remove a waiting ticket from its thread's queue. Caller holds the lock."""
+        queue = self._waiting[ticket.thread_id]
+        queue.remove(ticket)
+        self._queued -= 1
+        if not queue:
+            del self._waiting[ticket.thread_id]
+
+    def _release(self, ticket: Ticket):
+        with self._lock:
+            if ticket.admitted_at is None:
+                # gave up while waiting
+                self._withdraw(ticket)
+                woken = []
+            else:
+                self._running.discard(ticket.thread_id)
+                duration = time.perf_counter() - ticket.admitted_at
+                self.turn_times.observe(duration)
+                self._avg_turn = 0.8 * self._avg_turn + 0.2 * duration
+                woken = self._dispatch()
+        for t in woken:
+            t._wake()
+
+    def _give_up(self, ticket):
+        """Withdraw a turn whose wait timed out; returns if it was admitted in the meantime."""
+        with self._lock:
+            if ticket.admitted_at is not None:
+                return
+            ticket._released = True
+            self._withdraw(ticket)
+            self.timed_out += 1
+            retry_after = self._retry_after()
+        raise SchedulerFull(retry_after, "timed out waiting for a turn slot")
+
+    # ---------------------------- async ----------------------------
+
+    async def acquire(self, thread_id: str) -> Ticket:
+        """Wait until the turn may run. The caller must `release()` the returned ticket."""
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        ticket = self._enqueue(str(thread_id), wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(admitted), self.timeout)
+        except asyncio.TimeoutError:
+            self._give_up(ticket)
+        except BaseException:
+            ticket.release()
+            raise
+        return ticket
+
+    @asynccontextmanager
+    async def aturn(self, thread_id: str):
+        ticket = await self.acquire(thread_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    # ---------------------------- sync ----------------------------
+
+    def acquire_sync(self, thread_id: str) -> Ticket:
+        event = threading.Event()
+        ticket = self._enqueue(str(thread_id), event.set)
+        if not event.wait(self.timeout):
+            self._give_up(ticket)
+        return ticket
+
+    @contextmanager
+    def turn(self, thread_id: str):
+        ticket = self.acquire_sync(thread_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    # ---------------------------- metrics ----------------------------
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": len(self._running),
+                "queued": self._queued,
+                "queued_threads": len(self._waiting),
+                "max_queue_depth": self.max_depth,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_turn_seconds": round(self._avg_turn, 3),
+                "wait": self.wait_times.as_dict(),
+                "turn": self.turn_times.as_dict(),
+            }
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def turn_scheduler() -> TurnScheduler:
+    """The process-wide scheduler, built from the environment on first use."""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            timeout = float(os.getenv("TURN_QUEUE_TIMEOUT", "60"))
+            _shared_scheduler = TurnScheduler(
+                max_concurrent=int(os.getenv("MAX_CONCURRENT_TURNS", "16")),
+                max_queued=int(os.getenv("MAX_QUEUED_TURNS", "64")),
+                timeout=timeout if timeout > 0 else None,
+            )
+        return _shared_scheduler